@@ -1,4 +1,5 @@
 from __future__ import division
+import time
 from itertools import islice
 from array import array as pyarray
 import numpy
@@ -144,20 +145,173 @@ def solve_tsp(distances, optim_steps=3, pairs_by_dist=pairs_by_dist):
 
 
 def pairs_by_dist_np(N, distances):
-    pairs = numpy.zeros((N * (N - 1) // 2,), dtype=("f4, i2, i2"))
+    # condensed distance matrix (upper triangle) sorted by distance
+    distances = numpy.asarray(distances, dtype=float)
+    i, j = numpy.triu_indices(N, 1)
+    order = numpy.argsort(distances[i, j].astype("f4"), kind="stable")
+    pairs = numpy.zeros((i.size,), dtype=("i4, i4"))
+    pairs["f0"] = i[order]
+    pairs["f1"] = j[order]
+    return pairs
+
+
+def greedy_path_np(distances, pairs_by_dist=pairs_by_dist_np, neighbors=8):
+    """Greedy matching of the shortest edges into a path (as in solve_tsp).
+    Edges to the nearest neighbors of each vertex are joined first,
+    the remaining fragments are joined by the shortest edges
+    between their ends (sorted by pairs_by_dist).
+    Returns list of vertex indices."""
+    N = len(distances)
+    if N < 3:
+        return list(xrange(N))
+    k = min(neighbors, N - 1)
+    others = distances + numpy.diag(numpy.full(N, numpy.inf))
+    nearest = numpy.argpartition(others, k - 1, axis=1)[:, :k]
+    i = numpy.repeat(numpy.arange(N), k)
+    j = nearest.ravel()
+    candidates = numpy.unique(numpy.minimum(i, j) * N + numpy.maximum(i, j))
+    i, j = numpy.divmod(candidates, N)
+    order = numpy.argsort(distances[i, j], kind="stable")
+    valency = [2] * N
+    parent = list(xrange(N))
+    connections = [[] for each in xrange(N)]
+
+    def root(v):
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    def join(pairs):
+        joined = 0
+        for a, b in pairs:
+            if not valency[a] or not valency[b]:
+                continue
+            ra, rb = root(a), root(b)
+            if ra == rb:
+                continue
+            parent[ra] = rb
+            valency[a] -= 1
+            valency[b] -= 1
+            connections[a].append(b)
+            connections[b].append(a)
+            joined += 1
+        return joined
+
+    joined = join(zip(i[order].tolist(), j[order].tolist()))
+    if joined < N - 1:
+        ends = numpy.flatnonzero(numpy.array(valency) > 0)
+        pairs = pairs_by_dist(len(ends), distances[numpy.ix_(ends, ends)])
+        join(
+            zip(
+                ends[pairs[pairs.dtype.names[0]]].tolist(),
+                ends[pairs[pairs.dtype.names[1]]].tolist(),
+            )
+        )
+    return restore_path(connections)
 
-    idx = 0
-    for i in xrange(N):
-        row_size = N - i - 1
-        dist_i = distances[i]
-        pairs[idx : (idx + row_size)] = [(dist_i[j], i, j) for j in xrange(i + 1, N)]
-        idx += row_size
-    pairs.sort(order=["f0"])  # sort by the first field
-    return pairs[["f1", "f2"]]
+
+def two_opt_np(distances, path, deadline=None):
+    """One pass of 2-opt over path (array of vertex indices, changed in place).
+    For each edge (a, a+1), the best exchange with all following edges
+    is found at once and applied by reversing the path between them.
+    Endpoints of the path don't move. Returns number of improvements."""
+    N = len(path)
+    optimizations = 0
+    for a in xrange(N - 3):
+        if deadline and time.perf_counter() > deadline:
+            break
+        b = a + 1
+        c = numpy.arange(b + 1, N - 1)
+        delta = (
+            distances[path[a], path[b]]
+            + distances[path[c], path[c + 1]]
+            - distances[path[a], path[c]]
+            - distances[path[b], path[c + 1]]
+        )
+        best = numpy.argmax(delta)
+        if delta[best] > 1e-9:
+            c = c[best]
+            path[b : c + 1] = path[b : c + 1][::-1]
+            optimizations += 1
+    return optimizations
 
 
-def solve_tsp_numpy(distances, optim_steps=3, pairs_by_dist=pairs_by_dist_np):
+def or_opt_np(distances, path, deadline=None, segment=3):
+    """One pass of Or-opt over path (array of vertex indices, changed in place).
+    Segments of 1 to segment vertices are moved (possibly reversed)
+    to the best edge between other vertices. Endpoints of the path
+    don't move. Returns number of improvements."""
+    N = len(path)
+    optimizations = 0
+    for length in xrange(1, segment + 1):
+        i = 1
+        while i + length < N:
+            if deadline and time.perf_counter() > deadline:
+                return optimizations
+            first, last = path[i], path[i + length - 1]
+            prev, next = path[i - 1], path[i + length]
+            removed = (
+                distances[prev, first] + distances[last, next] - distances[prev, next]
+            )
+            # edges (j, j+1) not touching the segment
+            j = numpy.concatenate(
+                (numpy.arange(0, i - 1), numpy.arange(i + length, N - 1))
+            )
+            start, end = path[j], path[j + 1]
+            edge = distances[start, end]
+            forward = distances[start, first] + distances[last, end] - edge
+            backward = distances[start, last] + distances[first, end] - edge
+            inserted = numpy.minimum(forward, backward)
+            best = numpy.argmin(inserted) if j.size else None
+            if best is None or removed - inserted[best] <= 1e-9:
+                i += 1
+                continue
+            moved = path[i : i + length].copy()
+            if backward[best] < forward[best]:
+                moved = moved[::-1]
+            rest = numpy.concatenate((path[:i], path[i + length :]))
+            position = j[best] + 1 if j[best] < i else j[best] + 1 - length
+            path[:] = numpy.concatenate((rest[:position], moved, rest[position:]))
+            optimizations += 1
+    return optimizations
+
+
+def solve_tsp_numpy(
+    distances,
+    optim_steps=3,
+    pairs_by_dist=pairs_by_dist_np,
+    or_opt=False,
+    time_budget=None,
+    closed=False,
+):
     """Given a distance matrix, finds a solution for the TSP problem.
     Returns list of vertex indices.
-    Version that uses Numpy - consumes less memory and works faster."""
-    return solve_tsp(distances, optim_steps=optim_steps, pairs_by_dist=pairs_by_dist_np)
+    Version that uses Numpy - consumes less memory and works faster.
+    Greedy solution (see greedy_path_np) is optimized with array-based 2-opt (and Or-opt
+    if or_opt is True) passes until there is no improvement, optim_steps
+    passes are done or time_budget (seconds, including the greedy
+    solution) is exhausted.
+    If closed is True, the path is optimized as a tour returning
+    to the first vertex."""
+    start = time.perf_counter()
+    distances = numpy.asarray(distances, dtype=float)
+    if len(distances) and distances.shape != (len(distances), len(distances)):
+        raise ValueError("Matrix is not square")
+    path = greedy_path_np(distances, pairs_by_dist)
+    if closed and path:
+        # tour is a path starting and ending in the same vertex
+        path.append(path[0])
+    if len(path) < 4:
+        return path[:-1] if closed and path else path
+    deadline = start + time_budget if time_budget else None
+    path = numpy.array(path)
+    for passn in xrange(optim_steps):
+        nopt = two_opt_np(distances, path, deadline)
+        if or_opt:
+            nopt += or_opt_np(distances, path, deadline)
+        if nopt == 0 or (deadline and time.perf_counter() > deadline):
+            break
+    if closed:
+        path = path[:-1]
+    return path.tolist()
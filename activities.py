@@ -10,16 +10,14 @@ This program is free software under the GNU General Public License
 import os
 import datetime
 import json
-import traceback
 import wx
 import wx.lib.newevent
 import wx.lib.filebrowsebutton as filebrowse
 from wx.lib.wordwrap import wordwrap
 
-from grass.exceptions import CalledModuleError, ScriptError
 from grass.pydispatch.signal import Signal
 
-from tangible_utils import get_environment, load_source
+from tangible_utils import get_environment, load_analyses
 
 try:
     from activities_profile import ProfileFrame
@@ -249,18 +247,10 @@ class ActivitiesPanel(wx.Panel):
                 win.SetAcceleratorTable(accel_tbl)
 
     def CustomAction(self, eventName):
-        env = get_environment(rast=self.settings["output"]["scan"])  # noqa: F841
-        myanalyses, functions = self._reloadAnalysisFile(funcPrefix=eventName)
-
-        for func in functions:
-            try:
-                exec(
-                    "myanalyses."
-                    + func
-                    + "(eventHandler=wx.GetTopLevelParent(self), env=env)"
-                )
-            except (CalledModuleError, Exception, ScriptError):
-                print(traceback.print_exc())
+        env = get_environment(rast=self.settings["output"]["scan"])
+        loaded = self._reloadAnalysisFile()
+        if loaded:
+            loaded.dispatch(eventName, eventHandler=wx.GetTopLevelParent(self), env=env)
 
     def OnNextTask(self, event):
         if self.timer.IsRunning():
@@ -777,43 +767,24 @@ class ActivitiesPanel(wx.Panel):
     def PostProcessing(self, onDone=None):
         wx.BeginBusyCursor()
         wx.SafeYield()
-        env = get_environment(rast=self.settings["output"]["scan"])  # noqa: F841
-        try:
-            postprocess = load_source(
-                "postprocess",
-                os.path.join(self._getTaskDir(), self.tasks[self.current]["analyses"]),
-            )
-        except Exception as e:
-            print(e)
-            return
-
-        functions = [func for func in dir(postprocess) if func.startswith("post_")]
-        for func in functions:
-            exec("del postprocess." + func)
+        env = get_environment(rast=self.settings["output"]["scan"])
         try:
-            postprocess = load_source(
-                "postprocess",
-                os.path.join(self._getTaskDir(), self.tasks[self.current]["analyses"]),
+            loaded = load_analyses(
+                os.path.join(self._getTaskDir(), self.tasks[self.current]["analyses"])
             )
         except Exception as e:
             print(e)
             return
-        functions = [func for func in dir(postprocess) if func.startswith("post_")]
-        for func in functions:
-            try:
-                exec(
-                    "postprocess."
-                    + func
-                    + "(real_elev=self.settings['scan']['elevation'],"
-                    " scanned_elev=self.settings['output']['scan'],"
-                    " filterResults=self.scaniface.filter['counter'],"
-                    " timeToFinish=self.endTime,"
-                    " subTask=self.currentSubtask,"
-                    " logDir=self.configuration['logDir'],"
-                    " env=env)"
-                )
-            except (CalledModuleError, Exception, ScriptError) as e:
-                traceback.print_exc()
+        loaded.dispatch(
+            "post_",
+            real_elev=self.settings["scan"]["elevation"],
+            scanned_elev=self.settings["output"]["scan"],
+            filterResults=self.scaniface.filter["counter"],
+            timeToFinish=self.endTime,
+            subTask=self.currentSubtask,
+            logDir=self.configuration.get("logDir"),
+            env=env,
+        )
         wx.EndBusyCursor()
         if self.handsoff and not self.IsStandalone():
             ll = self.giface.GetLayerList()
@@ -1026,20 +997,11 @@ class ActivitiesPanel(wx.Panel):
         self.scaniface.resume_once = True
         self.scaniface.changedInput = True
 
-    def _reloadAnalysisFile(self, funcPrefix):
+    def _reloadAnalysisFile(self):
         analysesFile = os.path.join(
             self._getTaskDir(), self.configuration["tasks"][self.current]["analyses"]
         )
         try:
-            myanalyses = load_source("myanalyses", analysesFile)
-        except Exception:
-            return None
-        functions = [func for func in dir(myanalyses) if func.startswith(funcPrefix)]
-        for func in functions:
-            exec("del myanalyses." + func)
-        try:
-            myanalyses = load_source("myanalyses", analysesFile)
+            return load_analyses(analysesFile)
         except Exception:
             return None
-        functions = [func for func in dir(myanalyses) if func.startswith(funcPrefix)]
-        return myanalyses, functions
@@ -7,21 +7,339 @@ This program is free software under the GNU General Public License
 
 @author: Anna Petrasova (akratoc@ncsu.edu)
 """
+import hashlib
+import heapq
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from math import sqrt
 
+import numpy as np
+
 from grass.script import core as gcore
 from grass.script import raster as grast
 from grass.script import vector as gvect
 from grass.exceptions import CalledModuleError
 
-from tangible_utils import remove_vector
+import TSP
+import cost_cache
+import grass_session
+from scratch import scratch_space
+from tangible_utils import (
+    remove_vector,
+    read_raster_header,
+    region_from_header,
+    read_raster_array,
+    write_raster_array,
+    parse_region,
+    mask_stamp,
+)
+
+# errors of NumPy engine after which GRASS modules are used instead
+ENGINE_ERRORS = (IOError, KeyError, ValueError, CalledModuleError)
+
+
+def _regression(x, y):
+    """Linear regression y = a + b * x of cells where both x and y are not null,
+    same as r.regression.line"""
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = x[valid].astype(np.float64)
+    y = y[valid].astype(np.float64)
+    n = x.size
+    sumX = x.sum()
+    sumY = y.sum()
+    b = (n * np.dot(x, y) - sumX * sumY) / (n * np.dot(x, x) - sumX * sumX)
+    a = (sumY - b * sumX) / n
+    return a, b
+
+
+def _resample_bilinear(name, env):
+    """Reads raster in its own resolution and resamples it
+    to the computational region with bilinear interpolation
+    (same as r.resamp.interp method=bilinear)"""
+    header = read_raster_header(name)
+    sourceEnv = env.copy()
+    sourceEnv["GRASS_REGION"] = region_from_header(header)
+    source = read_raster_array(name, env=sourceEnv)
+    region = parse_region(env["GRASS_REGION"])
+    # cell centers of region in source array coordinates
+    cols = (
+        region["west"]
+        + (np.arange(region["cols"]) + 0.5) * region["e-w resol"]
+        - header["west"]
+    ) / header["e-w resol"] - 0.5
+    rows = (
+        header["north"]
+        - region["north"]
+        + (np.arange(region["rows"]) + 0.5) * region["n-s resol"]
+    ) / header["n-s resol"] - 0.5
+    cols = np.clip(cols, 0, source.shape[1] - 1)
+    rows = np.clip(rows, 0, source.shape[0] - 1)
+    col0 = np.minimum(np.floor(cols).astype(int), source.shape[1] - 2).clip(0)
+    row0 = np.minimum(np.floor(rows).astype(int), source.shape[0] - 2).clip(0)
+    col1 = np.minimum(col0 + 1, source.shape[1] - 1)
+    row1 = np.minimum(row0 + 1, source.shape[0] - 1)
+    u = (cols - col0)[np.newaxis, :]
+    t = (rows - row0)[:, np.newaxis]
+    r0 = row0[:, np.newaxis]
+    r1 = row1[:, np.newaxis]
+    return (
+        (1 - t) * (1 - u) * source[r0, col0]
+        + (1 - t) * u * source[r0, col1]
+        + t * (1 - u) * source[r1, col0]
+        + t * u * source[r1, col1]
+    )
+
+
+def _label_clumps(mask):
+    """Labels 4-connected clumps of True cells (same as r.clump)
+    using vectorized union-find (hooking to the smaller root
+    and full path compression in each round).
+
+    @return array of clump labels (0..n-1, -1 outside of mask), number of clumps
+    """
+    rows, cols = mask.shape
+    cells = np.flatnonzero(mask)
+    index = np.full(rows * cols, -1, dtype=np.int64)
+    index[cells] = np.arange(cells.size)
+    index = index.reshape(rows, cols)
+    # pairs of neighboring cells in mask
+    horizontal = mask[:, :-1] & mask[:, 1:]
+    vertical = mask[:-1, :] & mask[1:, :]
+    u = np.concatenate((index[:, :-1][horizontal], index[:-1, :][vertical]))
+    v = np.concatenate((index[:, 1:][horizontal], index[1:, :][vertical]))
+    parent = np.arange(cells.size)
+    while True:
+        pu = parent[u]
+        pv = parent[v]
+        changed = pu != pv
+        if not changed.any():
+            break
+        low = np.minimum(pu[changed], pv[changed])
+        high = np.maximum(pu[changed], pv[changed])
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    roots, labels = np.unique(parent, return_inverse=True)
+    result = np.full((rows, cols), -1, dtype=np.int64)
+    result[mask] = labels
+    return result, roots.size
+
+
+def _fill_depressions(dem):
+    """Fills depressions so that each cell drains (8-connected) to the edge
+    of the region or to a null cell using priority-flood.
+    Cells which drain along a straight line (their lowest spill level
+    on lines to the edge is their elevation) keep their elevation,
+    the rest is flooded in order of elevation from the cells around it.
+
+    @param dem 2D array with nulls as NaN
+    @return filled 2D array
+    """
+    valid = np.isfinite(dem)
+    low = np.pad(np.where(valid, dem, -np.inf), 1, constant_values=-np.inf)
+    upper = np.minimum(
+        np.minimum(
+            np.maximum.accumulate(low, axis=0),
+            np.maximum.accumulate(low[::-1], axis=0)[::-1],
+        ),
+        np.minimum(
+            np.maximum.accumulate(low, axis=1),
+            np.maximum.accumulate(low[:, ::-1], axis=1)[:, ::-1],
+        ),
+    )
+    flooded = (upper > low) & (low > -np.inf)
+    filled = low.copy()
+    if flooded.any():
+        # cells next to flooded cells are where flooding starts
+        near = flooded.copy()
+        near[1:, :] |= flooded[:-1, :]
+        near[:-1, :] |= flooded[1:, :]
+        grown = near.copy()
+        grown[:, 1:] |= near[:, :-1]
+        grown[:, :-1] |= near[:, 1:]
+        cols = low.shape[1]
+        levels = low.ravel().tolist()
+        done = bytearray((~flooded).ravel().tolist())
+        start = np.flatnonzero(grown & ~flooded)
+        heap = list(zip(low.ravel()[start].tolist(), start.tolist()))
+        heapq.heapify(heap)
+        offsets = (-cols - 1, -cols, -cols + 1, -1, 1, cols - 1, cols, cols + 1)
+        while heap:
+            level, cell = heapq.heappop(heap)
+            for offset in offsets:
+                neighbor = cell + offset
+                if done[neighbor]:
+                    continue
+                done[neighbor] = 1
+                if levels[neighbor] < level:
+                    levels[neighbor] = level
+                heapq.heappush(heap, (levels[neighbor], neighbor))
+        filled = np.array(levels).reshape(low.shape)
+    filled = filled[1:-1, 1:-1]
+    filled[~valid] = np.nan
+    return filled
+
+
+# outputs of analyses using DirtyRegion by name:
+# (index of the scan, digest of parameters, analyses and settings)
+_computed = {}
+
+
+def _provenance(dirty, params):
+    """Returns digest of analysis parameters together with the key
+    of the scan (digest of analyses file and settings)"""
+    return hashlib.sha1(repr((params, dirty.key)).encode()).hexdigest()
+
+
+def _computed_since(outputs, dirty, params):
+    """Checks that all outputs were computed with params
+    for the scan the DirtyRegion is computed against"""
+    if dirty is None or dirty.since is None:
+        return False
+    stamp = (dirty.since, _provenance(dirty, params))
+    return all(_computed.get(name) == stamp for name in outputs)
+
+
+def _mark_computed(outputs, dirty, params):
+    """Records outputs as computed for the scan of the DirtyRegion,
+    forgets them when there is no DirtyRegion"""
+    for name in outputs:
+        if dirty is None or dirty.index is None:
+            _computed.pop(name, None)
+        else:
+            _computed[name] = (dirty.index, _provenance(dirty, params))
+
+
+# splicing costs full region r.mapcalc, r.colors and g.rename,
+# it is used only when the dirty window is at most this part of the region
+_SPLICE_MAX_FRACTION = 0.5
+
+
+def _update_dirty(
+    outputs, dirty, radius, compute, env, params, categories=False, splice=True
+):
+    """Computes outputs of a local operator, skipped when the scan didn't change
+    and the outputs were computed with the same params (and analyses
+    and settings) for the scan the DirtyRegion is computed against.
+    With splice, the operator is run in the dirty window enlarged
+    by 2 * radius cells and results in the window enlarged by radius
+    are spliced into the existing outputs. Splicing pays off
+    only for expensive operators (large radius) and small windows.
+
+    @param outputs names of output rasters
+    @param dirty DirtyRegion (from 'dirty' keyword argument)
+    @param radius number of neighboring cells the operator uses
+    @param compute function(outputs, env) running the operator
+    with the given output names and environment
+    @param params parameters of the analysis (including its name)
+    @param categories copy categories of outputs
+    @param splice update only the dirty window, otherwise the outputs
+    are computed in the full region when the scan changed
+    """
+    partial = _dirty_window(outputs, dirty, params, env)
+    if partial and (not splice or not _small_window(dirty, radius)):
+        partial = None
+    # outputs interrupted by an error or cancel are computed again in full
+    _mark_computed(outputs, None, params)
+    if partial is None:
+        compute(outputs, env)
+    elif partial:
+        _splice(outputs, dirty, radius, compute, env, categories)
+    _mark_computed(outputs, dirty, params)
+
+
+def _small_window(dirty, radius):
+    window = dirty.window(2 * radius)
+    cells = dirty.header["rows"] * dirty.header["cols"]
+    return window["rows"] * window["cols"] <= _SPLICE_MAX_FRACTION * cells
+
+
+def _dirty_window(outputs, dirty, params, env):
+    """Returns True if outputs need to be updated in the dirty window,
+    False if they are up to date, None if they need to be computed
+    in the full region"""
+    if dirty is None or dirty.full or not env or "GRASS_REGION" not in env:
+        return None
+    if not _computed_since(outputs, dirty, params):
+        return None
+    if not dirty.matches(parse_region(env["GRASS_REGION"])):
+        return None
+    for name in outputs:
+        try:
+            if not dirty.matches(read_raster_header(name)):
+                return None
+        except (IOError, KeyError, ValueError):
+            return None
+    return not dirty.empty
+
+
+def _splice(outputs, dirty, radius, compute, env, categories):
+    windowEnv = env.copy()
+    windowEnv["GRASS_REGION"] = dirty.region(2 * radius)
+    with scratch_space(env) as scratch:
+        windows = [scratch.raster("window") for name in outputs]
+        # spliced maps replace outputs
+        spliced = [scratch.raster("spliced", current=True) for name in outputs]
+        compute(windows, scratch.environ(windowEnv))
+        bounds = dirty.window(radius)
+        inside = "x() > {w} && x() < {e} && y() > {s} && y() < {n}".format(
+            n=bounds["north"], s=bounds["south"], e=bounds["east"], w=bounds["west"]
+        )
+        grast.mapcalc(
+            "\n".join(
+                "{new} = if({inside}, {window}, {old})".format(
+                    new=new, inside=inside, window=scratch.qualified(window), old=old
+                )
+                for new, window, old in zip(spliced, windows, outputs)
+            ),
+            env=env,
+        )
+        for new, old in zip(spliced, outputs):
+            grass_session.run_command("r.colors", map=new, raster=old, env=env)
+            if categories:
+                gcore.run_command("r.category", map=new, raster=old, env=env)
+            grass_session.run_command("g.rename", raster=[new, old], env=env)
+
+
+def _use_numpy(engine, env):
+    """NumPy engine needs region given by environment"""
+    return engine == "numpy" and env is not None and "GRASS_REGION" in env
+
+
+def _stddev_color_rules(std1, zexag):
+    std2 = zexag * 2 * std1
+    std3 = zexag * 3 * std1
+    return [
+        f"-1000000 black",
+        f"-{std3} black",
+        f"-{std2} 202:000:032",
+        f"-{std1} 244:165:130",
+        "0 247:247:247",
+        f"{std1} 146:197:222",
+        f"{std2} 5:113:176",
+        f"{std3} black",
+        f"1000000 black",
+    ]
 
 
-def difference_scaled(real_elev, scanned_elev, new, env):
+def difference_scaled(real_elev, scanned_elev, new, env, engine="numpy"):
     """!Computes difference of original and scanned (scan - orig).
-    Uses regression for automatic scaling"""
+    Uses regression for automatic scaling.
+    Engine 'numpy' computes it in memory, 'grass' with GRASS modules"""
+    if _use_numpy(engine, env):
+        try:
+            scan = read_raster_array(scanned_elev, env=env)
+            real = read_raster_array(real_elev, env=env)
+            a, b = _regression(scan, real)
+            write_raster_array(a + b * scan - real, new, env=env)
+            grass_session.run_command("r.colors", map=new, color="differences", env=env)
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
     regression = "regression"
     regression_params = gcore.parse_command(
         "r.regression.line", flags="g", mapx=scanned_elev, mapy=real_elev, env=env
@@ -43,36 +361,57 @@ def difference_scaled(real_elev, scanned_elev, new, env):
         ),
         env=env,
     )
-    gcore.run_command("r.colors", map=new, color="differences", env=env)
+    grass_session.run_command("r.colors", map=new, color="differences", env=env)
 
 
-def difference(real_elev, scanned_elev, new, zexag=1, env=None):
-    """Compute difference and set color table using standard deviations"""
-    tmp = "tmp_resampled"
-    gcore.run_command(
-        "r.resamp.interp", input=real_elev, output=tmp, method="bilinear", env=env
-    )
-    grast.mapcalc(f"{new} = {tmp} - {scanned_elev}", env=env)
+def difference(real_elev, scanned_elev, new, zexag=1, env=None, engine="numpy"):
+    """Compute difference and set color table using standard deviations.
+    Engine 'numpy' computes it in memory, 'grass' with GRASS modules"""
+    if _use_numpy(engine, env):
+        try:
+            scan = read_raster_array(scanned_elev, env=env)
+            resampled = _resample_bilinear(real_elev, env)
+            std1 = zexag * float(np.nanstd(read_raster_array(real_elev, env=env)))
+            write_raster_array(resampled - scan, new, env=env)
+            grass_session.write_command(
+                "r.colors",
+                map=new,
+                rules="-",
+                stdin="\n".join(_stddev_color_rules(std1, zexag)),
+                env=env,
+            )
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
+    with scratch_space(env) as scratch:
+        tmp = scratch.raster("resampled")
+        gcore.run_command(
+            "r.resamp.interp",
+            input=real_elev,
+            output=tmp,
+            method="bilinear",
+            env=scratch.environ(env),
+        )
+        grast.mapcalc(f"{new} = {scratch.qualified(tmp)} - {scanned_elev}", env=env)
     univar = gcore.parse_command("r.univar", flags="g", map=real_elev, env=env)
     std1 = zexag * float(univar["stddev"])
-    std2 = zexag * 2 * std1
-    std3 = zexag * 3 * std1
-    rules = [
-        f"-1000000 black",
-        f"-{std3} black",
-        f"-{std2} 202:000:032",
-        f"-{std1} 244:165:130",
-        "0 247:247:247",
-        f"{std1} 146:197:222",
-        f"{std2} 5:113:176",
-        f"{std3} black",
-        f"1000000 black",
-    ]
-    gcore.write_command("r.colors", map=new, rules="-", stdin="\n".join(rules), env=env)
+    rules = _stddev_color_rules(std1, zexag)
+    grass_session.write_command(
+        "r.colors", map=new, rules="-", stdin="\n".join(rules), env=env
+    )
 
 
-def match_scan(base, scan, matched, env):
-    """Vertically match scan to base using linear regression"""
+def match_scan(base, scan, matched, env, engine="numpy"):
+    """Vertically match scan to base using linear regression.
+    Engine 'numpy' computes it in memory, 'grass' with GRASS modules"""
+    if _use_numpy(engine, env):
+        try:
+            scanArray = read_raster_array(scan, env=env)
+            a, b = _regression(scanArray, read_raster_array(base, env=env))
+            write_raster_array(a + b * scanArray, matched, env=env)
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
     coeff = gcore.parse_command(
         "r.regression.line", mapx=scan, mapy=base, flags="g", env=env
     )
@@ -85,18 +424,24 @@ def match_scan(base, scan, matched, env):
 
 
 def rlake(scanned_elev, new, base, env, seed, level, **kwargs):
-    suffix = str(uuid.uuid4()).replace("-", "")[:5]
-    match = "tmp_match" + suffix
     params = {}
     if isinstance(seed, list):
         params["coordinates"] = ",".join(str(each) for each in seed)
     else:
         params["seed"] = seed
-    match_scan(base=base, scan=scanned_elev, matched=match, env=env)
-    gcore.run_command(
-        "r.lake", elevation=match, water_level=level, lake=new, env=env, **params
-    )
-    gcore.run_command("g.remove", flags="f", type="raster", name=[match])
+    with scratch_space(env) as scratch:
+        match = scratch.raster("match")
+        match_scan(
+            base=base, scan=scanned_elev, matched=match, env=scratch.environ(env)
+        )
+        gcore.run_command(
+            "r.lake",
+            elevation=scratch.qualified(match),
+            water_level=level,
+            lake=new,
+            env=env,
+            **params,
+        )
 
 
 def flowacc(scanned_elev, new, env):
@@ -117,22 +462,42 @@ def aspect(scanned_elev, new, env):
     )
 
 
-def slope_aspect(scanned_elev, slope, aspect, env):
-    gcore.run_command(
-        "r.slope.aspect", elevation=scanned_elev, aspect=aspect, slope=slope, env=env
-    )
-    gcore.run_command("r.colors", map=aspect, color="aspectcolr", env=env)
+def slope_aspect(scanned_elev, slope, aspect, env, dirty=None):
+    """Computes slope and aspect, with dirty (DirtyRegion)
+    only when the scan changed"""
 
+    def compute(outputs, env):
+        gcore.run_command(
+            "r.slope.aspect",
+            elevation=scanned_elev,
+            slope=outputs[0],
+            aspect=outputs[1],
+            env=env,
+        )
+        grass_session.run_command(
+            "r.colors", map=outputs[1], color="aspectcolr", env=env
+        )
 
-def shaded_relief(scanned_elev, new, zscale=10, env=None):
-    gcore.run_command(
-        "r.shaded.relief",
-        overwrite=True,
-        input=scanned_elev,
-        output=new,
-        zscale=zscale,
-        env=env,
-    )
+    params = ("slope_aspect", scanned_elev)
+    _update_dirty([slope, aspect], dirty, 1, compute, env, params, splice=False)
+
+
+def shaded_relief(scanned_elev, new, zscale=10, env=None, dirty=None):
+    """Computes shaded relief, with dirty (DirtyRegion)
+    only when the scan changed"""
+
+    def compute(outputs, env):
+        gcore.run_command(
+            "r.shaded.relief",
+            overwrite=True,
+            input=scanned_elev,
+            output=outputs[0],
+            zscale=zscale,
+            env=env,
+        )
+
+    params = ("shaded_relief", scanned_elev, zscale)
+    _update_dirty([new], dirty, 1, compute, env, params, splice=False)
 
 
 def simwe(
@@ -146,44 +511,40 @@ def simwe(
     man_value=None,
     env=None,
 ):
-    suffix = str(uuid.uuid4()).replace("-", "")[:5]
     options = {}
     if slope:
         options["slope"] = slope
     if aspect:
         options["aspect"] = aspect
-    gcore.run_command(
-        "r.slope.aspect",
-        elevation=scanned_elev,
-        dx="dx_" + suffix,
-        dy="dy" + suffix,
-        env=env,
-        **options,
-    )
-    simwe_options = {}
-    if man:
-        simwe_options["man"] = man
-    elif man_value:
-        simwe_options["man_value"] = man_value
-    gcore.run_command(
-        "r.sim.water",
-        elevation=scanned_elev,
-        dx="dx_" + suffix,
-        dy="dy" + suffix,
-        rain_value=rain_value,
-        depth=depth,
-        nwalkers=10000,
-        niterations=niterations,
-        env=env,
-        **simwe_options,
-    )
-    gcore.run_command(
-        "g.remove",
-        flags="f",
-        type="raster",
-        name=["dx_" + suffix, "dy" + suffix],
-        env=env,
-    )
+    with scratch_space(env) as scratch:
+        # slope and aspect outputs are written together with dx, dy
+        dx = scratch.raster("dx", current=bool(options))
+        dy = scratch.raster("dy", current=bool(options))
+        gcore.run_command(
+            "r.slope.aspect",
+            elevation=scanned_elev,
+            dx=dx,
+            dy=dy,
+            env=env if options else scratch.environ(env),
+            **options,
+        )
+        simwe_options = {}
+        if man:
+            simwe_options["man"] = man
+        elif man_value:
+            simwe_options["man_value"] = man_value
+        gcore.run_command(
+            "r.sim.water",
+            elevation=scanned_elev,
+            dx=scratch.qualified(dx),
+            dy=scratch.qualified(dy),
+            rain_value=rain_value,
+            depth=depth,
+            nwalkers=10000,
+            niterations=niterations,
+            env=env,
+            **simwe_options,
+        )
 
 
 def erosion(
@@ -202,113 +563,127 @@ def erosion(
     man_value=None,
     env=None,
 ):
-    suffix = str(uuid.uuid4()).replace("-", "")[:5]
     options = {}
     if slope:
         options["slope"] = slope
     if aspect:
         options["aspect"] = aspect
-    dc, tc, tau = "dc" + suffix, "tc" + suffix, "tau" + suffix
     simwe_options = {}
     if man:
         simwe_options["man"] = man
     elif man_value:
         simwe_options["man_value"] = man_value
-    gcore.run_command(
-        "r.slope.aspect",
-        elevation=scanned_elev,
-        dx="dx_" + suffix,
-        dy="dy" + suffix,
-        overwrite=True,
-        env=env,
-        **options,
-    )
-    gcore.run_command(
-        "r.sim.water",
-        elevation=scanned_elev,
-        dx="dx_" + suffix,
-        dy="dy" + suffix,
-        rain_value=rain_value,
-        depth=depth,
-        nwalkers=10000,
-        niterations=niterations,
-        overwrite=True,
-        env=env,
-        **simwe_options,
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{dc} = {detachment_coeff}".format(
-            dc=dc, detachment_coeff=detachment_coeff
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{tc} = {transport_coeff}".format(
-            tc=tc, transport_coeff=transport_coeff
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{tau} = {shear_stress}".format(tau=tau, shear_stress=shear_stress),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.sim.sediment",
-        elevation=scanned_elev,
-        dx="dx_" + suffix,
-        dy="dy" + suffix,
-        water_depth=depth,
-        detachment_coeff=dc,
-        transport_coeff=tc,
-        shear_stress=tau,
-        sediment_flux=sediment_flux,
-        erosion_deposition=erosion_deposition,
-        niterations=niterations,
-        nwalkers=10000,
-        overwrite=True,
-        env=env,
-        **simwe_options,
-    )
-    gcore.run_command(
-        "g.remove",
-        flags="f",
-        type="raster",
-        name=[dc, tc, tau, "dx_" + suffix, "dy" + suffix],
-        env=env,
-    )
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        dc, tc, tau = scratch.raster("dc"), scratch.raster("tc"), scratch.raster("tau")
+        # slope and aspect outputs are written together with dx, dy
+        dx = scratch.raster("dx", current=bool(options))
+        dy = scratch.raster("dy", current=bool(options))
+        gcore.run_command(
+            "r.slope.aspect",
+            elevation=scanned_elev,
+            dx=dx,
+            dy=dy,
+            overwrite=True,
+            env=env if options else scratchEnv,
+            **options,
+        )
+        dx, dy = scratch.qualified(dx), scratch.qualified(dy)
+        gcore.run_command(
+            "r.sim.water",
+            elevation=scanned_elev,
+            dx=dx,
+            dy=dy,
+            rain_value=rain_value,
+            depth=depth,
+            nwalkers=10000,
+            niterations=niterations,
+            overwrite=True,
+            env=env,
+            **simwe_options,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{dc} = {detachment_coeff}".format(
+                dc=dc, detachment_coeff=detachment_coeff
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{tc} = {transport_coeff}".format(
+                tc=tc, transport_coeff=transport_coeff
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{tau} = {shear_stress}".format(
+                tau=tau, shear_stress=shear_stress
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.sim.sediment",
+            elevation=scanned_elev,
+            dx=dx,
+            dy=dy,
+            water_depth=depth,
+            detachment_coeff=scratch.qualified(dc),
+            transport_coeff=scratch.qualified(tc),
+            shear_stress=scratch.qualified(tau),
+            sediment_flux=sediment_flux,
+            erosion_deposition=erosion_deposition,
+            niterations=niterations,
+            nwalkers=10000,
+            overwrite=True,
+            env=env,
+            **simwe_options,
+        )
 
 
-def max_curv(scanned_elev, new, size=15, zscale=5, env=None):
-    gcore.run_command(
-        "r.param.scale",
-        overwrite=True,
-        input=scanned_elev,
-        output=new,
-        size=size,
-        param="maxic",
-        zscale=zscale,
-        env=env,
-    )
-    gcore.run_command("r.colors", map=new, color="byr", env=env)
+def max_curv(scanned_elev, new, size=15, zscale=5, env=None, dirty=None):
+    """Computes maximum curvature, with dirty (DirtyRegion)
+    only where the scan changed"""
 
+    def compute(outputs, env):
+        gcore.run_command(
+            "r.param.scale",
+            overwrite=True,
+            input=scanned_elev,
+            output=outputs[0],
+            size=size,
+            param="maxic",
+            zscale=zscale,
+            env=env,
+        )
+        grass_session.run_command("r.colors", map=outputs[0], color="byr", env=env)
 
-def landform(scanned_elev, new, size=25, zscale=1, env=None):
-    gcore.run_command(
-        "r.param.scale",
-        overwrite=True,
-        input=scanned_elev,
-        output=new,
-        size=size,
-        param="feature",
-        zscale=zscale,
-        env=env,
-    )
+    params = ("max_curv", scanned_elev, size, zscale)
+    _update_dirty([new], dirty, size // 2, compute, env, params)
+
+
+def landform(scanned_elev, new, size=25, zscale=1, env=None, dirty=None):
+    """Computes landforms, with dirty (DirtyRegion)
+    only where the scan changed"""
+
+    def compute(outputs, env):
+        gcore.run_command(
+            "r.param.scale",
+            overwrite=True,
+            input=scanned_elev,
+            output=outputs[0],
+            size=size,
+            param="feature",
+            zscale=zscale,
+            env=env,
+        )
+
+    params = ("landform", scanned_elev, size, zscale)
+    _update_dirty([new], dirty, size // 2, compute, env, params, categories=True)
 
 
 def geomorphon(scanned_elev, new, search=22, skip=12, flat=1, dist=0, env=None):
@@ -326,100 +701,135 @@ def geomorphon(scanned_elev, new, search=22, skip=12, flat=1, dist=0, env=None):
 
 def usped(scanned_elev, k_factor, c_factor, flowacc, slope, aspect, new, env):
     """!Computes net erosion and deposition (USPED model)"""
-    suffix = str(uuid.uuid4()).replace("-", "")[:5]
-    sedflow = "sedflow_" + suffix
-    qsx = "qsx_" + suffix
-    qsxdx = "qsxdx_" + suffix
-    qsy = "qsy_" + suffix
-    qsydy = "qsydy_" + suffix
-    slope_sm = "slope_sm" + suffix
-    gcore.run_command(
-        "r.neighbors", overwrite=True, input=slope, output=slope_sm, size=5, env=env
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{sedflow} = 270. * {k_factor} * {c_factor} * {flowacc} * sin({slope})".format(
-            c_factor=c_factor,
-            k_factor=k_factor,
-            slope=slope_sm,
-            flowacc=flowacc,
-            sedflow=sedflow,
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{qsx} = {sedflow} * cos({aspect})".format(
-            sedflow=sedflow, aspect=aspect, qsx=qsx
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{qsy} = {sedflow} * sin({aspect})".format(
-            sedflow=sedflow, aspect=aspect, qsy=qsy
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.run_command(
-        "r.slope.aspect", elevation=qsx, dx=qsxdx, overwrite=True, env=env
-    )
-    gcore.run_command(
-        "r.slope.aspect", elevation=qsy, dy=qsydy, overwrite=True, env=env
-    )
-    gcore.run_command(
-        "r.mapcalc",
-        expression="{erdep} = {qsxdx} + {qsydy}".format(
-            erdep=new, qsxdx=qsxdx, qsydy=qsydy
-        ),
-        overwrite=True,
-        env=env,
-    )
-    gcore.write_command(
-        "r.colors",
-        map=new,
-        rules="-",
-        stdin="-15000 100 0 100\n-100 magenta\n-10 red\n-1 orange\n-0.1 yellow\n0 200 255 200\n0.1 cyan\n1 aqua\n10 blue\n100 0 0 100\n18000 black",
-        env=env,
-    )
-
-    gcore.run_command(
-        "g.remove",
-        flags="f",
-        type="raster",
-        name=[sedflow, qsx, qsxdx, qsy, qsydy, slope_sm],
-    )
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        sedflow = scratch.raster("sedflow")
+        qsx = scratch.raster("qsx")
+        qsxdx = scratch.raster("qsxdx")
+        qsy = scratch.raster("qsy")
+        qsydy = scratch.raster("qsydy")
+        slope_sm = scratch.raster("slope_sm")
+        gcore.run_command(
+            "r.neighbors",
+            overwrite=True,
+            input=slope,
+            output=slope_sm,
+            size=5,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{sedflow} = 270. * {k_factor} * {c_factor} * {flowacc} * sin({slope})".format(
+                c_factor=c_factor,
+                k_factor=k_factor,
+                slope=slope_sm,
+                flowacc=flowacc,
+                sedflow=sedflow,
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{qsx} = {sedflow} * cos({aspect})".format(
+                sedflow=sedflow, aspect=aspect, qsx=qsx
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{qsy} = {sedflow} * sin({aspect})".format(
+                sedflow=sedflow, aspect=aspect, qsy=qsy
+            ),
+            overwrite=True,
+            env=scratchEnv,
+        )
+        gcore.run_command(
+            "r.slope.aspect", elevation=qsx, dx=qsxdx, overwrite=True, env=scratchEnv
+        )
+        gcore.run_command(
+            "r.slope.aspect", elevation=qsy, dy=qsydy, overwrite=True, env=scratchEnv
+        )
+        gcore.run_command(
+            "r.mapcalc",
+            expression="{erdep} = {qsxdx} + {qsydy}".format(
+                erdep=new,
+                qsxdx=scratch.qualified(qsxdx),
+                qsydy=scratch.qualified(qsydy),
+            ),
+            overwrite=True,
+            env=env,
+        )
+        grass_session.write_command(
+            "r.colors",
+            map=new,
+            rules="-",
+            stdin="-15000 100 0 100\n-100 magenta\n-10 red\n-1 orange\n-0.1 yellow\n0 200 255 200\n0.1 cyan\n1 aqua\n10 blue\n100 0 0 100\n18000 black",
+            env=env,
+        )
 
 
-def depression(scanned_elev, new, env, filter_depth=0, repeat=2):
-    """Run r.fill.dir to compute depressions"""
-    suffix = str(uuid.uuid4()).replace("-", "")[:5]
+def depression(scanned_elev, new, env, filter_depth=0, repeat=2, engine="numpy"):
+    """Computes depressions deeper than filter_depth.
+    Engine 'numpy' fills them completely in memory with priority-flood,
+    which is what repeated r.fill.dir passes converge to, so any repeat
+    of at least 1 gives the same result (0 fills nothing),
+    'grass' runs r.fill.dir repeat times"""
+    if _use_numpy(engine, env):
+        try:
+            scan = read_raster_array(scanned_elev, env=env)
+            with np.errstate(invalid="ignore"):
+                filled = _fill_depressions(scan) if repeat else scan
+                depth = filled - scan
+                depth[~(depth > filter_depth)] = np.nan
+            write_raster_array(depth, new, env=env)
+            grass_session.write_command(
+                "r.colors", map=new, rules="-", stdin="0% aqua\n100% blue", env=env
+            )
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
     input_dem = scanned_elev
-    output = "tmp_filldir" + suffix
-    tmp_dir = "tmp_dir" + suffix
-    for i in range(repeat):
-        gcore.run_command(
-            "r.fill.dir", input=input_dem, output=output, direction=tmp_dir, env=env
+    with scratch_space(env) as scratch:
+        output = scratch.raster("filldir")
+        tmp_dir = scratch.raster("dir")
+        for i in range(repeat):
+            gcore.run_command(
+                "r.fill.dir",
+                input=input_dem,
+                output=output,
+                direction=tmp_dir,
+                env=scratch.environ(env),
+            )
+            input_dem = output
+        grast.mapcalc(
+            "{new} = if({out} - {scan} > {depth}, {out} - {scan}, null())".format(
+                new=new,
+                out=scratch.qualified(output),
+                scan=scanned_elev,
+                depth=filter_depth,
+            ),
+            env=env,
+        )
+        grass_session.write_command(
+            "r.colors", map=new, rules="-", stdin="0% aqua\n100% blue", env=env
         )
-        input_dem = output
-    grast.mapcalc(
-        "{new} = if({out} - {scan} > {depth}, {out} - {scan}, null())".format(
-            new=new, out=output, scan=scanned_elev, depth=filter_depth
-        ),
-        env=env,
-    )
-    gcore.write_command(
-        "r.colors", map=new, rules="-", stdin="0% aqua\n100% blue", env=env
-    )
-    gcore.run_command(
-        "g.remove", flags="f", type="raster", name=[output, tmp_dir], env=env
-    )
 
 
-def contours(scanned_elev, new, env, maxlevel=None, step=None):
+def contours(scanned_elev, new, env, maxlevel=None, step=None, dirty=None):
+    """Computes contours, skipped when dirty (DirtyRegion) is empty
+    and contours were computed with the same parameters for the previous scan"""
+    params = ("contours", scanned_elev, maxlevel, step)
+    if (
+        dirty is not None
+        and dirty.empty
+        and _computed_since([new], dirty, params)
+        and gcore.find_file(new, element="vector")["name"]
+    ):
+        _mark_computed([new], dirty, params)
+        return
+    _mark_computed([new], None, params)
     name = "x" + str(uuid.uuid4()).replace("-", "")
     if not step:
         info = grast.raster_info(scanned_elev)
@@ -445,11 +855,14 @@ def contours(scanned_elev, new, env, maxlevel=None, step=None):
                 env=env,
             )
         gcore.run_command("g.rename", vector=[name, new], env=env)
+        _mark_computed([new], dirty, params)
     except Exception as e:
         # catching exception when a vector is added to GUI in the same time
         pass
     except CalledModuleError as e:
-        gcore.run_command("g.remove", flags="f", type="vector", name=[name], env=env)
+        grass_session.run_command(
+            "g.remove", flags="f", type="vector", name=[name], env=env
+        )
         remove_vector(new, deleteTable=False)
         print(e)
 
@@ -459,47 +872,43 @@ def change_detection_area(
 ):
     """Detects change in area. Result are areas with value
     equals the max difference between the scans as a positive value."""
-    slope = "slope_tmp_get_change"
-    before_after_regression = "before_after_regression_tmp"
-
-    # slope is used to filter areas of change with high slope (edge of model)
-    gcore.run_command("r.slope.aspect", elevation=before, slope=slope, env=env)
-    if add:
-        after, before = before, after
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        slope = scratch.raster("slope")
+        before_after_regression = scratch.raster("regression")
 
-    # regression
-    reg_params = gcore.parse_command(
-        "r.regression.line", flags="g", mapx=before, mapy=after, env=env
-    )
-    grast.mapcalc(
-        exp="{before_after_regression} = {a} + {b} * {before}".format(
-            a=reg_params["a"],
-            b=reg_params["b"],
-            before=before,
-            before_after_regression=before_after_regression,
-        ),
-        env=env,
-    )
+        # slope is used to filter areas of change with high slope (edge of model)
+        gcore.run_command(
+            "r.slope.aspect", elevation=before, slope=slope, env=scratchEnv
+        )
+        if add:
+            after, before = before, after
 
-    grast.mapcalc(
-        exp="{change} = if({slope} < {filter_slope_threshold} && {before_after_regression} - {after} > {min_z_diff}, {before_after_regression} - {after}, null())".format(
-            change=change,
-            slope=slope,
-            filter_slope_threshold=filter_slope_threshold,
-            before_after_regression=before_after_regression,
-            after=after,
-            min_z_diff=height_threshold,
-        ),
-        env=env,
-    )
+        # regression
+        reg_params = gcore.parse_command(
+            "r.regression.line", flags="g", mapx=before, mapy=after, env=env
+        )
+        grast.mapcalc(
+            exp="{before_after_regression} = {a} + {b} * {before}".format(
+                a=reg_params["a"],
+                b=reg_params["b"],
+                before=before,
+                before_after_regression=before_after_regression,
+            ),
+            env=scratchEnv,
+        )
 
-    gcore.run_command(
-        "g.remove",
-        type="raster",
-        name=["slope_tmp_get_change", "before_after_regression_tmp"],
-        flags="f",
-        env=env,
-    )
+        grast.mapcalc(
+            exp="{change} = if({slope} < {filter_slope_threshold} && {before_after_regression} - {after} > {min_z_diff}, {before_after_regression} - {after}, null())".format(
+                change=change,
+                slope=scratch.qualified(slope),
+                filter_slope_threshold=filter_slope_threshold,
+                before_after_regression=scratch.qualified(before_after_regression),
+                after=after,
+                min_z_diff=height_threshold,
+            ),
+            env=env,
+        )
 
 
 def change_detection(
@@ -512,32 +921,51 @@ def change_detection(
     max_detected,
     debug,
     env,
+    engine="numpy",
 ):
-    diff_thr = "diff_thr_" + str(uuid.uuid4()).replace("-", "")
-    diff_thr_clump = "diff_thr_clump_" + str(uuid.uuid4()).replace("-", "")
+    """Detects blobs added to (add=True) or removed from the scan and writes
+    them as raster and their centroids as points (with attributes
+    of r.volume), both named change, difference is written as raster diff.
+    Blobs are 4-connected areas where difference from regression
+    of before and after is within height_threshold
+    and number of cells is within cells_threshold.
+    Engine 'numpy' computes it in memory, 'grass' with GRASS modules"""
+    if _use_numpy(engine, env):
+        try:
+            _change_detection_numpy(
+                before,
+                after,
+                change,
+                height_threshold,
+                cells_threshold,
+                add,
+                max_detected,
+                debug,
+                env,
+            )
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
     coeff = gcore.parse_command(
         "r.regression.line", mapx=after, mapy=before, flags="g", env=env
     )
-    grast.mapcalc(
-        "diff = {a} + {b} * {after} - {before}".format(
-            a=coeff["a"], b=coeff["b"], before=before, after=after
-        ),
-        env=env,
+    regression = "({a} + {b} * {after} - {before})".format(
+        a=coeff["a"], b=coeff["b"], before=before, after=after
     )
-    try:
+    grast.mapcalc("diff = {}".format(regression), env=env)
+    with scratch_space(env) as scratch:
+        diff_thr = scratch.raster("diff_thr")
+        diff_thr_clump = scratch.raster("diff_thr_clump")
+        scratchEnv = scratch.environ(env)
         if add:
             grast.mapcalc(
-                "{diff_thr} = if(({a} + {b} * {after} - {before}) > {thr1} &&"
-                " ({a} + {b} * {after} - {before}) < {thr2}, 1, null())".format(
-                    a=coeff["a"],
-                    b=coeff["b"],
+                "{diff_thr} = if({diff} > {thr1} && {diff} < {thr2}, 1, null())".format(
                     diff_thr=diff_thr,
-                    after=after,
-                    before=before,
+                    diff=regression,
                     thr1=height_threshold[0],
                     thr2=height_threshold[1],
                 ),
-                env=env,
+                env=scratchEnv,
             )
         else:
             grast.mapcalc(
@@ -549,13 +977,15 @@ def change_detection(
                     before=before,
                     thr=height_threshold,
                 ),
-                env=env,
+                env=scratchEnv,
             )
 
-        gcore.run_command("r.clump", input=diff_thr, output=diff_thr_clump, env=env)
+        gcore.run_command(
+            "r.clump", input=diff_thr, output=diff_thr_clump, env=scratchEnv
+        )
         stats = (
             gcore.read_command(
-                "r.stats", flags="cn", input=diff_thr_clump, sort="desc", env=env
+                "r.stats", flags="cn", input=diff_thr_clump, sort="desc", env=scratchEnv
             )
             .strip()
             .splitlines()
@@ -579,7 +1009,7 @@ def change_detection(
                 rules = ["{c}:{c}:1".format(c=c) for c in cats]
                 gcore.write_command(
                     "r.recode",
-                    input=diff_thr_clump,
+                    input=scratch.qualified(diff_thr_clump),
                     output=change,
                     rules="-",
                     stdin="\n".join(rules),
@@ -589,32 +1019,97 @@ def change_detection(
                     "r.volume",
                     flags="f",
                     input=change,
-                    clump=diff_thr_clump,
+                    clump=scratch.qualified(diff_thr_clump),
                     centroids=change,
                     env=env,
                 )
             else:
                 gcore.warning("No change found!")
-                gcore.run_command("v.edit", map=change, tool="create", env=env)
+                grass_session.run_command("v.edit", map=change, tool="create", env=env)
         else:
             gcore.warning("No change found!")
-            gcore.run_command("v.edit", map=change, tool="create", env=env)
+            grass_session.run_command("v.edit", map=change, tool="create", env=env)
 
-        gcore.run_command(
-            "g.remove",
-            flags="f",
-            type=["raster"],
-            name=[diff_thr, diff_thr_clump],
-            env=env,
+
+def _change_detection_numpy(
+    before,
+    after,
+    change,
+    height_threshold,
+    cells_threshold,
+    add,
+    max_detected,
+    debug,
+    env,
+):
+    beforeArray = read_raster_array(before, env=env)
+    afterArray = read_raster_array(after, env=env)
+    a, b = _regression(afterArray, beforeArray)
+    diff = a + b * afterArray - beforeArray
+    write_raster_array(diff, "diff", env=env)
+    with np.errstate(invalid="ignore"):
+        if add:
+            mask = (diff > height_threshold[0]) & (diff < height_threshold[1])
+        else:
+            mask = beforeArray - a + b * afterArray > height_threshold
+    labels, count = _label_clumps(mask)
+    sizes = np.bincount(labels[mask], minlength=count)
+    # largest clumps first as r.stats sort=desc
+    order = np.argsort(-sizes, kind="stable")
+    if debug:
+        print("DEBUG: {}".format(["{} {}".format(c + 1, sizes[c]) for c in order]))
+    selected = [
+        c
+        for c in order
+        if sizes[c] > cells_threshold[0] and sizes[c] < cells_threshold[1]
+    ][:max_detected]
+    if not selected:
+        gcore.warning("No change found!")
+        grass_session.run_command("v.edit", map=change, tool="create", env=env)
+        return
+    # selected clumps as raster (r.recode) and their centroids
+    # with attributes of r.volume -f (input is the recoded raster)
+    write_raster_array(
+        np.where(np.isin(labels, selected), 1.0, np.nan), change, env=env
+    )
+    rows, cols = np.nonzero(mask)
+    cellLabels = labels[rows, cols]
+    rowMeans = np.bincount(cellLabels, weights=rows, minlength=count) / sizes
+    colMeans = np.bincount(cellLabels, weights=cols, minlength=count) / sizes
+    region = parse_region(env["GRASS_REGION"])
+    cellArea = region["e-w resol"] * region["n-s resol"]
+    points = []
+    for c in sorted(selected):
+        # r.volume places centroid in the closest cell of the clump
+        inside = cellLabels == c
+        closest = np.argmin(
+            (rows[inside] - rowMeans[c]) ** 2 + (cols[inside] - colMeans[c]) ** 2
         )
-    except:
-        gcore.run_command(
-            "g.remove",
-            flags="f",
-            type=["raster"],
-            name=[diff_thr, diff_thr_clump],
-            env=env,
+        points.append(
+            "{}|{}|{}|{}|1|{}|{}".format(
+                region["west"] + (cols[inside][closest] + 0.5) * region["e-w resol"],
+                region["north"] - (rows[inside][closest] + 0.5) * region["n-s resol"],
+                c + 1,
+                sizes[c] * cellArea,
+                sizes[c],
+                sizes[c],
+            )
         )
+    gcore.write_command(
+        "v.in.ascii",
+        input="-",
+        output=change,
+        format="point",
+        separator="pipe",
+        columns="east double precision, north double precision, cat integer,"
+        " volume double precision, average double precision,"
+        " sum double precision, count integer",
+        x=1,
+        y=2,
+        cat=3,
+        stdin="\n".join(points),
+        env=env,
+    )
 
 
 def drain(elevation, point, drain, conditioned, env):
@@ -651,7 +1146,238 @@ def drain(elevation, point, drain, conditioned, env):
                 env=env,
             )
     else:
-        gcore.run_command("v.edit", map=drain, tool="create", env=env)
+        grass_session.run_command("v.edit", map=drain, tool="create", env=env)
+
+
+# movement directions of r.walk and r.cost (doubled degrees
+# counterclockwise from east) as (row, col) steps towards the start
+_WALK_STEPS = {
+    720: (0, 1),
+    90: (-1, 1),
+    180: (-1, 0),
+    270: (-1, -1),
+    360: (0, -1),
+    450: (1, -1),
+    540: (1, 0),
+    630: (1, 1),
+    45: (-1, 2),
+    135: (-2, 1),
+    225: (-2, -1),
+    315: (-1, -2),
+    405: (1, -2),
+    495: (2, -1),
+    585: (2, 1),
+    675: (1, 2),
+}
+
+
+def _cell(coordinates, region):
+    """Returns (row, col) of cell with coordinates 'x,y'"""
+    x, y = (float(each) for each in coordinates.split(","))
+    return (
+        int((region["north"] - y) // region["n-s resol"]),
+        int((x - region["west"]) // region["e-w resol"]),
+    )
+
+
+def _backtrack(directions, start, end, region):
+    """Follows movement directions from start cell to end cell
+    (same as r.drain -d), returns coordinates of the cell centers"""
+    rows, cols = directions.shape
+    row, col = start
+    line = []
+    for i in range(rows * cols):
+        if not (0 <= row < rows and 0 <= col < cols):
+            break
+        line.append(
+            (
+                region["west"] + (col + 0.5) * region["e-w resol"],
+                region["north"] - (row + 0.5) * region["n-s resol"],
+            )
+        )
+        if (row, col) == end or not np.isfinite(directions[row, col]):
+            break
+        step = _WALK_STEPS.get(int(round(directions[row, col] * 2)))
+        if not step:
+            break
+        row += step[0]
+        col += step[1]
+    return line
+
+
+def _walk_inputs(
+    scanned_elev, friction, mask, walk_coeff, _lambda, slope_factor, tolerance, env
+):
+    """Returns key of r.walk inputs except start (cost_cache),
+    elevation changed by less than tolerance in all cells has the same key.
+    Mask is identified by its data, mask active in the current mapset
+    of env by version of its files."""
+    region = env["GRASS_REGION"]
+    return (
+        "r.walk",
+        region,
+        cost_cache.versions.digest(
+            (region, scanned_elev), read_raster_array(scanned_elev, env=env), tolerance
+        ),
+        cost_cache.digest(read_raster_array(friction, env=env)),
+        cost_cache.digest(read_raster_array(mask, env=env)) if mask else None,
+        mask_stamp(env),
+        str(walk_coeff),
+        _lambda,
+        slope_factor,
+    )
+
+
+def _walk(
+    scanned_elev,
+    friction,
+    walk_coeff,
+    _lambda,
+    slope_factor,
+    walk,
+    walk_dir,
+    point_from,
+    points_to,
+    key,
+    walkEnv,
+    env,
+):
+    """Runs r.walk writing walk and walk_dir with walkEnv,
+    reads them (qualified names) into cost_cache under key
+
+    @return cost and directions arrays
+    """
+    gcore.run_command(
+        "r.walk",
+        overwrite=True,
+        flags="k",
+        elevation=scanned_elev,
+        friction=friction,
+        output=walk.split("@")[0],
+        start_coordinates=point_from,
+        outdir=walk_dir.split("@")[0],
+        stop_coordinates=points_to,
+        walk_coeff=walk_coeff,
+        _lambda=_lambda,
+        slope_factor=slope_factor,
+        env=walkEnv,
+    )
+    cost = read_raster_array(walk, env=env, cache=False)
+    directions = read_raster_array(walk_dir, env=env, cache=False)
+    cost_cache.surfaces.put(key, points_to, cost, directions)
+    return cost, directions
+
+
+# routes of trails_combinations (by name of the vector) for trail_salesman:
+# (arguments of _walk_inputs, key of routes, number of points, routes)
+_trail_routes = {}
+
+
+def _point_coordinates(points, env):
+    """Returns list of [x, y] strings of points in vector"""
+    coordinates = gcore.read_command(
+        "v.out.ascii", input=points, format="point", separator=",", env=env
+    ).strip()
+    return [coords.split(",")[:2] for coords in coordinates.split(os.linesep)]
+
+
+def _routes_key(inputs, points, coords_list):
+    """Returns key of routes of trails_combinations,
+    r.walk inputs (_walk_inputs) and points"""
+    return inputs + (points, tuple(tuple(coords) for coords in coords_list))
+
+
+def _write_lines(lines, output, env):
+    """Writes lines (lists of coordinates) as vector, category is order"""
+    records = [
+        "L {n} 1\n{vertices}\n1 {cat}\n".format(
+            n=len(line),
+            vertices="\n".join("{} {}".format(x, y) for x, y in line),
+            cat=cat,
+        )
+        for cat, line in enumerate(lines, start=1)
+    ]
+    gcore.write_command(
+        "v.in.ascii",
+        input="-",
+        stdin="\n".join(records),
+        output=output,
+        format="standard",
+        flags="n",
+        overwrite=True,
+        env=env,
+    )
+
+
+def _trails_numpy(
+    scanned_elev,
+    friction,
+    walk_coeff,
+    _lambda,
+    slope_factor,
+    coords_list,
+    vector_routes,
+    mask,
+    tolerance,
+    env,
+):
+    """Runs r.walk once for each origin (unless cost_cache has its
+    surfaces for the same inputs), traces routes to all following points
+    in memory and writes them as lines of one vector.
+
+    @return key of r.walk inputs (_walk_inputs),
+    dictionary with (cost, line) for pairs of point indices
+    """
+    region = parse_region(env["GRASS_REGION"])
+    inputs = _walk_inputs(
+        scanned_elev, friction, mask, walk_coeff, _lambda, slope_factor, tolerance, env
+    )
+    points = [",".join(coords) for coords in coords_list]
+    legs = [(origin, points[i + 1 :]) for i, origin in enumerate(points[:-1])]
+    walks = {}
+    missing = []
+    for origin, points_to in legs:
+        walks[origin] = cost_cache.surfaces.get(inputs + (origin,), points_to)
+        if walks[origin] is None:
+            missing.append((origin, points_to))
+    if missing:
+        with scratch_space(env) as scratch:
+            scratchEnv = scratch.environ(env)
+            walk_tmp = scratch.raster("walk")
+            walk_dir_tmp = scratch.raster("walk_dir")
+            if mask:
+                gcore.message("Activating mask")
+                gcore.run_command("r.mask", raster=mask, overwrite=True, env=scratchEnv)
+            try:
+                for origin, points_to in missing:
+                    walks[origin] = _walk(
+                        scanned_elev,
+                        friction,
+                        walk_coeff,
+                        _lambda,
+                        slope_factor,
+                        scratch.qualified(walk_tmp),
+                        scratch.qualified(walk_dir_tmp),
+                        origin,
+                        points_to,
+                        inputs + (origin,),
+                        scratchEnv,
+                        env,
+                    )
+            finally:
+                if mask:
+                    gcore.message("Removing mask")
+                    gcore.run_command("r.mask", flags="r", env=scratchEnv)
+    routes = {}
+    for i, (origin, points_to) in enumerate(legs):
+        cost, directions = walks[origin]
+        for j, point_to in enumerate(points_to, start=i + 1):
+            end = _cell(point_to, region)
+            line = _backtrack(directions, end, _cell(origin, region), region)
+            if len(line) > 1:
+                routes[(i, j)] = (float(cost[end]), line[::-1])
+    _write_lines([line for cost, line in routes.values()], vector_routes, env)
+    return inputs, routes
 
 
 def trails_combinations(
@@ -667,73 +1393,98 @@ def trails_combinations(
     vector_routes,
     mask,
     env,
+    engine="numpy",
+    tolerance=0.5,
 ):
+    """Computes least-cost routes between all pairs of points.
+    Engine 'numpy' runs r.walk once for each origin and traces
+    the routes in memory, 'grass' runs r.drain for each route.
+    Engine 'numpy' reuses cost surfaces while the elevation
+    changes by less than tolerance in all cells (scanner noise)."""
     import itertools
 
-    coordinates = gcore.read_command(
-        "v.out.ascii", input=points, format="point", separator=",", env=env
-    ).strip()
-    coords_list = []
-    for coords in coordinates.split(os.linesep):
-        coords_list.append(coords.split(",")[:2])
+    coords_list = _point_coordinates(points, env)
+
+    _trail_routes.pop(vector_routes, None)
+    if _use_numpy(engine, env):
+        try:
+            inputs, routes = _trails_numpy(
+                scanned_elev,
+                friction,
+                walk_coeff,
+                _lambda,
+                slope_factor,
+                coords_list,
+                vector_routes,
+                mask,
+                tolerance,
+                env,
+            )
+            walk = (
+                scanned_elev,
+                friction,
+                mask,
+                walk_coeff,
+                _lambda,
+                slope_factor,
+                tolerance,
+            )
+            key = _routes_key(inputs, points, coords_list)
+            _trail_routes[vector_routes] = (walk, key, len(coords_list), routes)
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
 
     combinations = itertools.combinations(coords_list, 2)
     combinations = [
         list(group) for k, group in itertools.groupby(combinations, key=lambda x: x[0])
     ]
-    i = k = 0
     vector_routes_list = []
-
-    walk_tmp = "walk_tmp"
-    walk_dir_tmp = "walk_dir_tmp"
-    raster_route_tmp = "raster_route_tmp"
-
-    if mask:
-        gcore.message("Activating mask")
-        gcore.run_command("r.mask", raster=mask, overwrite=True, env=env)
-    for points in combinations:
-        i += 1
-        point_from = ",".join(points[0][0])
-        points_to = [",".join(pair[1]) for pair in points]
-        vector_routes_list_drain = []
-        for each in points_to:
-            vector_route_tmp = "route_path_" + str(k)
-            vector_routes_list_drain.append(vector_route_tmp)
-            k += 1
-        vector_routes_list.extend(vector_routes_list_drain)
-
-        trail(
-            scanned_elev,
-            friction,
-            walk_coeff,
-            _lambda,
-            slope_factor,
-            walk_tmp,
-            walk_dir_tmp,
-            point_from,
-            points_to,
-            raster_route_tmp,
-            vector_routes_list_drain,
-            env,
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        walk_tmp = scratch.raster("walk")
+        walk_dir_tmp = scratch.raster("walk_dir")
+        raster_route_tmp = scratch.raster("route")
+        if mask:
+            # mask applies to modules writing temporary maps
+            gcore.message("Activating mask")
+            gcore.run_command("r.mask", raster=mask, overwrite=True, env=scratchEnv)
+        try:
+            for points in combinations:
+                point_from = ",".join(points[0][0])
+                points_to = [",".join(pair[1]) for pair in points]
+                vector_routes_list_drain = [
+                    scratch.vector("route_path") for each in points_to
+                ]
+                vector_routes_list.extend(vector_routes_list_drain)
+
+                trail(
+                    scanned_elev,
+                    friction,
+                    walk_coeff,
+                    _lambda,
+                    slope_factor,
+                    walk_tmp,
+                    walk_dir_tmp,
+                    point_from,
+                    points_to,
+                    raster_route_tmp,
+                    vector_routes_list_drain,
+                    scratchEnv,
+                    mask=mask,
+                    engine="grass",
+                )
+        finally:
+            if mask:
+                gcore.message("Removing mask")
+                gcore.run_command("r.mask", flags="r", env=scratchEnv)
+        gcore.run_command(
+            "v.patch",
+            input=[scratch.qualified(name) for name in vector_routes_list],
+            output=vector_routes,
+            overwrite=True,
+            env=env,
         )
-    gcore.run_command(
-        "v.patch",
-        input=vector_routes_list,
-        output=vector_routes,
-        overwrite=True,
-        env=env,
-    )
-
-    gcore.run_command(
-        "g.remove",
-        flags="f",
-        type="raster",
-        name=[walk_tmp, walk_dir_tmp, raster_route_tmp],
-        env=env,
-    )
-    gcore.message("Removing mask")
-    if mask:
-        gcore.run_command("r.mask", flags="r", env=env)
 
 
 # procedure for finding a trail in real-time
@@ -750,7 +1501,61 @@ def trail(
     raster_route,
     vector_routes,
     env,
+    mask=None,
+    engine="numpy",
+    tolerance=0.5,
 ):
+    """Computes least-cost routes from point_from to points_to.
+    Engine 'numpy' reuses cost surfaces from cost_cache when inputs
+    (including mask activated in env) didn't change and traces the routes
+    in memory (raster_route is not written), 'grass' runs r.drain.
+    Elevation changed by less than tolerance in all cells
+    (scanner noise) is considered unchanged."""
+    _trail_routes.pop(vector_routes, None)
+    if _use_numpy(engine, env):
+        try:
+            region = parse_region(env["GRASS_REGION"])
+            key = _walk_inputs(
+                scanned_elev,
+                friction,
+                mask,
+                walk_coeff,
+                _lambda,
+                slope_factor,
+                tolerance,
+                env,
+            ) + (point_from,)
+            cached = cost_cache.surfaces.get(key, points_to)
+            if cached:
+                cost, directions = cached
+                write_raster_array(cost, walk, env=env)
+                write_raster_array(directions, walk_dir, env=env)
+            else:
+                cost, directions = _walk(
+                    scanned_elev,
+                    friction,
+                    walk_coeff,
+                    _lambda,
+                    slope_factor,
+                    walk,
+                    walk_dir,
+                    point_from,
+                    points_to,
+                    key,
+                    env,
+                    env,
+                )
+            for point_to, vector_route in zip(points_to, vector_routes):
+                line = _backtrack(
+                    directions,
+                    _cell(point_to, region),
+                    _cell(point_from, region),
+                    region,
+                )
+                _write_lines([line[::-1]] if len(line) > 1 else [], vector_route, env)
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
     gcore.run_command(
         "r.walk",
         overwrite=True,
@@ -780,134 +1585,301 @@ def trail(
         )
 
 
-def trail_salesman(trails, points, output, env):
-    net_tmp = "net_tmp"
-    gcore.run_command(
-        "v.net",
-        input=trails,
-        points=points,
-        output=net_tmp,
-        operation="connect",
-        threshold=10,
-        overwrite=True,
-        env=env,
+def _salesman_numpy(count, routes, output, env):
+    """Solves tour through count points using costs of routes
+    (from trails_combinations), writes routes of the tour in its order"""
+    costs = np.full((count, count), np.nan)
+    for (i, j), (cost, line) in routes.items():
+        costs[i, j] = costs[j, i] = cost
+    np.fill_diagonal(costs, 0)
+    # pairs without route are avoided
+    unreachable = ~np.isfinite(costs)
+    costs[unreachable] = 10 * np.nanmax(costs, initial=0) + 1
+    tour = TSP.solve_tsp_numpy(
+        costs, optim_steps=10, or_opt=True, time_budget=0.1, closed=True
     )
-    cats = (
-        gcore.read_command(
-            "v.category", input=net_tmp, layer=2, option="print", env=env
+    lines = []
+    for i, j in zip(tour, tour[1:] + tour[:1]):
+        route = routes.get((min(i, j), max(i, j)))
+        if route and i != j:
+            lines.append(route[1] if i < j else route[1][::-1])
+    _write_lines(lines, output, env)
+
+
+def trail_salesman(trails, points, output, env, engine="numpy"):
+    """Computes tour through points along trails.
+    Engine 'numpy' uses routes and their costs kept by trails_combinations
+    (computed with its NumPy engine) when its inputs and points didn't change
+    and solves the tour with TSP.py, 'grass' uses v.net.salesman"""
+    routes = _trail_routes.get(trails)
+    if engine == "numpy" and routes:
+        try:
+            walk, key, count, routes = routes
+            coords_list = _point_coordinates(points, env)
+            inputs = _walk_inputs(*walk, env=env)
+            if _routes_key(inputs, points, coords_list) == key:
+                _salesman_numpy(count, routes, output, env)
+                return
+        except ENGINE_ERRORS as e:
+            print(e)
+    with scratch_space(env) as scratch:
+        net_tmp = scratch.vector("net")
+        gcore.run_command(
+            "v.net",
+            input=trails,
+            points=points,
+            output=net_tmp,
+            operation="connect",
+            threshold=10,
+            overwrite=True,
+            env=scratch.environ(env),
+        )
+        net_tmp = scratch.qualified(net_tmp)
+        cats = (
+            gcore.read_command(
+                "v.category", input=net_tmp, layer=2, option="print", env=env
+            )
+            .strip()
+            .split(os.linesep)
+        )
+        gcore.run_command(
+            "v.net.salesman",
+            input=net_tmp,
+            output=output,
+            ccats=",".join(cats),
+            alayer=1,
+            nlayer=2,
+            overwrite=True,
+            env=env,
         )
-        .strip()
-        .split(os.linesep)
+
+
+# largest region (number of cells) for viewshed with NumPy engine
+_VIEWSHED_MAX_CELLS = 1000000
+
+
+def _visibility(dem, observer, obs_elev, region):
+    """Returns boolean array of cells visible from observer (row, col)
+    with eyes obs_elev above the surface. Lines of sight along rays
+    to all edge cells are traced at once, cell is visible when no cell
+    before it on its ray is seen under larger vertical angle."""
+    rows, cols = dem.shape
+    row0, col0 = observer
+    edgeRows = np.concatenate(
+        (np.zeros(cols), np.full(cols, rows - 1), np.arange(rows), np.arange(rows))
     )
-    gcore.run_command(
-        "v.net.salesman",
-        input=net_tmp,
-        output=output,
-        ccats=",".join(cats),
-        alayer=1,
-        nlayer=2,
-        overwrite=True,
-        env=env,
+    edgeCols = np.concatenate(
+        (np.arange(cols), np.arange(cols), np.zeros(rows), np.full(rows, cols - 1))
     )
+    dr = edgeRows - row0
+    dc = edgeCols - col0
+    length = np.maximum(np.abs(dr), np.abs(dc))
+    dr, dc, length = dr[length > 0], dc[length > 0], length[length > 0]
+    steps = np.arange(1, length.max() + 1)
+    valid = steps[np.newaxis, :] <= length[:, np.newaxis]
+    fraction = np.where(valid, steps[np.newaxis, :] / length[:, np.newaxis], 0)
+    r = np.rint(row0 + dr[:, np.newaxis] * fraction).astype(int)
+    c = np.rint(col0 + dc[:, np.newaxis] * fraction).astype(int)
+    z = dem[r, c]
+    distance = np.hypot(
+        (r - row0) * region["n-s resol"], (c - col0) * region["e-w resol"]
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (z - (dem[row0, col0] + obs_elev)) / distance
+    slope[~valid | ~np.isfinite(slope)] = -np.inf
+    horizon = np.maximum.accumulate(slope, axis=1)
+    previous = np.concatenate(
+        (np.full((len(length), 1), -np.inf), horizon[:, :-1]), axis=1
+    )
+    seen = valid & np.isfinite(z) & (slope >= previous)
+    visible = np.zeros(rows * cols, dtype=bool)
+    visible[(r * cols + c)[seen]] = True
+    visible = visible.reshape(rows, cols)
+    visible[row0, col0] = True
+    return visible
 
 
 def viewshed(
-    scanned_elev, output, vector, visible_color, invisible_color, obs_elev=1.7, env=None
+    scanned_elev,
+    output,
+    vector,
+    visible_color,
+    invisible_color,
+    obs_elev=1.7,
+    env=None,
+    cumulative=None,
+    engine="grass",
 ):
+    """Computes area visible from any of the points in vector (output, 1 visible,
+    0 invisible) and optionally number of points each cell is visible from
+    (cumulative). Engine 'grass' runs r.viewshed for all points concurrently,
+    'numpy' traces lines of sight in memory (for regions up to
+    _VIEWSHED_MAX_CELLS), also concurrently. NumPy lines of sight
+    are rasterized, so visibility of some cells close to the horizon
+    differs from r.viewshed."""
     coordinates = gcore.read_command(
         "v.out.ascii", input=vector, separator=",", env=env
     ).strip()
-    coordinate = None
+    observers = []
     for line in coordinates.split(os.linesep):
         try:
-            coordinate = [float(c) for c in line.split(",")[0:2]]
+            observers.append([float(c) for c in line.split(",")[0:2]])
         except ValueError:  # no points in map
             pass
-        break
-    if coordinate:
+    if not observers:
+        return
+    rules = "0 {invis}\n1 {vis}".format(vis=visible_color, invis=invisible_color)
+    cumulative_rules = "0 {invis}\n{n} {vis}".format(
+        n=len(observers), vis=visible_color, invis=invisible_color
+    )
+    if _use_numpy(engine, env):
+        try:
+            region = parse_region(env["GRASS_REGION"])
+            if region["rows"] * region["cols"] > _VIEWSHED_MAX_CELLS:
+                raise ValueError("Region is too large for NumPy viewshed")
+            dem = read_raster_array(scanned_elev, env=env)
+            cells = [_cell("{},{}".format(x, y), region) for x, y in observers]
+            cells = [
+                cell
+                for cell in cells
+                if 0 <= cell[0] < dem.shape[0] and 0 <= cell[1] < dem.shape[1]
+            ]
+            count = np.zeros(dem.shape, dtype=np.int32)
+            # NumPy releases GIL in array operations of each observer
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                for visible in executor.map(
+                    lambda cell: _visibility(dem, cell, obs_elev, region), cells
+                ):
+                    count += visible
+            write_raster_array(count > 0, output, env=env, integer=True)
+            grass_session.write_command(
+                "r.colors", map=output, rules="-", stdin=rules, env=env
+            )
+            if cumulative:
+                write_raster_array(count, cumulative, env=env, integer=True)
+                grass_session.write_command(
+                    "r.colors",
+                    map=cumulative,
+                    rules="-",
+                    stdin=cumulative_rules,
+                    env=env,
+                )
+            return
+        except ENGINE_ERRORS as e:
+            print(e)
+
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        names = [scratch.raster("viewshed") for each in observers]
+
+        def compute(name, coordinate):
+            gcore.run_command(
+                "r.viewshed",
+                flags="b",
+                input=scanned_elev,
+                output=name,
+                coordinates=coordinate,
+                observer_elevation=obs_elev,
+                env=scratchEnv,
+            )
+
+        # each r.viewshed is a separate process
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            list(executor.map(compute, names, observers))
+        count = cumulative or scratch.raster("cumulative")
         gcore.run_command(
-            "r.viewshed",
-            flags="b",
-            input=scanned_elev,
-            output=output,
-            coordinates=coordinate,
-            observer_elevation=obs_elev,
-            env=env,
+            "r.series",
+            input=[scratch.qualified(name) for name in names],
+            output=count,
+            method="sum",
+            overwrite=True,
+            env=env if cumulative else scratchEnv,
         )
-        gcore.run_command("r.null", map=output, null=0, env=env)
-        gcore.write_command(
-            "r.colors",
-            map=output,
-            rules="-",
-            stdin="0 {invis}\n1 {vis}".format(vis=visible_color, invis=invisible_color),
+        grast.mapcalc(
+            "{output} = if(isnull({count}), 0, {count} > 0)".format(
+                output=output, count=scratch.qualified(count)
+            ),
             env=env,
         )
+    grass_session.write_command("r.colors", map=output, rules="-", stdin=rules, env=env)
+    if cumulative:
+        grass_session.write_command(
+            "r.colors", map=cumulative, rules="-", stdin=cumulative_rules, env=env
+        )
 
 
 def polygons(points_map, output, env):
     """Clusters markers together and creates polygons.
     Requires GRASS 7.1."""
-    tmp_cluster = "tmp_cluster"
-    tmp_hull = "tmp_hull"
-    gcore.run_command(
-        "v.cluster",
-        flags="t",
-        input=points_map,
-        min=3,
-        layer="3",
-        output=tmp_cluster,
-        method="optics",
-        env=env,
-    )
-    cats = (
-        gcore.read_command(
-            "v.category", input=tmp_cluster, layer="3", option="print", env=env
+    with scratch_space(env) as scratch:
+        scratchEnv = scratch.environ(env)
+        tmp_cluster = scratch.vector("cluster")
+        gcore.run_command(
+            "v.cluster",
+            flags="t",
+            input=points_map,
+            min=3,
+            layer="3",
+            output=tmp_cluster,
+            method="optics",
+            env=scratchEnv,
         )
-        .strip()
-        .split()
-    )
-    cats_list = list(set(cats))
-    cats_dict = dict([(x, cats.count(x)) for x in cats_list])
-    for cat in cats_list:
-        if cats_dict[cat] > 2:
-            gcore.run_command(
-                "v.hull",
+        cats = (
+            gcore.read_command(
+                "v.category",
                 input=tmp_cluster,
-                output=tmp_hull + "_%s" % cat,
-                cats=cat,
                 layer="3",
-                env=env,
+                option="print",
+                env=scratchEnv,
             )
-        elif cats_dict[cat] == 2:
-            points = (
-                gcore.read_command(
-                    "v.out.ascii",
+            .strip()
+            .split()
+        )
+        cats_list = list(set(cats))
+        cats_dict = dict([(x, cats.count(x)) for x in cats_list])
+        hulls = {}
+        for cat in cats_list:
+            if cats_dict[cat] >= 2:
+                hulls[cat] = scratch.vector("hull")
+            if cats_dict[cat] > 2:
+                gcore.run_command(
+                    "v.hull",
                     input=tmp_cluster,
-                    format="point",
-                    separator="space",
-                    layer="3",
+                    output=hulls[cat],
                     cats=cat,
-                    env=env,
+                    layer="3",
+                    env=scratchEnv,
                 )
-                .strip()
-                .splitlines()
-            )
-            ascii = "L 2 1\n" + points[0] + "\n" + points[1] + "\n" + "1 1"
-            gcore.write_command(
-                "v.in.ascii",
-                format="standard",
-                input="-",
-                flags="n",
-                output=tmp_hull + "_%s" % cat,
-                stdin=ascii,
-                env=env,
-            )
-    gcore.run_command(
-        "v.patch",
-        input=[tmp_hull + "_%s" % cat for cat in cats_list],
-        output=output,
-        env=env,
-    )
+            elif cats_dict[cat] == 2:
+                points = (
+                    gcore.read_command(
+                        "v.out.ascii",
+                        input=tmp_cluster,
+                        format="point",
+                        separator="space",
+                        layer="3",
+                        cats=cat,
+                        env=scratchEnv,
+                    )
+                    .strip()
+                    .splitlines()
+                )
+                ascii = "L 2 1\n" + points[0] + "\n" + points[1] + "\n" + "1 1"
+                gcore.write_command(
+                    "v.in.ascii",
+                    format="standard",
+                    input="-",
+                    flags="n",
+                    output=hulls[cat],
+                    stdin=ascii,
+                    env=scratchEnv,
+                )
+        gcore.run_command(
+            "v.patch",
+            input=[scratch.qualified(hulls[cat]) for cat in cats_list if cat in hulls],
+            output=output,
+            env=env,
+        )
     gcore.run_command(
         "v.to.rast",
         input=output,
@@ -921,53 +1893,58 @@ def polygons(points_map, output, env):
 
 def polylines(points_map, output, env):
     """Cluster points and connect points by line in each cluster"""
-    tmp_cluster = "tmp_cluster"
-    gcore.run_command(
-        "v.cluster",
-        flags="t",
-        input=points_map,
-        min=3,
-        layer="3",
-        output=tmp_cluster,
-        method="optics",
-        env=env,
-    )
-    cats = gcore.read_command(
-        "v.category", input=tmp_cluster, layer=3, option="print", env=env
-    ).strip()
-    cats = list(set(cats.split()))
-    line = ""
-    for cat in cats:
-        point_list = []
-        distances = {}
-        points = (
-            gcore.read_command(
-                "v.out.ascii",
-                input=tmp_cluster,
-                layer=3,
-                type="point",
-                cats=cat,
-                format="point",
-                env=env,
-            )
-            .strip()
-            .split()
+    with scratch_space(env) as scratch:
+        tmp_cluster = scratch.vector("cluster")
+        gcore.run_command(
+            "v.cluster",
+            flags="t",
+            input=points_map,
+            min=3,
+            layer="3",
+            output=tmp_cluster,
+            method="optics",
+            env=scratch.environ(env),
         )
-        for point in points:
-            point = point.split("|")[:2]
-            point_list.append((float(point[0]), float(point[1])))
-        for i, point1 in enumerate(point_list[:-1]):
-            for point2 in point_list[i + 1 :]:
-                distances[(point1, point2)] = sqrt(
-                    (point1[0] - point2[0]) * (point1[0] - point2[0])
-                    + (point1[1] - point2[1]) * (point1[1] - point2[1])
+        cats = gcore.read_command(
+            "v.category",
+            input=scratch.qualified(tmp_cluster),
+            layer=3,
+            option="print",
+            env=env,
+        ).strip()
+        cats = list(set(cats.split()))
+        line = ""
+        for cat in cats:
+            point_list = []
+            distances = {}
+            points = (
+                gcore.read_command(
+                    "v.out.ascii",
+                    input=scratch.qualified(tmp_cluster),
+                    layer=3,
+                    type="point",
+                    cats=cat,
+                    format="point",
+                    env=env,
                 )
-        ordered = sorted(distances.items(), key=lambda x: x[1])[: len(points) - 1]
-        for key, value in ordered:
-            line += "L 2 1\n"
-            line += "{x} {y}\n".format(x=key[0][0], y=key[0][1])
-            line += "{x} {y}\n".format(x=key[1][0], y=key[1][1])
-            line += "1 {cat}\n\n".format(cat=cat)
+                .strip()
+                .split()
+            )
+            for point in points:
+                point = point.split("|")[:2]
+                point_list.append((float(point[0]), float(point[1])))
+            for i, point1 in enumerate(point_list[:-1]):
+                for point2 in point_list[i + 1 :]:
+                    distances[(point1, point2)] = sqrt(
+                        (point1[0] - point2[0]) * (point1[0] - point2[0])
+                        + (point1[1] - point2[1]) * (point1[1] - point2[1])
+                    )
+            ordered = sorted(distances.items(), key=lambda x: x[1])[: len(points) - 1]
+            for key, value in ordered:
+                line += "L 2 1\n"
+                line += "{x} {y}\n".format(x=key[0][0], y=key[0][1])
+                line += "{x} {y}\n".format(x=key[1][0], y=key[1][1])
+                line += "1 {cat}\n\n".format(cat=cat)
     gcore.write_command(
         "v.in.ascii",
         input="-",
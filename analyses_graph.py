@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Concurrent execution of analyses with declared inputs and outputs
+
+Analyses decorated with @analysis declare which maps they read and write.
+Analyses which don't depend on each other are run at the same time,
+analyses without declaration are run only after all previous analyses
+finished and before any following analysis starts.
+
+Example (in the Python file with analyses):
+
+    from analyses_graph import analysis
+
+    @analysis(inputs=["scanned_elev"], outputs=["slope", "aspect"])
+    def run_slope(scanned_elev, env, **kwargs):
+        analyses.slope_aspect(scanned_elev, "slope", "aspect", env)
+
+Inputs and outputs are either map names or names of keyword
+arguments passed to the analyses (e.g. 'scanned_elev').
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from grass.exceptions import CalledModuleError, ScriptError
+
+from profiling import profiler
+from scratch import attached, current_frame
+
+
+def analysis(inputs=None, outputs=None):
+    """Decorator declaring maps the analysis reads (inputs) and writes (outputs)"""
+
+    def decorator(func):
+        func.analysis_inputs = tuple(inputs or ())
+        func.analysis_outputs = tuple(outputs or ())
+        return func
+
+    return decorator
+
+
+def is_declared(func):
+    return hasattr(func, "analysis_outputs")
+
+
+def _resolve(names, kwargs):
+    """Replaces names of keyword arguments by their values"""
+    resolved = set()
+    for name in names:
+        value = kwargs.get(name, name)
+        if isinstance(value, str):
+            resolved.add(value.split("@")[0])
+    return resolved
+
+
+def build_graph(callables, kwargs):
+    """Returns dictionary with names of functions it depends on for each function.
+    Function depends on previous functions writing its inputs or outputs
+    or reading its outputs. Functions without declaration depend on all previous
+    functions and all following functions depend on them.
+
+    @param callables sorted list of (name, function)
+    @param kwargs keyword arguments the functions are called with
+    """
+    graph = {}
+    declared = []
+    barrier = None
+    for name, func in callables:
+        depends = {barrier} if barrier else set()
+        if not is_declared(func):
+            depends.update(other for other, inputs, outputs in declared)
+            graph[name] = depends
+            barrier = name
+            declared = []
+            continue
+        inputs = _resolve(func.analysis_inputs, kwargs)
+        outputs = _resolve(func.analysis_outputs, kwargs)
+        for other, other_inputs, other_outputs in declared:
+            if other_outputs & (inputs | outputs) or other_inputs & outputs:
+                depends.add(other)
+        graph[name] = depends
+        declared.append((name, inputs, outputs))
+    return graph
+
+
+def _run(name, func, waitFor, kwargs, timings, cancel, scratch):
+    wait(waitFor)
+    if cancel and cancel.is_set():
+        return
+    start = time.perf_counter()
+    try:
+        with profiler.span(name, "analysis"), attached(scratch):
+            func(**kwargs)
+    except (CalledModuleError, Exception, ScriptError):
+        traceback.print_exc()
+    timings[name] = time.perf_counter() - start
+
+
+def run_graph(callables, kwargs, timings, max_workers=None, cancel=None):
+    """Runs functions concurrently respecting their dependencies.
+    Errors are printed and don't stop the remaining functions.
+
+    @param callables sorted list of (name, function)
+    @param kwargs keyword arguments the functions are called with
+    @param timings dictionary where duration of each call in seconds is stored
+    @param max_workers maximum number of concurrently running functions
+    @param cancel threading.Event, when set, functions not yet started are skipped
+
+    @return wall-clock time of all functions in seconds
+    """
+    start = time.perf_counter()
+    graph = build_graph(callables, kwargs)
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    futures = {}
+    # temporary maps are removed at the end of the frame processed by caller
+    scratch = current_frame()
+    # functions depend only on previous functions and are submitted in order,
+    # so the functions they wait for are already running or done
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for name, func in callables:
+            waitFor = [futures[other] for other in graph[name]]
+            futures[name] = executor.submit(
+                _run, name, func, waitFor, kwargs, timings, cancel, scratch
+            )
+    return time.perf_counter() - start
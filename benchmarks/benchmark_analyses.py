@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@brief Benchmark of analyses on synthetic scans
+
+Creates synthetic scans (noise, hills, pits and markers) in the current
+mapset, runs each analysis repeatedly at several resolutions and prints
+latency percentiles, number of subprocesses and number of written
+and removed rasters as JSON. Cold runs get a scan with fresh sensor
+noise each time (as during scanning, caches of inputs don't hit),
+warm runs repeat identical inputs. Run it in a temporary location:
+
+    grass --tmp-location XY --exec python3 benchmarks/benchmark_analyses.py
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import grass.script as gscript
+from grass.script import core as gcore
+
+import analyses
+import grass_session
+from tangible_utils import (
+    get_environment,
+    get_mapset_path,
+    write_raster_array,
+)
+
+SCAN = "bench_scan"
+SCAN_SAVED = "bench_scan_saved"
+MARKERS = "bench_markers"
+FRICTION = "bench_friction"
+MARKER_HEIGHT = 20
+# standard deviation of sensor noise added to the scan before each cold run
+SENSOR_NOISE = 0.5
+
+
+class ProcessCounter:
+    """Counts GRASS modules started through grass.script"""
+
+    def __init__(self):
+        self.modules = Counter()
+        self.removed = 0
+        self._popen = gcore.Popen
+
+    def __enter__(self):
+        counter = self
+
+        class CountingPopen(self._popen):
+            def __init__(self, args, **kwargs):
+                counter.record(args)
+                super().__init__(args, **kwargs)
+
+        gcore.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *args):
+        gcore.Popen = self._popen
+
+    def record(self, args):
+        module = os.path.basename(str(args[0]))
+        self.modules[module] += 1
+        if module == "g.remove" and any("raster" in str(a) for a in args):
+            for arg in args:
+                if str(arg).startswith("name="):
+                    self.removed += len(str(arg)[5:].split(","))
+
+
+def synthetic_scan(rows, cols, markers, seed=0):
+    """Returns scan without and with markers (square blocks)
+    and marker centers (row, col). Scan has hills, pits and noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:rows, 0:cols]
+    y = y / float(rows)
+    x = x / float(cols)
+    dem = np.full((rows, cols), 100.0)
+    for i in range(5):
+        cy, cx = rng.uniform(0.1, 0.9, 2)
+        sigma = rng.uniform(0.1, 0.25)
+        dem += rng.uniform(20, 60) * np.exp(
+            -((x - cx) ** 2 + (y - cy) ** 2) / (2 * sigma**2)
+        )
+    for i in range(3):
+        cy, cx = rng.uniform(0.1, 0.9, 2)
+        dem -= 10 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * 0.03**2))
+    dem += rng.normal(0, 0.5, (rows, cols))
+    scan = dem.copy()
+    half = max(1, int(0.015 * min(rows, cols)))
+    centers = []
+    for i in range(markers):
+        r = rng.integers(half + 1, rows - half - 1)
+        c = rng.integers(half + 1, cols - half - 1)
+        scan[r - half : r + half + 1, c - half : c + half + 1] += MARKER_HEIGHT
+        centers.append((r, c))
+    return dem, scan, centers, (2 * half + 1) ** 2
+
+
+def setup(extent, resolution, markers):
+    """Creates input data, returns environment and parameters for analyses"""
+    cells = int(round(extent / resolution))
+    env = os.environ.copy()
+    env["GRASS_OVERWRITE"] = "1"
+    env["GRASS_VERBOSE"] = "0"
+    env["GRASS_REGION"] = gscript.region_env(
+        n=extent, s=0, e=extent, w=0, res=resolution
+    )
+    before, after, centers, markerCells = synthetic_scan(cells, cells, markers)
+    write_raster_array(before, SCAN_SAVED, env=env)
+    write_raster_array(after, SCAN, env=env)
+    gcore.run_command("r.mapcalc", expression=FRICTION + " = 0", env=env)
+    points = [
+        "{}|{}".format((c + 0.5) * resolution, extent - (r + 0.5) * resolution)
+        for r, c in centers
+    ]
+    gcore.write_command(
+        "v.in.ascii",
+        input="-",
+        output=MARKERS,
+        format="point",
+        separator="pipe",
+        stdin="\n".join(points),
+        env=env,
+    )
+    return get_environment(rast=SCAN), markerCells, after
+
+
+def benchmarks(markers, markerCells):
+    """Analyses to benchmark as name: function(env)"""
+    return OrderedDict(
+        [
+            (
+                "difference",
+                lambda env: analyses.difference(
+                    real_elev=SCAN_SAVED, scanned_elev=SCAN, new="bench_diff", env=env
+                ),
+            ),
+            (
+                "contours",
+                lambda env: analyses.contours(
+                    scanned_elev=SCAN, new="bench_contours", step=5, env=env
+                ),
+            ),
+            (
+                "slope_aspect",
+                lambda env: analyses.slope_aspect(
+                    scanned_elev=SCAN,
+                    slope="bench_slope",
+                    aspect="bench_aspect",
+                    env=env,
+                ),
+            ),
+            (
+                "depression",
+                lambda env: analyses.depression(
+                    scanned_elev=SCAN, new="bench_depression", env=env
+                ),
+            ),
+            (
+                "simwe",
+                lambda env: analyses.simwe(
+                    scanned_elev=SCAN,
+                    depth="bench_depth",
+                    rain_value=300,
+                    niterations=4,
+                    env=env,
+                ),
+            ),
+            (
+                "erosion",
+                lambda env: analyses.erosion(
+                    scanned_elev=SCAN,
+                    rain_value=200,
+                    depth="bench_depth",
+                    detachment_coeff=0.001,
+                    transport_coeff=0.01,
+                    shear_stress=0,
+                    niterations=4,
+                    sediment_flux="bench_flux",
+                    erosion_deposition="bench_erdep",
+                    env=env,
+                ),
+            ),
+            (
+                "change_detection",
+                lambda env: analyses.change_detection(
+                    before=SCAN_SAVED,
+                    after=SCAN,
+                    change="bench_change",
+                    height_threshold=[MARKER_HEIGHT / 2, MARKER_HEIGHT * 1.5],
+                    cells_threshold=[markerCells / 2, markerCells * 2],
+                    add=True,
+                    max_detected=markers,
+                    debug=False,
+                    env=env,
+                ),
+            ),
+            (
+                "viewshed",
+                lambda env: analyses.viewshed(
+                    scanned_elev=SCAN,
+                    output="bench_viewshed",
+                    vector=MARKERS,
+                    visible_color="green",
+                    invisible_color="red",
+                    env=env,
+                ),
+            ),
+            (
+                "trails_combinations",
+                lambda env: analyses.trails_combinations(
+                    scanned_elev=SCAN,
+                    friction=FRICTION,
+                    walk_coeff=[0.72, 6.0, 1.9998, -1.9998],
+                    _lambda=0.5,
+                    slope_factor=-0.8125,
+                    walk="bench_walk",
+                    walking_dir="bench_walkdir",
+                    points=MARKERS,
+                    raster_route="bench_route",
+                    vector_routes="bench_route",
+                    mask=None,
+                    env=env,
+                ),
+            ),
+        ]
+    )
+
+
+def perturbation(scan, env, seed=1):
+    """Returns function writing scan with fresh sensor noise (not measured)"""
+    rng = np.random.default_rng(seed)
+
+    def perturb():
+        noisy = scan + rng.normal(0, SENSOR_NOISE, scan.shape)
+        write_raster_array(noisy, SCAN, env=env)
+
+    return perturb
+
+
+def run_benchmark(func, env, repeat, perturb=None):
+    """Measures repeated runs of func, perturb is called before each run"""
+    cellhd = os.path.join(get_mapset_path(), "cellhd")
+    times = []
+    writes = 0
+    counter = ProcessCounter()
+    for i in range(repeat):
+        if perturb:
+            perturb()
+        start = time.time()
+        with counter:
+            t0 = time.perf_counter()
+            func(env)
+            times.append(time.perf_counter() - t0)
+        writes += sum(
+            1
+            for name in os.listdir(cellhd)
+            if os.path.getmtime(os.path.join(cellhd, name)) >= start
+        )
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 2),
+        "p95_ms": round(float(np.percentile(times, 95)), 2),
+        "mean_ms": round(float(times.mean()), 2),
+        "subprocesses": sum(counter.modules.values()) / float(repeat),
+        "modules": {
+            module: count / float(repeat) for module, count in counter.modules.items()
+        },
+        "raster_writes": writes / float(repeat),
+        "raster_removals": counter.removed / float(repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark analyses on synthetic scans, prints JSON"
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="runs per analysis")
+    parser.add_argument(
+        "--resolutions",
+        default="2,1",
+        help="comma separated resolutions, extent is always the same",
+    )
+    parser.add_argument("--extent", type=float, default=400, help="model size")
+    parser.add_argument("--markers", type=int, default=4, help="number of markers")
+    parser.add_argument(
+        "--analyses", help="comma separated names of analyses (default all)"
+    )
+    parser.add_argument("--output", help="write JSON to file instead of stdout")
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="use persistent GRASS session for metadata operations",
+    )
+    args = parser.parse_args()
+
+    if "GISRC" not in os.environ:
+        sys.exit("Run the benchmark in GRASS session (see grass --exec)")
+    grass_session.session.enabled = args.session
+
+    results = []
+    for resolution in [float(r) for r in args.resolutions.split(",")]:
+        env, markerCells, scan = setup(args.extent, resolution, args.markers)
+        perturb = perturbation(scan, env)
+        tests = benchmarks(args.markers, markerCells)
+        names = args.analyses.split(",") if args.analyses else list(tests.keys())
+        for name in names:
+            result = OrderedDict(
+                [
+                    ("analysis", name),
+                    ("resolution", resolution),
+                    ("cells", int(round(args.extent / resolution)) ** 2),
+                ]
+            )
+            try:
+                # first run is not measured (loading libraries)
+                tests[name](env)
+                result["cold"] = run_benchmark(tests[name], env, args.repeat, perturb)
+                result["warm"] = run_benchmark(tests[name], env, args.repeat)
+            except Exception:
+                result["error"] = traceback.format_exc().strip().splitlines()[-1]
+            results.append(result)
+
+    report = OrderedDict(
+        [
+            ("grass_version", gscript.version().get("version")),
+            ("repeat", args.repeat),
+            ("session", args.session),
+            ("results", results),
+        ]
+    )
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
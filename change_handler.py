@@ -16,8 +16,9 @@ class SignalFileChangeHandler(FileSystemEventHandler):
         if os.path.basename(event.src_path) == self.filename:
             tstamp = os.path.getmtime(event.src_path)
             if self.latest_timestamp != tstamp:
-                self.callback()
+                # callback can read when the scan was written
                 self.latest_timestamp = tstamp
+                self.callback()
 
 
 class RasterChangeHandler(FileSystemEventHandler):
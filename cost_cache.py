@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Cache of cost surfaces computed by r.walk or r.cost
+
+Accumulated cost and movement direction arrays are kept in memory
+by key describing all inputs (digests of input rasters, start
+coordinates, coefficients) together with the stop points they
+were computed for:
+
+    key = ("r.walk", region, digest(elevation), digest(friction), start, coeff)
+    cached = surfaces.get(key, stops)
+    if cached is None:
+        ...  # run r.walk, read cost and directions
+        surfaces.put(key, stops, cost, directions)
+
+Least recently used surfaces are evicted, and when spill directory
+is set, they are saved there and loaded again when needed.
+
+Scanned elevation differs by noise in each scan, so its digest
+is taken from versions, which keep the same digest until the
+elevation changes by more than tolerance in any cell:
+
+    versions.digest((region, name), elevation, tolerance)
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def digest(array):
+    """Returns digest of array content"""
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+class Versions:
+    """Digests of arrays (e.g. scans) by name which don't change
+    while the array stays within tolerance of the array
+    the digest was computed for (cells don't change from or to NaN
+    and don't move by more than tolerance)."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def digest(self, name, array, tolerance=0):
+        """Returns digest of the last version of array under name,
+        new version is created when array differs from it"""
+        with self._lock:
+            version = self._versions.get(name)
+        if (
+            tolerance
+            and version is not None
+            and self._same(version[0], array, tolerance)
+        ):
+            return version[1]
+        version = (array, digest(array))
+        with self._lock:
+            self._versions[name] = version
+        return version[1]
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+    @staticmethod
+    def _same(reference, array, tolerance):
+        if reference.shape != array.shape:
+            return False
+        valid = np.isfinite(array)
+        if not np.array_equal(valid, np.isfinite(reference)):
+            return False
+        return bool(np.all(np.abs(array[valid] - reference[valid]) <= tolerance))
+
+
+class CostSurfaces:
+    """LRU cache of cost and direction arrays.
+
+    @param size maximum number of surfaces in memory
+    @param spill directory for surfaces evicted from memory or None
+    @param spill_size maximum number of surfaces in spill directory
+    """
+
+    def __init__(self, size=16, spill=None, spill_size=64):
+        self.size = size
+        self.spill = spill
+        self.spill_size = spill_size
+        self.hits = 0
+        self.misses = 0
+        self._surfaces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, points=()):
+        """Returns (cost, directions) computed for key
+        if it was computed for all points, otherwise None"""
+        with self._lock:
+            entry = self._surfaces.get(key)
+            if entry:
+                self._surfaces.move_to_end(key)
+        if entry is None and self.spill:
+            entry = self._load(key)
+            if entry:
+                self._store(key, entry)
+        if entry and set(points) <= entry[0]:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, key, points, cost, directions):
+        """Stores cost and directions computed for key reaching points"""
+        cost.flags.writeable = False
+        directions.flags.writeable = False
+        self._store(key, (set(points), cost, directions))
+
+    def clear(self):
+        with self._lock:
+            self._surfaces.clear()
+        if self.spill:
+            for path in glob.glob(os.path.join(self.spill, "*.npz")):
+                os.remove(path)
+
+    def _store(self, key, entry):
+        evicted = []
+        with self._lock:
+            self._surfaces[key] = entry
+            self._surfaces.move_to_end(key)
+            while len(self._surfaces) > self.size:
+                evicted.append(self._surfaces.popitem(last=False))
+        if self.spill:
+            for each in evicted:
+                self._save(*each)
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.spill, name + ".npz")
+
+    def _save(self, key, entry):
+        try:
+            os.makedirs(self.spill, exist_ok=True)
+            with open(self._path(key), "wb") as f:
+                np.savez(
+                    f,
+                    points=np.array(sorted(entry[0]), dtype=str),
+                    cost=entry[1],
+                    directions=entry[2],
+                )
+            files = sorted(
+                glob.glob(os.path.join(self.spill, "*.npz")), key=os.path.getmtime
+            )
+            for path in files[: max(0, len(files) - self.spill_size)]:
+                os.remove(path)
+        except OSError as e:
+            print(e)
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                entry = (
+                    set(data["points"].tolist()),
+                    data["cost"],
+                    data["directions"],
+                )
+            os.remove(path)
+        except (OSError, KeyError, ValueError) as e:
+            print(e)
+            return None
+        entry[1].flags.writeable = False
+        entry[2].flags.writeable = False
+        return entry
+
+
+surfaces = CostSurfaces()
+versions = Versions()
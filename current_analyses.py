@@ -3,11 +3,18 @@
 This file serves as a control file with analyses
 which are running in real-time. The name of the analyses
 must start with 'run_'. The file has to be saved so that the change is applied.
+The newly imported scan is available in keyword argument 'scan_frame'
+(scan_frame.array is a NumPy array of the scanned elevation,
+scan_frame.index and scan_frame.timestamp identify the scan).
+Last scans are available in keyword argument 'scan_history'.
+Analyses decorated with @analysis(inputs=[...], outputs=[...])
+from analyses_graph can run in parallel (see Analyses tab).
 """
 import subprocess
 import uuid
 
 import analyses
+from analyses_graph import analysis
 from tangible_utils import get_environment
 import grass.script as gscript
 from grass.exceptions import CalledModuleError
@@ -18,6 +25,7 @@ from grass.exceptions import CalledModuleError
 #                         env=env, new='diff', color_coeff=1)
 #
 #
+# @analysis(inputs=["scanned_elev"], outputs=["contours_scanned"])
 # def run_contours(scanned_elev, env, **kwargs):
 #    analyses.contours(scanned_elev=scanned_elev, new='contours_scanned', env=env, step=2)
 
@@ -62,7 +70,7 @@ from grass.exceptions import CalledModuleError
 #    analyses.trail_salesman(trails='route_result', points='change', output='route_salesman', env=env)
 
 # def run_viewshed(real_elev, scanned_elev, env, **kwargs):
-#    analyses.viewshed(real_elev, output='viewshed', obs_elev=1.75, vector='change', visible_color='green', invisible_color='red', env=env)
+#    analyses.viewshed(real_elev, output='viewshed', obs_elev=1.75, vector='change', visible_color='green', invisible_color='red', cumulative='viewshed_count', env=env)
 
 # def run_colors(scanned_elev, scanned_color, env, **kwargs):
 #    if scanned_color:
@@ -46,6 +46,11 @@ from tangible_utils import (
 from drawing import DrawingPanel
 from export import OutputPanel
 from activities import ActivitiesPanel
+from scan_pipeline import ScanPipeline
+from scheduler import FrameScheduler
+from profiling import profiler
+import grass_session
+from scratch import remove_orphans, use_mapset
 from tangible_utils import get_show_layer_icon
 
 
@@ -146,6 +151,57 @@ class AnalysesPanel(wx.Panel):
         if self.settings["analyses"]["file"]:
             self.selectAnalyses.SetValue(self.settings["analyses"]["file"])
 
+        if "parallel" not in self.settings["analyses"]:
+            self.settings["analyses"]["parallel"] = False
+        self.parallel = wx.CheckBox(self, label="Run independent analyses in parallel")
+        self.parallel.SetToolTip(
+            "Analyses declaring their inputs and outputs with"
+            " @analysis decorator run concurrently"
+        )
+        self.parallel.SetValue(self.settings["analyses"]["parallel"])
+        self.parallel.Bind(wx.EVT_CHECKBOX, self.OnAnalysesChange)
+        if "session" not in self.settings["analyses"]:
+            self.settings["analyses"]["session"] = False
+        self.session = wx.CheckBox(self, label="Use persistent GRASS session")
+        self.session.SetToolTip(
+            "Change color tables, rename and remove maps"
+            " without starting GRASS modules"
+        )
+        self.session.SetValue(self.settings["analyses"]["session"])
+        self.session.Bind(wx.EVT_CHECKBOX, self.OnAnalysesChange)
+        grass_session.session.enabled = self.settings["analyses"]["session"]
+        if "timeout" not in self.settings["analyses"]:
+            self.settings["analyses"]["timeout"] = 120
+        self.timeout = SpinCtrl(
+            self, min=0, max=3600, initial=self.settings["analyses"]["timeout"]
+        )
+        self.timeout.SetToolTip(
+            "Maximum time in seconds to process one scan"
+            " before running GRASS modules are killed (0 for no limit)"
+        )
+        self.timeout.Bind(wx.EVT_SPINCTRL, self.OnAnalysesChange)
+        if "scratch" not in self.settings["analyses"]:
+            self.settings["analyses"]["scratch"] = ""
+        self.scratch = TextCtrl(self, value=self.settings["analyses"]["scratch"])
+        self.scratch.SetToolTip(
+            "Directory on RAM disk (e.g. /dev/shm) for temporary maps"
+            " of analyses (empty to use current mapset)"
+        )
+        self.scratch.Bind(wx.EVT_TEXT, self.OnAnalysesChange)
+
+        if "profile" not in self.settings["analyses"]:
+            self.settings["analyses"]["profile"] = False
+        profileBox = wx.StaticBox(self, label="  Profiling  ")
+        profileSizer = wx.StaticBoxSizer(profileBox, wx.VERTICAL)
+        self.profile = wx.CheckBox(self, label="Profile processing of scans")
+        self.profile.SetToolTip("Show FPS and duration of stages in status line")
+        self.profile.SetValue(self.settings["analyses"]["profile"])
+        self.profile.Bind(wx.EVT_CHECKBOX, self.OnAnalysesChange)
+        profiler.enabled = self.settings["analyses"]["profile"]
+        exportProfile = wx.Button(self, label="Export trace")
+        exportProfile.SetToolTip("Export profile of last frames in Chrome trace format")
+        exportProfile.Bind(wx.EVT_BUTTON, self.OnExportProfile)
+
         newAnalyses = wx.Button(self, label="Create new file with predefined analyses")
         newAnalyses.Bind(wx.EVT_BUTTON, lambda evt: self.CreateNewFile())
         self.selectAnalyses.Bind(wx.EVT_TEXT, self.OnAnalysesChange)
@@ -209,6 +265,26 @@ class AnalysesPanel(wx.Panel):
         fileSizer.Add(sizer, flag=wx.EXPAND | wx.ALL, border=5)
 
         sizer = wx.BoxSizer(wx.HORIZONTAL)
+        sizer.Add(self.parallel, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL)
+        sizer.AddStretchSpacer()
+        sizer.Add(self.session, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL)
+        fileSizer.Add(sizer, flag=wx.EXPAND | wx.ALL, border=5)
+
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        sizer.Add(
+            wx.StaticText(self, label="Timeout (s):"),
+            proportion=0,
+            flag=wx.ALIGN_CENTER_VERTICAL | wx.RIGHT,
+            border=5,
+        )
+        sizer.Add(self.timeout, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL)
+        sizer.Add(
+            wx.StaticText(self, label="Scratch directory:"),
+            proportion=0,
+            flag=wx.ALIGN_CENTER_VERTICAL | wx.LEFT | wx.RIGHT,
+            border=5,
+        )
+        sizer.Add(self.scratch, proportion=1, flag=wx.ALIGN_CENTER_VERTICAL)
         sizer.AddStretchSpacer()
         sizer.Add(
             newAnalyses,
@@ -219,6 +295,13 @@ class AnalysesPanel(wx.Panel):
         fileSizer.Add(sizer, flag=wx.EXPAND | wx.ALL, border=5)
         mainSizer.Add(fileSizer, flag=wx.EXPAND | wx.ALL, border=5)
 
+        sizer = wx.BoxSizer(wx.HORIZONTAL)
+        sizer.Add(self.profile, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL)
+        sizer.AddStretchSpacer()
+        sizer.Add(exportProfile, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL)
+        profileSizer.Add(sizer, flag=wx.EXPAND | wx.ALL, border=5)
+        mainSizer.Add(profileSizer, flag=wx.EXPAND | wx.ALL, border=5)
+
         # color training
         sizer = wx.BoxSizer(wx.HORIZONTAL)
         sizer.Add(
@@ -256,8 +339,29 @@ class AnalysesPanel(wx.Panel):
         ] = self.contoursStepTextCtrl.GetValue()
         self.settings["analyses"]["file"] = self.selectAnalyses.GetValue()
         self.settings["analyses"]["color_training"] = self.trainingAreas.GetValue()
+        self.settings["analyses"]["parallel"] = self.parallel.GetValue()
+        self.settings["analyses"]["session"] = self.session.GetValue()
+        grass_session.session.enabled = self.session.GetValue()
+        self.settings["analyses"]["timeout"] = self.timeout.GetValue()
+        self.settings["analyses"]["scratch"] = self.scratch.GetValue().strip()
+        self.settings["analyses"]["profile"] = self.profile.GetValue()
+        profiler.enabled = self.profile.GetValue()
         self.settingsChanged.emit()
 
+    def OnExportProfile(self, event):
+        if not profiler.frames():
+            gscript.warning("No profiled frames, enable profiling first")
+            return
+        dlg = wx.FileDialog(
+            self,
+            message="Export profile",
+            wildcard="JSON file (*.json)|*.json",
+            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT,
+        )
+        if dlg.ShowModal() == wx.ID_OK:
+            profiler.export_chrome_trace(dlg.GetPath())
+        dlg.Destroy()
+
     def CreateNewFile(self):
         get_lib_path("g.gui.tangible")
         dlg = wx.FileDialog(
@@ -814,17 +918,32 @@ class TangibleLandscapePlugin(wx.Dialog):
         if "tangible" not in self.settings:
             self.settings["tangible"] = {
                 "calibration": {"matrix": None},
-                "analyses": {"file": None, "contours": None, "contours_step": 1},
+                "analyses": {
+                    "file": None,
+                    "contours": None,
+                    "contours_step": 1,
+                    "parallel": False,
+                    "session": False,
+                    "timeout": 120,
+                    "profile": False,
+                },
             }
         self.calib_matrix = self.settings["tangible"]["calibration"]["matrix"]
 
         self.delay = 0.3
         self.process = None
         self.observer = None
+        self.signalHandler = None
         self.signal_file = None
         self.timer = wx.Timer(self)
         self.changedInput = False
         self.filter = {"filter": False, "counter": 0, "threshold": 0.1, "debug": False}
+        self.pipeline = ScanPipeline()
+        self.scheduler = FrameScheduler(
+            onProcessed=lambda: wx.CallAfter(self._updateSchedulerStatus),
+            timeout=lambda: self.settings["tangible"]["analyses"].get("timeout", 120),
+            onStopped=lambda: wx.CallAfter(self._onSchedulerStopped),
+        )
         # to be able to add params to runAnalyses from outside
         self.additionalParams4Analyses = {}
 
@@ -954,14 +1073,18 @@ class TangibleLandscapePlugin(wx.Dialog):
 
     def OnClose(self, event):
         self.Stop()
+        # cancelled analyses need to finish before the session is stopped
+        self.scheduler.stop()
+        grass_session.session.stop()
         UserSettings.SaveToFile(self.settings)
         if self.signal_file and os.path.exists(self.signal_file):
             os.remove(self.signal_file)
         self.Destroy()
 
     def OnUpdate(self, event=None):
-        for each in self.giface.GetAllMapDisplays():
-            each.GetMapWindow().UpdateMap(delay=self.delay)
+        with profiler.span("redraw", frame=profiler.last):
+            for each in self.giface.GetAllMapDisplays():
+                each.GetMapWindow().UpdateMap(delay=self.delay)
 
     def CalibrateModelBBox(self, event):
         if self.IsScanning():
@@ -1221,6 +1344,8 @@ class TangibleLandscapePlugin(wx.Dialog):
             self.status.SetLabel("Importing scan...")
             self.process.communicate()
             self.process = None
+            # scanning once always runs analyses
+            self.pipeline.invalidate()
             run_analyses(
                 settings=self.settings,
                 analysesFile=self.settings["tangible"]["analyses"]["file"],
@@ -1228,6 +1353,7 @@ class TangibleLandscapePlugin(wx.Dialog):
                 update=self.OnUpdate,
                 eventHandler=self,
                 scanFilter=self.filter,
+                pipeline=self.pipeline,
             )
             self.status.SetLabel("Done.")
             self.OnUpdate(None)
@@ -1260,6 +1386,9 @@ class TangibleLandscapePlugin(wx.Dialog):
 
     def Start(self):
         self.EnableDataCatalogWatchdog(False)
+        # temporary maps left by crashed processing
+        remove_orphans()
+        use_mapset(self.settings["tangible"]["analyses"].get("scratch"))
         self.Scan(continuous=True)
         self.status.SetLabel("Real-time scanning is running now.")
 
@@ -1275,12 +1404,14 @@ class TangibleLandscapePlugin(wx.Dialog):
         paths = [os.path.dirname(self._getSignalFile()), path2]
         handlers = [
             SignalFileChangeHandler(
-                self.runImport, os.path.basename(self._getSignalFile())
+                self.scheduleImport, os.path.basename(self._getSignalFile())
             ),
             DrawingChangeHandler(
-                self.runImportDrawing, self.settings["tangible"]["drawing"]["name"]
+                self.scheduleImportDrawing, self.settings["tangible"]["drawing"]["name"]
             ),
         ]
+        self.signalHandler = handlers[0]
+        self.scheduler.start()
 
         self.observer = Observer()
         for path, handler in zip(paths, handlers):
@@ -1301,48 +1432,95 @@ class TangibleLandscapePlugin(wx.Dialog):
                     pass
                 self.observer.join()
                 self.observer = None
+        # running analyses are cancelled, GUI doesn't wait for them
+        self.scheduler.stop(wait=False)
+        self.pipeline.skipped = 0
         self.timer.Stop()
         self.status.SetLabel("Real-time scanning stopped.")
         self.pause = False
         self.btnPause.SetLabel("Pause")
         self.EnableDataCatalogWatchdog(True)
 
+    def _onSchedulerStopped(self):
+        # window was closed or scanning was started again in the meantime
+        if not self or self.scheduler.running:
+            return
+        self.scheduler.reset_counters()
+        use_mapset(None)
+
     def Pause(self):
         if self.process and self.process.poll() is None:  # still running
             if not self.pause:
                 self.pause = True
                 self.btnPause.SetLabel("Resume")
+                self.scheduler.cancel()
             else:
                 self.pause = False
                 self.btnPause.SetLabel("Pause")
             self.changedInput = True
 
-    def runImport(self):
-        run_analyses(
-            settings=self.settings,
-            analysesFile=self.settings["tangible"]["analyses"]["file"],
-            giface=self.giface,
-            update=self.OnUpdate,
-            eventHandler=self,
-            scanFilter=self.filter,
-            **self.additionalParams4Analyses
+    def _updateSchedulerStatus(self):
+        if not self.observer:
+            return
+        label = "Real-time scanning is running now. Processed: {}, dropped: {}".format(
+            self.scheduler.processed, self.scheduler.dropped
         )
+        if self.pipeline.skipped:
+            label += ", unchanged: {}".format(self.pipeline.skipped)
+        if self.scheduler.timedOut:
+            label += ", timed out: {}".format(self.scheduler.timedOut)
+        if profiler.enabled:
+            label += " | " + profiler.summary_text()
+        self.status.SetLabel(label)
+
+    def postUpdate(self, event=None):
+        """Requests update of map displays, can be called from any thread"""
         evt = updateGUIEvt(self.GetId())
         wx.PostEvent(self, evt)
 
-    def runImportDrawing(self):
-        self.drawing_panel.appendVector()
-        run_analyses(
-            settings=self.settings,
-            analysesFile=self.settings["tangible"]["analyses"]["file"],
-            giface=self.giface,
-            update=self.OnUpdate,
-            eventHandler=self,
-            scanFilter=self.filter,
-            **self.additionalParams4Analyses
+    def scheduleImport(self):
+        frame = profiler.begin_frame(signal=self.signalHandler.latest_timestamp)
+        self.scheduler.submit("scan", lambda job: self.runImport(job, frame))
+
+    def scheduleImportDrawing(self):
+        frame = profiler.begin_frame()
+        self.scheduler.submit(
+            "drawing", lambda job: self.runImportDrawing(job, frame), coalesce=False
         )
-        evt = updateGUIEvt(self.GetId())
-        wx.PostEvent(self, evt)
+
+    def runImport(self, job=None, frame=None):
+        with profiler.frame(frame):
+            processed = run_analyses(
+                settings=self.settings,
+                analysesFile=self.settings["tangible"]["analyses"]["file"],
+                giface=self.giface,
+                update=self.postUpdate,
+                eventHandler=self,
+                scanFilter=self.filter,
+                pipeline=self.pipeline,
+                job=job,
+                **self.additionalParams4Analyses
+            )
+        # unchanged scan doesn't need redrawing
+        if processed:
+            self.postUpdate()
+
+    def runImportDrawing(self, job=None, frame=None):
+        with profiler.frame(frame):
+            with profiler.span("append drawing"):
+                self.drawing_panel.appendVector()
+            run_analyses(
+                settings=self.settings,
+                analysesFile=self.settings["tangible"]["analyses"]["file"],
+                giface=self.giface,
+                update=self.postUpdate,
+                eventHandler=self,
+                scanFilter=self.filter,
+                pipeline=self.pipeline,
+                job=job,
+                **self.additionalParams4Analyses
+            )
+        self.postUpdate()
 
     def postEvent(self, receiver, event):
         wx.PostEvent(receiver, event)
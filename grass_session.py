@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Persistent GRASS session for fast metadata operations
+
+Modules like r.colors, g.remove, g.rename or v.edit tool=create take
+much less time than starting the module process. A worker process
+keeps GRASS libraries initialized and performs these operations
+through the library API (ctypes, pygrass); analyses send it requests
+over a pipe. Calls the worker doesn't support (other modules
+or parameters) or which fail in the worker are run as usual modules.
+
+    import grass_session
+
+    grass_session.session.enabled = True
+    grass_session.run_command("r.colors", map="slope", color="slope", env=env)
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import sys
+import json
+import atexit
+import tempfile
+import threading
+import traceback
+from subprocess import PIPE, Popen
+
+from grass.script import core as gcore
+
+MODULES = ("r.colors", "g.remove", "g.rename", "v.edit")
+# raster elements removed and renamed together with the map (as g.remove
+# and g.rename do), secondary color table (colr2/<mapset>) is added by worker
+RASTER_ELEMENTS = ("cellhd", "cell", "fcell", "cats", "colr", "hist", "cell_misc")
+# worker is not restarted after this many crashes
+MAX_FAILURES = 3
+
+
+class GrassSession:
+    """Client of the worker process, starts it on first request.
+    Disabled by default, then all calls run modules as usual.
+    Can be used from multiple threads, requests are processed one at a time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.handled = 0
+        self.fallbacks = 0
+        self._process = None
+        self._failures = 0
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        """Starts worker process unless it is running"""
+        with self._lock:
+            return self._start()
+
+    def _start(self):
+        if self._process and self._process.poll() is None:
+            return True
+        if self._failures >= MAX_FAILURES:
+            return False
+        try:
+            self._process = Popen(
+                [sys.executable, "-u", os.path.abspath(__file__)],
+                stdin=PIPE,
+                stdout=PIPE,
+                universal_newlines=True,
+                env=os.environ.copy(),
+            )
+            reply = json.loads(self._process.stdout.readline())
+        except (OSError, ValueError):
+            reply = {"status": "error"}
+        if reply.get("status") != "ready":
+            print("GRASS session worker failed to start: {}".format(reply))
+            self._failures += 1
+            self._kill()
+            return False
+        return True
+
+    def stop(self):
+        """Stops worker process, it is started again by the next request"""
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if self._process and self._process.poll() is None:
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=5)
+            except Exception:
+                self._kill()
+        self._process = None
+
+    def _kill(self):
+        if self._process:
+            try:
+                self._process.kill()
+                self._process.wait()
+            except OSError:
+                pass
+        self._process = None
+
+    def _request(self, module, kwargs, stdin=None):
+        """Sends request to worker, returns True if worker did it"""
+        env = kwargs.pop("env", None) or os.environ
+        # worker runs in the session it was started in
+        if env.get("GISRC") != os.environ.get("GISRC"):
+            return False
+        request = {
+            "module": module,
+            "kwargs": kwargs,
+            "stdin": stdin,
+            "gisrc": env.get("GISRC"),
+            "overwrite": bool(kwargs.get("overwrite"))
+            or env.get("GRASS_OVERWRITE") == "1",
+        }
+        try:
+            line = json.dumps(request) + "\n"
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            if not self._start():
+                return False
+            try:
+                self._process.stdin.write(line)
+                self._process.stdin.flush()
+                reply = json.loads(self._process.stdout.readline())
+            except (OSError, ValueError):
+                # worker crashed (e.g. fatal error in library)
+                self._failures += 1
+                self._kill()
+                return False
+            if reply["status"] == "restart":
+                # mapset changed, worker initialized in the new mapset next time
+                self._stop()
+        return reply["status"] == "done"
+
+    def _call(self, module, kwargs, stdin=None):
+        if self.enabled and module in MODULES:
+            if self._request(module, dict(kwargs), stdin):
+                self.handled += 1
+                return True
+            self.fallbacks += 1
+        return False
+
+    def run_command(self, module, **kwargs):
+        if not self._call(module, kwargs):
+            return gcore.run_command(module, **kwargs)
+
+    def write_command(self, module, stdin, **kwargs):
+        if not self._call(module, kwargs, stdin):
+            return gcore.write_command(module, stdin=stdin, **kwargs)
+
+
+class Unsupported(Exception):
+    """Request has to be run as module"""
+
+
+def _names(value):
+    if isinstance(value, str):
+        value = value.split(",")
+    return [name for name in value if name]
+
+
+def _flags(kwargs):
+    return kwargs.pop("flags", "") or ""
+
+
+class SessionWorker:
+    """Performs requests in the worker process using GRASS libraries"""
+
+    # parameters which don't change result of the supported modules
+    IGNORED = ("quiet", "verbose", "superquiet", "overwrite")
+
+    def __init__(self):
+        import ctypes
+        import grass.lib.gis as libgis
+        import grass.lib.raster as libraster
+        import grass.lib.vector as libvector
+        from grass.script.utils import decode, encode
+
+        self.ctypes = ctypes
+        self.libgis = libgis
+        self.libraster = libraster
+        self.libvector = libvector
+        self.decode = decode
+        self.encode = encode
+        libgis.G_gisinit(encode("tangible_session"))
+        self.gisrc = os.environ.get("GISRC")
+        self.mapset = decode(libgis.G_mapset())
+        self.path = os.path.join(
+            decode(libgis.G_gisdbase()), decode(libgis.G_location()), self.mapset
+        )
+
+    def current(self, gisrc):
+        """Checks the request is for the mapset of the worker"""
+        if gisrc != self.gisrc:
+            return False
+        with open(gisrc) as f:
+            variables = dict(
+                line.strip().split(": ", 1) for line in f if ": " in line.strip()
+            )
+        return (
+            os.path.join(
+                variables.get("GISDBASE", ""),
+                variables.get("LOCATION_NAME", ""),
+                variables.get("MAPSET", ""),
+            )
+            == self.path
+        )
+
+    def handle(self, request):
+        kwargs = {
+            key: value
+            for key, value in request["kwargs"].items()
+            if key not in self.IGNORED
+        }
+        module = request["module"]
+        if module == "r.colors":
+            self.colors(kwargs, request["stdin"])
+        elif module == "g.remove":
+            self.remove(kwargs)
+        elif module == "g.rename":
+            self.rename(kwargs, request["overwrite"])
+        elif module == "v.edit":
+            self.create_vector(kwargs, request["overwrite"])
+        else:
+            raise Unsupported(module)
+
+    def _local(self, name):
+        """Returns name of map in current mapset, fails for other mapsets"""
+        if "@" in name:
+            name, mapset = name.split("@", 1)
+            if mapset != self.mapset:
+                raise Unsupported("map in other mapset")
+        return name
+
+    def _raster_file(self, element, name):
+        return os.path.join(self.path, element, name)
+
+    def _is_reclass(self, name):
+        with open(self._raster_file("cellhd", name)) as f:
+            if f.read(7) == "reclass":
+                return True
+        return os.path.exists(
+            os.path.join(self._raster_file("cell_misc", name), "reclassed_to")
+        )
+
+    def colors(self, kwargs, stdin):
+        ctypes = self.ctypes
+        lib = self.libraster
+        name = self._local(kwargs.pop("map"))
+        color = kwargs.pop("color", None)
+        raster = kwargs.pop("raster", None)
+        rules = kwargs.pop("rules", None)
+        if _flags(kwargs) or kwargs or [color, raster, rules].count(None) != 2:
+            raise Unsupported("parameters")
+        if not os.path.exists(self._raster_file("cellhd", name)):
+            raise Unsupported("missing map")
+        mapset = self.encode(self.mapset)
+        ename = self.encode(name)
+        colors = lib.Colors()
+        lib.Rast_init_colors(ctypes.byref(colors))
+        try:
+            if raster:
+                other = raster.split("@")
+                found = self.libgis.G_find_raster2(
+                    self.encode(other[0]), self.encode(other[1] if other[1:] else "")
+                )
+                if not found or (
+                    lib.Rast_read_colors(
+                        self.encode(other[0]), found, ctypes.byref(colors)
+                    )
+                    < 0
+                ):
+                    raise Unsupported("colors of raster")
+            else:
+                fp = lib.Rast_map_is_fp(ename, mapset)
+                if fp:
+                    fprange = lib.FPRange()
+                    if lib.Rast_read_fp_range(ename, mapset, ctypes.byref(fprange)) < 0:
+                        raise Unsupported("range")
+                    low, high = lib.DCELL(), lib.DCELL()
+                    lib.Rast_get_fp_range_min_max(
+                        ctypes.byref(fprange), ctypes.byref(low), ctypes.byref(high)
+                    )
+                else:
+                    crange = lib.Range()
+                    if lib.Rast_read_range(ename, mapset, ctypes.byref(crange)) < 0:
+                        raise Unsupported("range")
+                    low, high = lib.CELL(), lib.CELL()
+                    lib.Rast_get_range_min_max(
+                        ctypes.byref(crange), ctypes.byref(low), ctypes.byref(high)
+                    )
+                if color:
+                    path = os.path.join(os.environ["GISBASE"], "etc", "colors", color)
+                    # library exits on unknown color table
+                    if not os.path.isfile(path):
+                        raise Unsupported("color table")
+                    if fp:
+                        lib.Rast_make_fp_colors(
+                            ctypes.byref(colors), self.encode(color), low, high
+                        )
+                    else:
+                        lib.Rast_make_colors(
+                            ctypes.byref(colors), self.encode(color), low, high
+                        )
+                else:
+                    self._load_rules(colors, rules, stdin, fp, low, high)
+            lib.Rast_write_colors(ename, mapset, ctypes.byref(colors))
+        finally:
+            lib.Rast_free_colors(ctypes.byref(colors))
+
+    def _load_rules(self, colors, rules, stdin, fp, low, high):
+        lib = self.libraster
+        path = rules
+        if rules == "-":
+            if stdin is None:
+                raise Unsupported("rules")
+            fd, path = tempfile.mkstemp()
+            with os.fdopen(fd, "w") as f:
+                f.write(stdin)
+        try:
+            load = lib.Rast_load_fp_colors if fp else lib.Rast_load_colors
+            if not load(self.ctypes.byref(colors), self.encode(path), low, high):
+                raise Unsupported("rules")
+        finally:
+            if rules == "-":
+                os.remove(path)
+
+    def _raster_elements(self):
+        return RASTER_ELEMENTS + ("colr2/" + self.mapset,)
+
+    def _remove_raster(self, name):
+        for element in self._raster_elements():
+            if self.libgis.G_remove(self.encode(element), self.encode(name)) < 0:
+                raise Unsupported("remove " + element)
+
+    def _vector_exists(self, name):
+        return bool(
+            self.libgis.G_find_vector2(self.encode(name), self.encode(self.mapset))
+        )
+
+    def remove(self, kwargs):
+        types = _names(kwargs.pop("type"))
+        names = [self._local(name) for name in _names(kwargs.pop("name"))]
+        if "f" not in _flags(kwargs) or kwargs:
+            raise Unsupported("parameters")
+        for maptype in types:
+            if maptype not in ("raster", "vector"):
+                raise Unsupported("type")
+            if maptype == "raster":
+                for name in names:
+                    if os.path.exists(
+                        self._raster_file("cellhd", name)
+                    ) and self._is_reclass(name):
+                        raise Unsupported("reclass")
+        for maptype in types:
+            for name in names:
+                if maptype == "raster":
+                    self._remove_raster(name)
+                elif self._vector_exists(name):
+                    # removes attribute tables as g.remove
+                    if self.libvector.Vect_delete(self.encode(name)) < 0:
+                        raise Unsupported("remove vector")
+
+    def rename(self, kwargs, overwrite):
+        if _flags(kwargs) or list(kwargs.keys()) != ["raster"]:
+            raise Unsupported("parameters")
+        old, new = [self._local(name) for name in _names(kwargs["raster"])]
+        if not os.path.exists(self._raster_file("cellhd", old)):
+            raise Unsupported("missing map")
+        if os.path.exists(self._raster_file("cellhd", new)):
+            if not overwrite or self._is_reclass(new):
+                raise Unsupported("existing map")
+        if self._is_reclass(old):
+            raise Unsupported("reclass")
+        self._remove_raster(new)
+        for element in self._raster_elements():
+            if (
+                self.libgis.G_rename(
+                    self.encode(element), self.encode(old), self.encode(new)
+                )
+                < 0
+            ):
+                raise Unsupported("rename " + element)
+
+    def create_vector(self, kwargs, overwrite):
+        from grass.pygrass.vector import VectorTopo
+
+        name = self._local(kwargs.pop("map"))
+        if kwargs.pop("tool", None) != "create" or _flags(kwargs) or kwargs:
+            raise Unsupported("parameters")
+        vector = VectorTopo(name)
+        if vector.exist() and not overwrite:
+            raise Unsupported("existing map")
+        vector.open("w", overwrite=True)
+        vector.close()
+
+
+def serve():
+    """Processes requests (JSON lines) from stdin, replies to stdout"""
+    # messages of GRASS libraries go to stderr, stdout is for replies
+    replies = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+
+    def reply(status, message=None):
+        replies.write(json.dumps({"status": status, "message": message}) + "\n")
+        replies.flush()
+
+    try:
+        worker = SessionWorker()
+    except Exception:
+        reply("error", traceback.format_exc())
+        return
+    reply("ready")
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            if not worker.current(request["gisrc"]):
+                reply("restart")
+                return
+            worker.handle(request)
+            reply("done")
+        except Unsupported as e:
+            reply("unsupported", str(e))
+        except Exception:
+            reply("unsupported", traceback.format_exc())
+
+
+session = GrassSession()
+
+
+def run_command(module, **kwargs):
+    """Same as grass.script.run_command, uses session when enabled"""
+    return session.run_command(module, **kwargs)
+
+
+def write_command(module, stdin, **kwargs):
+    """Same as grass.script.write_command, uses session when enabled"""
+    return session.write_command(module, stdin, **kwargs)
+
+
+if __name__ == "__main__":
+    serve()
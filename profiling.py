@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Profiling of processing of scans
+
+Each processed frame gets an ID and a list of timestamped stages
+(spans), last frames are kept in a ring buffer and can be exported
+to Chrome trace format (open in chrome://tracing or Perfetto).
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import json
+import time
+import itertools
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+
+class Frame:
+    """Processed frame with spans (name, category, start, end, thread)"""
+
+    def __init__(self, id, start):
+        self.id = id
+        self.start = start
+        self.end = None
+        self.spans = []
+        # analyses were skipped because scan didn't change
+        self.skipped = False
+
+    def add_span(self, name, category, start, end):
+        self.spans.append((name, category, start, end, threading.get_ident()))
+
+
+class FrameProfiler:
+    """Records stages of processed frames, disabled by default.
+    Spans are added to the frame currently being processed
+    (frames are processed one at a time) from any thread."""
+
+    def __init__(self, size=500):
+        self.enabled = False
+        self.current = None
+        self.last = None
+        self._frames = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def begin_frame(self, signal=None):
+        """Creates new frame when profiling is enabled.
+
+        @param signal time when the scan was written (signal file changed)
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        frame = Frame(next(self._ids), now)
+        if signal:
+            frame.start = min(signal, now)
+            frame.add_span("notify", "scan", frame.start, now)
+        return frame
+
+    @contextmanager
+    def frame(self, frame):
+        """Makes frame current while processing it, adds it to the ring buffer"""
+        if frame is None:
+            yield None
+            return
+        queued = frame.spans[-1][3] if frame.spans else frame.start
+        frame.add_span("queue", "scan", queued, time.time())
+        self.current = frame
+        try:
+            yield frame
+        finally:
+            self.current = None
+            frame.end = time.time()
+            with self._lock:
+                self._frames.append(frame)
+            self.last = frame
+
+    @contextmanager
+    def span(self, name, category="stage", frame=None):
+        """Records span in the given or current frame"""
+        frame = frame or self.current
+        if not self.enabled or frame is None:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            frame.add_span(name, category, start, time.time())
+
+    def skip(self, frame=None):
+        """Marks the given or current frame as skipped"""
+        frame = frame or self.current
+        if frame is not None:
+            frame.skipped = True
+
+    def frames(self):
+        with self._lock:
+            return list(self._frames)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+        self.last = None
+
+    def summary(self, seconds=5):
+        """Returns frames per second and mean duration
+        of each stage in ms of processed (not skipped) frames
+        finished in last seconds"""
+        now = time.time()
+        frames = [f for f in self.frames() if f.end >= now - seconds]
+        stages = OrderedDict()
+        for frame in frames:
+            if frame.skipped:
+                continue
+            for name, category, start, end, thread in frame.spans:
+                stages.setdefault(name, []).append(end - start)
+        fps = 0
+        if len(frames) > 1:
+            fps = (len(frames) - 1) / max(frames[-1].end - frames[0].end, 1e-6)
+        return fps, OrderedDict(
+            (name, 1000 * sum(values) / len(values)) for name, values in stages.items()
+        )
+
+    def skipped(self, seconds=5):
+        """Returns number of skipped frames finished in last seconds"""
+        now = time.time()
+        return sum(1 for f in self.frames() if f.skipped and f.end >= now - seconds)
+
+    def summary_text(self, seconds=5):
+        fps, stages = self.summary(seconds)
+        return "{:.1f} FPS ({} skipped); {}".format(
+            fps,
+            self.skipped(seconds),
+            ", ".join("{} {:.0f} ms".format(k, v) for k, v in stages.items()),
+        )
+
+    def chrome_trace(self):
+        """Returns frames in Chrome trace event format"""
+        events = []
+        for frame in self.frames():
+            events.append(
+                {
+                    "name": "frame {}".format(frame.id),
+                    "cat": "frame",
+                    "ph": "X",
+                    "ts": frame.start * 1e6,
+                    "dur": (frame.end - frame.start) * 1e6,
+                    "pid": 1,
+                    "tid": 0,
+                    "args": {"frame": frame.id, "skipped": frame.skipped},
+                }
+            )
+            for name, category, start, end, thread in frame.spans:
+                events.append(
+                    {
+                        "name": name,
+                        "cat": category,
+                        "ph": "X",
+                        "ts": start * 1e6,
+                        "dur": (end - start) * 1e6,
+                        "pid": 1,
+                        "tid": thread,
+                        "args": {"frame": frame.id},
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+profiler = FrameProfiler()
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Processing of incoming scans before analyses are run
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+from grass.exceptions import CalledModuleError
+
+import grass_session
+from tangible_utils import (
+    read_raster_header,
+    region_from_header,
+    read_raster_array,
+    write_raster_array,
+    cache_raster_array,
+)
+
+
+class ScanFrame:
+    """New scan imported by ScanPipeline.
+    Data are available as NumPy array (nulls are NaN).
+    Index is increasing number of the accepted scan,
+    timestamp is the time of import (seconds since epoch)."""
+
+    def __init__(self, name, header, array, index=None, timestamp=None):
+        self.name = name
+        self.header = header
+        self.array = array
+        self.index = index
+        self.timestamp = timestamp
+        # mask of pixels occluded by hands (OcclusionDetector)
+        self.occlusion = None
+        # cells changed since the previous scan (DirtyRegion)
+        self.dirty = None
+        # scan was skipped by ChangeGate
+        self.unchanged = False
+        valid = array[np.isfinite(array)]
+        if valid.size:
+            self.min = float(valid.min())
+            self.max = float(valid.max())
+        else:
+            self.min = self.max = None
+
+    @property
+    def region(self):
+        """GRASS_REGION string matching the scan"""
+        return region_from_header(self.header)
+
+
+class DirtyRegion:
+    """Bounding box of cells changed since the previous scan.
+
+    @param header header (region) of the scan
+    @param bbox (first row, last row + 1, first col, last col + 1)
+    or None if nothing changed
+    @param since index of the scan the changes are computed against
+    @param index index of the scan
+    @param key key (analyses and settings) the scan was imported with
+    """
+
+    def __init__(self, header, bbox, since=None, index=None, key=None):
+        self.header = header
+        self.bbox = bbox
+        self.since = since
+        self.index = index
+        self.key = key
+
+    @property
+    def empty(self):
+        return self.bbox is None
+
+    @property
+    def full(self):
+        return self.bbox == (0, self.header["rows"], 0, self.header["cols"])
+
+    def window(self, pad=0):
+        """Returns header of the bounding box enlarged by pad cells"""
+        h = self.header
+        row0, row1, col0, col1 = self.bbox
+        row0 = max(row0 - pad, 0)
+        col0 = max(col0 - pad, 0)
+        row1 = min(row1 + pad, h["rows"])
+        col1 = min(col1 + pad, h["cols"])
+        window = dict(h)
+        window["north"] = h["north"] - row0 * h["n-s resol"]
+        window["south"] = h["north"] - row1 * h["n-s resol"]
+        window["west"] = h["west"] + col0 * h["e-w resol"]
+        window["east"] = h["west"] + col1 * h["e-w resol"]
+        window["rows"] = row1 - row0
+        window["cols"] = col1 - col0
+        return window
+
+    def region(self, pad=0):
+        """Returns GRASS_REGION of the bounding box enlarged by pad cells"""
+        return region_from_header(self.window(pad))
+
+    def matches(self, grid):
+        """Checks if grid (parsed region or header) is the grid of the scan"""
+        try:
+            return all(
+                np.isclose(self.header[key], grid[key])
+                for key in ("north", "south", "east", "west", "rows", "cols")
+            )
+        except KeyError:
+            return False
+
+    @classmethod
+    def compare(cls, header, array, previous, tolerance=0, ignore=None):
+        """Creates DirtyRegion of cells changed more than tolerance
+        except cells where ignore (boolean array) is True"""
+        if previous is None or previous.shape != array.shape:
+            return cls(header, (0, array.shape[0], 0, array.shape[1]))
+        with np.errstate(invalid="ignore"):
+            changed = np.abs(array - previous) > tolerance
+        changed |= np.isnan(array) != np.isnan(previous)
+        if ignore is not None:
+            changed &= ~ignore
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not rows.size:
+            return cls(header, None)
+        cols = np.flatnonzero(changed.any(axis=0))
+        return cls(
+            header, (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)
+        )
+
+
+class ScanHistory:
+    """Ring buffer of last accepted scans (ScanFrame objects).
+    Arrays are shared with the frames (read-only), no rasters are written
+    unless requested with write(). Indexing works as with lists,
+    history[-1] is the latest scan."""
+
+    def __init__(self, size=10):
+        self._frames = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._frames.maxlen
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __getitem__(self, item):
+        with self._lock:
+            return list(self._frames)[item]
+
+    def append(self, frame):
+        with self._lock:
+            self._frames.append(frame)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+    def frames(self, count=None):
+        """Returns list of last count frames (all by default), oldest first"""
+        with self._lock:
+            frames = list(self._frames)
+        return frames[-count:] if count else frames
+
+    def get(self, index):
+        """Returns frame with the given frame index or None"""
+        for frame in self.frames():
+            if frame.index == index:
+                return frame
+        return None
+
+    def stack(self, count=None):
+        """Returns 3D array of last count scans with the same region
+        as the latest scan, oldest first"""
+        frames = self.frames(count)
+        if not frames:
+            return None
+        region = frames[-1].region
+        return np.stack([f.array for f in frames if f.region == region])
+
+    def write(self, frame, name, env=None):
+        """Writes scan from history as raster in the region of the scan"""
+        env = env.copy() if env else os.environ.copy()
+        env["GRASS_REGION"] = frame.region
+        write_raster_array(frame.array, name, env=env)
+
+
+class TemporalFilter:
+    """Filters noise of scans over time.
+
+    @param method 'ema' (exponential moving average), 'median'
+    (per-pixel median of last frames) or 'none'
+    @param alpha weight of the new scan for 'ema'
+    @param frames number of scans for 'median'
+    @param reject pixels higher than filtered elevation by more than this value
+    (hands above the model) are replaced by the filtered elevation
+    and not used for filtering, None to disable
+    """
+
+    def __init__(self, method="ema", alpha=0.5, frames=5, reject=None):
+        if method not in ("ema", "median", "none"):
+            raise ValueError("Unknown temporal filter method <{}>".format(method))
+        self.method = method
+        self.alpha = float(alpha)
+        self.reject = reject
+        self._frames = deque(maxlen=int(frames))
+        self._filtered = None
+
+    def reset(self):
+        self._frames.clear()
+        self._filtered = None
+
+    def apply(self, array):
+        """Returns filtered array, resets when shape of scans changes"""
+        if self._filtered is not None and self._filtered.shape != array.shape:
+            self.reset()
+        if self._filtered is None:
+            self._filtered = array.astype(np.float32)
+            self._frames.append(self._filtered)
+            return self._filtered
+        previous = self._filtered
+        array = array.astype(np.float32)
+        with np.errstate(invalid="ignore"):
+            if self.reject is not None:
+                rejected = array - previous > self.reject
+                array[rejected] = previous[rejected]
+            missing = np.isnan(array)
+            array[missing] = previous[missing]
+            if self.method == "ema":
+                filtered = self.alpha * array + (1 - self.alpha) * previous
+                # pixels without previous value
+                filtered = np.where(np.isnan(previous), array, filtered)
+            elif self.method == "median":
+                self._frames.append(array)
+                filtered = np.nanmedian(np.stack(self._frames), axis=0)
+            else:
+                filtered = array
+        self._filtered = filtered.astype(np.float32)
+        return self._filtered
+
+
+class OcclusionDetector:
+    """Detects pixels which rise above the rolling baseline
+    (per-pixel median of last accepted scans) by more than threshold,
+    typically hands between the sensor and the model.
+    Pixels which stay raised for persist scans are considered
+    a real change of the model (e.g. added sand).
+
+    @param threshold minimum height above baseline
+    @param action 'skip' to reject scans with occlusion,
+    'patch' to replace occluded pixels by last accepted values
+    @param min_cells minimum number of occluded pixels to take action
+    @param baseline number of scans for baseline
+    @param persist number of scans after which raised pixel is accepted
+    """
+
+    def __init__(self, threshold, action="patch", min_cells=1, baseline=5, persist=10):
+        if action not in ("skip", "patch"):
+            raise ValueError("Unknown occlusion action <{}>".format(action))
+        self.threshold = float(threshold)
+        self.action = action
+        self.min_cells = int(min_cells)
+        self.persist = int(persist)
+        self._frames = deque(maxlen=int(baseline))
+        self._raised = None
+
+    def reset(self):
+        self._frames.clear()
+        self._raised = None
+
+    def detect(self, array):
+        """Returns occlusion mask (True for occluded pixels)"""
+        if self._frames and self._frames[-1].shape != array.shape:
+            self.reset()
+        if not self._frames:
+            self._raised = np.zeros(array.shape, dtype=np.int32)
+            return np.zeros(array.shape, dtype=bool)
+        baseline = np.nanmedian(np.stack(self._frames), axis=0)
+        with np.errstate(invalid="ignore"):
+            raised = array - baseline > self.threshold
+        self._raised = np.where(raised, self._raised + 1, 0)
+        return raised & (self._raised < self.persist)
+
+    def apply(self, array):
+        """Returns (array, mask) where occluded pixels are patched,
+        or (None, mask) if the scan should be skipped"""
+        mask = self.detect(array)
+        occluded = np.count_nonzero(mask) >= self.min_cells
+        if occluded and self.action == "skip":
+            return None, mask
+        if occluded:
+            array = array.astype(np.float32)
+            array[mask] = self._frames[-1][mask]
+        self._frames.append(array)
+        return array, mask
+
+
+class ChangeGate:
+    """Detects scans which are effectively identical to the last
+    processed scan, so that analyses don't need to run again.
+    Scans are compared on a grid subsampled by step
+    using root mean square difference of elevation.
+
+    @param tolerance maximum RMS difference of unchanged scan
+    @param step subsampling step in cells
+    @param nulls maximum fraction of sampled cells which
+    changed from or to null in unchanged scan
+    """
+
+    def __init__(self, tolerance=0.5, step=4, nulls=0.01):
+        self.tolerance = float(tolerance)
+        self.step = max(1, int(step))
+        self.nulls = float(nulls)
+        self._reference = None
+        self._key = None
+
+    def reset(self):
+        self._reference = None
+        self._key = None
+
+    def digest(self, array):
+        return np.array(array[:: self.step, :: self.step], dtype=np.float32)
+
+    def unchanged(self, array, key=None, ignore=None):
+        """Returns True if array is within tolerance of the last
+        processed scan and key (e.g. state of analyses) is the same.
+        Cells where ignore (boolean array) is True are not compared."""
+        reference = self._reference
+        if reference is None or key != self._key:
+            return False
+        sample = self.digest(array)
+        if sample.shape != reference.shape:
+            return False
+        compared = np.ones(sample.shape, dtype=bool)
+        if ignore is not None:
+            compared = ~ignore[:: self.step, :: self.step]
+        valid = np.isfinite(sample)
+        valid_reference = np.isfinite(reference)
+        if (
+            np.count_nonzero((valid != valid_reference) & compared)
+            > self.nulls * sample.size
+        ):
+            return False
+        both = valid & valid_reference & compared
+        if not both.any():
+            return True
+        diff = sample[both] - reference[both]
+        return float(np.sqrt(np.mean(diff * diff))) <= self.tolerance
+
+    def processed(self, array, key=None):
+        """Sets array as the last processed scan"""
+        self._reference = self.digest(array)
+        self._key = key
+
+
+class ScanPipeline:
+    """Imports scans written by r.in.kinect under temporary name.
+    Each scan is read only once into memory, the statistics
+    needed for filtering are computed from the array
+    and the scan is then renamed to its final name.
+    The array is kept in the cache of read_raster_array
+    and accepted scans are kept in history.
+    When occlusion detection or temporal filter changes the scan,
+    the changed scan is written instead.
+    Scans identical to the last processed scan (see ChangeGate)
+    are not imported and are counted as skipped."""
+
+    def __init__(self, historySize=10):
+        self.history = ScanHistory(historySize)
+        self.skipped = 0
+        self._index = 0
+        self._stages = {}
+
+    def _stage(self, cls, params, enabled=True):
+        """Returns processing stage of class cls created with params
+        (dictionary), keeps the stage while the parameters don't change"""
+        if not params or not enabled:
+            self._stages.pop(cls, None)
+            return None
+        stage = self._stages.get(cls)
+        if stage is None or stage[0] != params:
+            try:
+                stage = (dict(params), cls(**params))
+            except (TypeError, ValueError) as e:
+                print(e)
+                return None
+            self._stages[cls] = stage
+        return stage[1]
+
+    def invalidate(self):
+        """Makes sure the next scan is processed even if it is unchanged"""
+        stage = self._stages.get(ChangeGate)
+        if stage:
+            stage[1].reset()
+
+    def import_scan(
+        self,
+        name,
+        scanFilter,
+        temporalFilter=None,
+        occlusion=None,
+        dirtyTolerance=0,
+        changeGate=None,
+        key=None,
+    ):
+        """Reads scan '<name>tmp', checks it and renames it to name.
+
+        @param name final name of the scan
+        @param scanFilter filter settings (filter, threshold, debug, counter)
+        @param temporalFilter parameters of TemporalFilter or None
+        @param occlusion parameters of OcclusionDetector or None
+        @param dirtyTolerance minimum change of cell for DirtyRegion
+        @param changeGate parameters of ChangeGate or None
+        @param key anything else analyses depend on, scan is not skipped
+        when it differs from key of the last processed scan
+
+        @return ScanFrame (with unchanged True if the scan was skipped)
+        or None if scan is invalid or filtered out
+        """
+        tmp = name + "tmp"
+        try:
+            header = read_raster_header(tmp)
+            env = os.environ.copy()
+            env["GRASS_REGION"] = region_from_header(header)
+            array = read_raster_array(tmp, env=env, cache=False)
+        except (IOError, KeyError, ValueError, CalledModuleError):
+            print("error reading scan")
+            return None
+        frame = ScanFrame(name, header, array)
+        if frame.min is None:
+            return None
+        if scanFilter["filter"]:
+            if scanFilter["debug"]:
+                print(frame.max - frame.min)
+            if frame.max - frame.min > scanFilter["threshold"]:
+                scanFilter["counter"] += 1
+                return None
+        modified = False
+        mask = None
+        # occluded cells replaced by last accepted values,
+        # their changes don't make the scan changed or dirty
+        rejected = None
+        detector = self._stage(OcclusionDetector, occlusion)
+        if detector:
+            array, mask = detector.apply(array)
+            if array is None:
+                scanFilter["counter"] += 1
+                return None
+            if np.count_nonzero(mask) >= detector.min_cells:
+                rejected = mask
+            modified = rejected is not None and bool(rejected.any())
+        temporalFilter = temporalFilter or {}
+        temporal = self._stage(
+            TemporalFilter,
+            temporalFilter,
+            enabled=temporalFilter.get("method", "none") != "none"
+            or temporalFilter.get("reject") is not None,
+        )
+        if temporal:
+            array = temporal.apply(array)
+            modified = True
+        gate = self._stage(ChangeGate, changeGate)
+        if gate and gate.unchanged(array, key, ignore=rejected):
+            # the scan map still contains the last processed scan,
+            # temporary map is overwritten by the next scan
+            self.skipped += 1
+            frame.unchanged = True
+            frame.occlusion = mask
+            return frame
+        if modified:
+            try:
+                write_raster_array(array, name, env=env)
+                grass_session.run_command("r.colors", map=name, raster=tmp, quiet=True)
+                grass_session.run_command(
+                    "g.remove", flags="f", type="raster", name=tmp, quiet=True
+                )
+            except CalledModuleError:
+                print("error writing filtered scan")
+                return None
+            frame = ScanFrame(name, header, array)
+        else:
+            try:
+                grass_session.run_command(
+                    "g.rename", raster=[tmp, name], overwrite=True, quiet=True
+                )
+            except CalledModuleError:
+                print("error renaming scanned data from temporary name")
+                return None
+        frame.occlusion = mask
+        # analyses reading the scan get the array without reading it again
+        cache_raster_array(name, array, frame.region)
+        # workaround weird georeferencing
+        # filters cases when extent and elev values are in inconsistent state
+        # probably it reads it before the header is written
+        try:
+            if (abs(header["north"] - header["south"]) / (frame.max - frame.min)) < 1:
+                return None
+        except ZeroDivisionError:
+            return None
+        previous = self.history[-1] if len(self.history) else None
+        if previous is not None and previous.region != frame.region:
+            previous = None
+        frame.dirty = DirtyRegion.compare(
+            header,
+            array,
+            previous.array if previous is not None else None,
+            dirtyTolerance,
+            ignore=rejected,
+        )
+        if gate:
+            gate.processed(array, key)
+        self._index += 1
+        frame.index = self._index
+        frame.dirty.since = previous.index if previous is not None else None
+        frame.dirty.index = frame.index
+        frame.dirty.key = key
+        frame.timestamp = time.time()
+        self.history.append(frame)
+        return frame
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Scheduling of processing of new scans
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import signal
+import itertools
+import threading
+import traceback
+from collections import OrderedDict
+from subprocess import PIPE, run
+
+JOB_VARIABLE = "TANGIBLE_JOB"
+
+_job_ids = itertools.count(1)
+
+
+class Job:
+    """Processing of one frame, can be cancelled.
+    GRASS modules started with environment from environ()
+    can be identified and killed when the job times out."""
+
+    def __init__(self, key, callback):
+        self.key = key
+        self.callback = callback
+        self.id = next(_job_ids)
+        self.cancelled = threading.Event()
+        self.timedOut = False
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def environ(self, env):
+        """Returns copy of environment marking processes started by this job"""
+        env = env.copy()
+        env[JOB_VARIABLE] = str(self.id)
+        return env
+
+    def processes(self):
+        """Returns PIDs of running child processes started by this job"""
+        try:
+            out = run(["pgrep", "-P", str(os.getpid())], stdout=PIPE).stdout
+        except OSError:
+            return []
+        tag = "{}={}".format(JOB_VARIABLE, self.id).encode()
+        pids = []
+        for pid in out.split():
+            try:
+                with open("/proc/{}/environ".format(int(pid)), "rb") as f:
+                    if tag in f.read().split(b"\0"):
+                        pids.append(int(pid))
+            except (OSError, ValueError):
+                pass
+        return pids
+
+    def kill(self):
+        """Kills running GRASS modules of this job"""
+        for pid in self.processes():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+class FrameScheduler:
+    """Processes frames (new scans, drawings) in a separate thread.
+    Frames are submitted under a key, pending frame with the same key
+    is replaced by the newer one (dropped), so that processing
+    never queues behind outdated scans. Frames submitted
+    with coalesce=False are always processed.
+    Callbacks get the Job as parameter.
+
+    @param onProcessed function called (from the worker thread)
+    after each processed frame
+    @param timeout maximum processing time of one frame in seconds,
+    after that the job is cancelled and its GRASS modules killed,
+    or function returning it (called for each frame)
+    @param onStopped function called (from the worker thread)
+    when the worker thread exits after stop, or from stop
+    if the worker thread is not running
+    """
+
+    def __init__(self, onProcessed=None, timeout=None, onStopped=None):
+        self.onProcessed = onProcessed
+        self.timeout = timeout
+        self.onStopped = onStopped
+        self.processed = 0
+        self.dropped = 0
+        self.timedOut = 0
+        self._pending = OrderedDict()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._current = None
+
+    def start(self):
+        """Starts the worker thread, worker of previous stop
+        which didn't exit yet continues"""
+        with self._condition:
+            self._stopped = False
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="FrameScheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def running(self):
+        """True if the worker thread was started and not stopped"""
+        with self._condition:
+            return self._thread is not None and not self._stopped
+
+    def stop(self, wait=True):
+        """Stops the worker thread, pending frames are discarded
+        and the running one is cancelled and its GRASS modules killed.
+        Without wait, the worker thread exits when the running
+        callback returns (use onStopped to get notified)."""
+        with self._condition:
+            self._stopped = True
+            self._pending.clear()
+            current = self._current
+            thread = self._thread
+            self._condition.notify_all()
+        if current:
+            current.cancel()
+            current.kill()
+        if thread is None and self.onStopped:
+            self.onStopped()
+        if wait and thread and thread is not threading.current_thread():
+            thread.join()
+
+    def submit(self, key, callback, coalesce=True):
+        """Schedules callback for processing, replacing pending callback
+        with the same key if coalesce is True"""
+        job = Job(key, callback)
+        with self._condition:
+            if not coalesce:
+                key = (key, job.id)
+            elif key in self._pending:
+                del self._pending[key]
+                self.dropped += 1
+            self._pending[key] = job
+            self._condition.notify()
+        return job
+
+    def cancel(self):
+        """Discards pending frames and cancels the running one"""
+        with self._condition:
+            self._pending.clear()
+            if self._current:
+                self._current.cancel()
+
+    def clear(self):
+        """Discards pending frames"""
+        with self._condition:
+            self._pending.clear()
+
+    def reset_counters(self):
+        with self._condition:
+            self.processed = self.dropped = self.timedOut = 0
+
+    def _timeout(self, job):
+        job.timedOut = True
+        job.cancel()
+        job.kill()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    self._thread = None
+                    break
+                key, job = self._pending.popitem(last=False)
+                self._current = job
+            timer = None
+            timeout = self.timeout() if callable(self.timeout) else self.timeout
+            if timeout:
+                timer = threading.Timer(timeout, self._timeout, args=(job,))
+                timer.daemon = True
+                timer.start()
+            try:
+                job.callback(job)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                if timer:
+                    timer.cancel()
+            with self._condition:
+                self._current = None
+                self.processed += 1
+                if job.timedOut:
+                    self.timedOut += 1
+            if self.onProcessed:
+                self.onProcessed()
+        if self.onStopped:
+            self.onStopped()
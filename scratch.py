@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+@brief Temporary maps of analyses
+
+Analyses get unique names of temporary maps from Scratch
+and all of them are removed at once when the scratch is closed:
+
+    with scratch_space(env) as scratch:
+        dx = scratch.raster("dx")
+        gcore.run_command("r.slope.aspect", elevation=elev, dx=dx, env=env)
+
+When processing of a frame runs in frame_scratch, temporary maps
+of all analyses are removed at the end of the frame (optionally
+in background). Names contain ID of the process, so that maps left
+by crashed processes can be removed by remove_orphans.
+
+With use_mapset, temporary maps are written to a scratch mapset
+in a directory on RAM disk (e.g. /dev/shm) linked into the current
+location. Modules writing temporary maps then need environment
+from scratch.environ(env), other modules read them with the name
+from scratch.qualified(name):
+
+    with scratch_space(env) as scratch:
+        dx = scratch.raster("dx")
+        gcore.run_command(
+            "r.slope.aspect", elevation=elev, dx=dx, env=scratch.environ(env)
+        )
+        grast.mapcalc(f"{new} = {scratch.qualified(dx)} * 2", env=env)
+
+This program is free software under the GNU General Public License
+(>=v2). Read the file COPYING that comes with GRASS for details.
+
+@author: Anna Petrasova (akratoc@ncsu.edu)
+"""
+import os
+import glob
+import uuid
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from grass.script import core as gcore
+from grass.exceptions import CalledModuleError
+
+from grass_session import RASTER_ELEMENTS
+import grass_session
+
+PREFIX = "tlscratch"
+
+
+def _read_gisrc(path):
+    variables = {}
+    with open(path) as f:
+        for line in f:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                variables[key.strip()] = value.strip()
+    return variables
+
+
+class ScratchMapset:
+    """Mapset for temporary maps in a directory (typically on tmpfs),
+    linked into the current location. It uses the region
+    and search path of the current mapset.
+
+    @param directory directory where the mapset is created
+    """
+
+    def __init__(self, directory="/dev/shm", env=None):
+        env = env or os.environ
+        gisrc = _read_gisrc(env["GISRC"])
+        location = os.path.join(gisrc["GISDBASE"], gisrc["LOCATION_NAME"])
+        current = os.path.join(location, gisrc["MAPSET"])
+        self.name = "{}_{}".format(PREFIX, os.getpid())
+        self.link = os.path.join(location, self.name)
+        self.path = tempfile.mkdtemp(prefix=self.name + "_", dir=directory)
+        for wind in (
+            os.path.join(current, "WIND"),
+            os.path.join(location, "PERMANENT", "DEFAULT_WIND"),
+        ):
+            if os.path.exists(wind):
+                shutil.copyfile(wind, os.path.join(self.path, "WIND"))
+                break
+        mapsets = [gisrc["MAPSET"]]
+        try:
+            with open(os.path.join(current, "SEARCH_PATH")) as f:
+                mapsets.extend(line.strip() for line in f if line.strip())
+        except IOError:
+            mapsets.append("PERMANENT")
+        with open(os.path.join(self.path, "SEARCH_PATH"), "w") as f:
+            f.write("\n".join(sorted(set(mapsets), key=mapsets.index)) + "\n")
+        with open(os.path.join(self.path, "VAR"), "w") as f:
+            f.write(
+                "DB_DRIVER: sqlite\n"
+                "DB_DATABASE: $GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db\n"
+            )
+        if os.path.lexists(self.link):
+            os.remove(self.link)
+        os.symlink(self.path, self.link)
+        gisrc["MAPSET"] = self.name
+        fd, self.gisrc = tempfile.mkstemp(prefix=self.name + "_rc_", dir=directory)
+        with os.fdopen(fd, "w") as f:
+            f.write("".join("{}: {}\n".format(k, v) for k, v in gisrc.items()))
+
+    def environ(self, env=None):
+        """Returns copy of environment where modules write to this mapset"""
+        env = (env or os.environ).copy()
+        env["GISRC"] = self.gisrc
+        return env
+
+    def remove_maps(self, names):
+        """Removes maps (dictionary of lists of names by map type)
+        directly, there is nothing else in the mapset"""
+        for maptype, maps in names.items():
+            for name in maps:
+                if maptype == "raster":
+                    paths = [os.path.join(self.path, e, name) for e in RASTER_ELEMENTS]
+                else:
+                    paths = [os.path.join(self.path, maptype, name)]
+                for path in paths:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    elif os.path.exists(path):
+                        os.remove(path)
+
+    def remove(self):
+        """Removes the mapset with all maps"""
+        if os.path.islink(self.link):
+            os.remove(self.link)
+        shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.gisrc):
+            os.remove(self.gisrc)
+
+
+_mapset = None
+
+
+def use_mapset(directory, env=None):
+    """Creates scratch mapset in directory for temporary maps
+    of following scratches, removes it when directory is empty
+
+    @return ScratchMapset or None
+    """
+    global _mapset
+    if _mapset and directory and os.path.dirname(_mapset.path) == directory:
+        return _mapset
+    if _mapset:
+        _mapset.remove()
+        _mapset = None
+    if directory:
+        try:
+            _mapset = ScratchMapset(directory, env)
+        except (OSError, KeyError) as e:
+            print("Scratch mapset can't be created: {}".format(e))
+    return _mapset
+
+
+class Scratch:
+    """Allocates names of temporary maps and removes them together.
+    Maps are in the scratch mapset (see use_mapset) unless
+    current mapset is requested."""
+
+    def __init__(self, env=None):
+        self.env = env
+        self.mapset = _mapset
+        self._names = {}
+        self._scratch = {}
+        self._lock = threading.Lock()
+
+    def name(self, base="tmp", maptype="raster", current=False):
+        """Returns unique name of temporary map of given type,
+        in the current mapset if current is True"""
+        name = "{prefix}_{pid}_{base}_{id}".format(
+            prefix=PREFIX, pid=os.getpid(), base=base, id=uuid.uuid4().hex[:8]
+        )
+        names = self._names if current or not self.mapset else self._scratch
+        with self._lock:
+            names.setdefault(maptype, []).append(name)
+        return name
+
+    def raster(self, base="tmp", current=False):
+        return self.name(base, "raster", current)
+
+    def vector(self, base="tmp", current=False):
+        return self.name(base, "vector", current)
+
+    def names(self, maptype="raster"):
+        with self._lock:
+            return self._names.get(maptype, []) + self._scratch.get(maptype, [])
+
+    def environ(self, env):
+        """Returns environment for modules writing temporary maps"""
+        if self.mapset:
+            return self.mapset.environ(env)
+        return env
+
+    def qualified(self, name):
+        """Returns name of temporary map readable from the current mapset"""
+        with self._lock:
+            scratch = any(name in names for names in self._scratch.values())
+        if scratch:
+            return "{}@{}".format(name, self.mapset.name)
+        return name
+
+    def cleanup(self, background=False):
+        """Removes all temporary maps (one g.remove per map type
+        in the current mapset, files in the scratch mapset)"""
+        with self._lock:
+            names, self._names = self._names, {}
+            scratch, self._scratch = self._scratch, {}
+        if scratch:
+            self.mapset.remove_maps(scratch)
+        if not names:
+            return
+        if background:
+            thread = threading.Thread(target=_remove, args=(names, self.env))
+            thread.daemon = True
+            thread.start()
+        else:
+            _remove(names, self.env)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+
+def _remove(names, env):
+    for maptype, maps in names.items():
+        try:
+            grass_session.run_command(
+                "g.remove", flags="f", type=maptype, name=maps, quiet=True, env=env
+            )
+        except CalledModuleError as e:
+            print(e)
+
+
+_local = threading.local()
+
+
+def current_frame():
+    """Returns scratch of the frame processed in this thread or None"""
+    return getattr(_local, "frame", None)
+
+
+@contextmanager
+def attached(frame):
+    """Uses scratch of frame in this thread (e.g. in thread pool)"""
+    previous = current_frame()
+    _local.frame = frame
+    try:
+        yield frame
+    finally:
+        _local.frame = previous
+
+
+@contextmanager
+def frame_scratch(env=None, background=False):
+    """Collects temporary maps of all analyses of one frame
+    (processed in this thread), removes them at the end of the frame"""
+    scratch = Scratch(env)
+    try:
+        with attached(scratch):
+            yield scratch
+    finally:
+        scratch.cleanup(background)
+
+
+@contextmanager
+def scratch_space(env=None):
+    """Returns scratch of the current frame if there is one,
+    otherwise new scratch removed on exit"""
+    frame = current_frame()
+    if frame is not None:
+        yield frame
+        return
+    with Scratch(env) as scratch:
+        yield scratch
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _orphan_pid(name):
+    try:
+        pid = int(name.split("_")[1])
+    except (IndexError, ValueError):
+        return None
+    if pid == os.getpid() or _running(pid):
+        return None
+    return pid
+
+
+def remove_orphans(env=None):
+    """Removes temporary maps in current mapset and scratch mapsets
+    left by processes which are not running anymore"""
+    gisrc = _read_gisrc((env or os.environ)["GISRC"])
+    location = os.path.join(gisrc["GISDBASE"], gisrc["LOCATION_NAME"])
+    for name in os.listdir(location):
+        path = os.path.join(location, name)
+        if name.startswith(PREFIX + "_") and os.path.islink(path):
+            if _orphan_pid(name):
+                target = os.path.realpath(path)
+                for rc in glob.glob(
+                    os.path.join(os.path.dirname(target), name + "_rc_*")
+                ):
+                    os.remove(rc)
+                shutil.rmtree(target, ignore_errors=True)
+                os.remove(path)
+    try:
+        maps = gcore.read_command(
+            "g.list",
+            flags="t",
+            type=["raster", "vector"],
+            pattern=PREFIX + "_*",
+            mapset=".",
+            env=env,
+        ).split()
+    except CalledModuleError as e:
+        print(e)
+        return
+    orphans = {}
+    for each in maps:
+        maptype, name = each.split("/", 1)
+        if _orphan_pid(name):
+            orphans.setdefault(maptype, []).append(name)
+    _remove(orphans, env)
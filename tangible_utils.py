@@ -8,9 +8,17 @@ This program is free software under the GNU General Public License
 @author: Anna Petrasova (akratoc@ncsu.edu)
 """
 import os
+import json
 import shutil
+import hashlib
+import tempfile
 import importlib
+import threading
+import time
 import traceback
+from collections import OrderedDict
+
+import numpy as np
 
 try:
     from StringIO import StringIO  # for Python 2
@@ -22,6 +30,10 @@ import grass.script as gscript
 from grass.exceptions import CalledModuleError, ScriptError
 from wxwrap import BitmapFromImage, ImageFromStream
 
+from analyses_graph import run_graph
+from profiling import profiler
+from scratch import frame_scratch
+
 import wx
 import wx.lib.newevent
 
@@ -107,10 +119,157 @@ def load_source(modname, filename):
     return module
 
 
+class AnalysesModule:
+    """Loaded Python file with analyses together with
+    the registry of its functions grouped by prefix"""
+
+    def __init__(self, module, mtime, digest):
+        self.module = module
+        self.mtime = mtime
+        self.digest = digest
+        self.timings = {}
+        self._registry = {}
+
+    def callables(self, prefix):
+        """Returns sorted list of (name, function) of functions
+        starting with prefix, resolved only once per loaded module"""
+        if prefix not in self._registry:
+            self._registry[prefix] = [
+                (name, getattr(self.module, name))
+                for name in sorted(dir(self.module))
+                if name.startswith(prefix)
+                and name != "run_command"
+                and callable(getattr(self.module, name))
+            ]
+        return self._registry[prefix]
+
+    def functions(self, prefix):
+        """Returns sorted names of functions starting with prefix"""
+        return [name for name, func in self.callables(prefix)]
+
+    def dispatch(self, prefix, cancel=None, **kwargs):
+        """Calls all functions starting with prefix with the given
+        keyword arguments. Errors are printed and don't stop
+        the remaining functions. Duration of each call in seconds
+        is stored in timings. When cancel (threading.Event) is set,
+        the remaining functions are skipped."""
+        for name, func in self.callables(prefix):
+            if cancel and cancel.is_set():
+                return
+            start = time.perf_counter()
+            try:
+                with profiler.span(name, "analysis"):
+                    func(**kwargs)
+            except (CalledModuleError, Exception, ScriptError):
+                traceback.print_exc()
+            self.timings[name] = time.perf_counter() - start
+
+    def dispatch_graph(self, prefix, max_workers=None, cancel=None, **kwargs):
+        """Same as dispatch, but functions with declared inputs and outputs
+        which don't depend on each other run concurrently (see analyses_graph).
+
+        @return wall-clock time of all functions in seconds
+        """
+        return run_graph(
+            self.callables(prefix), kwargs, self.timings, max_workers, cancel
+        )
+
+
+_analyses_cache = {}
+_analyses_lock = threading.Lock()
+
+
+def load_analyses(filename, modname="myanalyses"):
+    """Loads Python file with analyses.
+    The loaded module is cached and the file is executed again
+    only when its modification time and content changes.
+
+    @return AnalysesModule
+    """
+    filename = os.path.abspath(filename)
+    with _analyses_lock:
+        mtime = os.path.getmtime(filename)
+        cached = _analyses_cache.get(filename)
+        if cached and cached.mtime == mtime:
+            return cached
+        with open(filename, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if cached and cached.digest == digest:
+            cached.mtime = mtime
+            return cached
+        module = load_source(modname, filename)
+        _analyses_cache[filename] = AnalysesModule(module, mtime, digest)
+        return _analyses_cache[filename]
+
+
+_region_cache = {}
+_region_cache_lock = threading.Lock()
+# files defining extent of maps given as g.region arguments
+_REGION_MAP_FILES = {
+    "rast": ("cellhd", None),
+    "raster": ("cellhd", None),
+    "zoom": ("cellhd", None),
+    "align": ("cellhd", None),
+    "raster_3d": ("grid3", "cellhd"),
+    "vector": ("vector", "topo"),
+    "region": ("windows", None),
+}
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _region_cache_key(kwargs):
+    """Returns key identifying region computed by g.region with kwargs:
+    the arguments, current region and modification times of maps.
+    Returns None if some map is not found."""
+    mapsetPath = get_mapset_path()
+    try:
+        stamps = [_file_stamp(os.path.join(mapsetPath, "WIND"))]
+        for key in sorted(kwargs):
+            if key not in _REGION_MAP_FILES:
+                continue
+            names = kwargs[key]
+            if isinstance(names, str):
+                names = names.split(",")
+            element, filename = _REGION_MAP_FILES[key]
+            for name in names:
+                path = find_map_file(name, element)
+                if not path:
+                    return None
+                if filename:
+                    path = os.path.join(path, filename)
+                stamps.append(_file_stamp(path))
+    except OSError:
+        return None
+    args = tuple(sorted((key, str(value)) for key, value in kwargs.items()))
+    overrides = (os.environ.get("GRASS_REGION"), os.environ.get("WIND_OVERRIDE"))
+    return (mapsetPath, args, overrides, tuple(stamps))
+
+
+def _compute_region(kwargs):
+    """Computes GRASS_REGION string, for a single raster directly
+    from its header, otherwise with g.region"""
+    region3d = "raster_3d" in kwargs
+    if len(kwargs) == 1 and ("rast" in kwargs or "raster" in kwargs):
+        name = kwargs.get("rast", kwargs.get("raster"))
+        if isinstance(name, str) and "," not in name:
+            try:
+                return region_from_header(read_raster_header(name))
+            except (IOError, KeyError, ValueError):
+                # e.g. lat-lon headers are not plain numbers
+                pass
+    return gscript.region_env(region3d=region3d, **kwargs)
+
+
 def get_environment(**kwargs):
     """!Returns environment for running modules.
     All modules for which region is important should
     pass this environment into run_command or similar.
+    The region is cached and computed again only when
+    the region arguments or the maps they refer to change.
 
     @param tmp_regions a list of temporary regions
     @param kwargs arguments for g.region
@@ -121,13 +280,300 @@ def get_environment(**kwargs):
     env["GRASS_OVERWRITE"] = "1"
     env["GRASS_VERBOSE"] = "0"
     env["GRASS_MESSAGE_FORMAT"] = "standard"
-    region3d = False
-    if "raster_3d" in kwargs:
-        region3d = True
-    env["GRASS_REGION"] = gscript.region_env(region3d=region3d, **kwargs)
+    try:
+        key = _region_cache_key(kwargs)
+    except (IOError, KeyError):
+        key = None
+    with _region_cache_lock:
+        region = _region_cache.get(key) if key else None
+    if region is None:
+        region = _compute_region(kwargs)
+        if key:
+            with _region_cache_lock:
+                if len(_region_cache) > 100:
+                    _region_cache.clear()
+                _region_cache[key] = region
+    env["GRASS_REGION"] = region
     return env
 
 
+def get_gisenv(env=None):
+    """Reads GRASS variables directly from the GISRC file
+    (of env or of this process), avoids running g.gisenv"""
+    gisenv = {}
+    with open((env or os.environ)["GISRC"], "r") as f:
+        for line in f:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                gisenv[key.strip()] = value.strip()
+    return gisenv
+
+
+def get_mapset_path(mapset=None, env=None):
+    """Returns path to the given mapset (current mapset by default)"""
+    gisenv = get_gisenv(env)
+    return os.path.join(
+        gisenv["GISDBASE"], gisenv["LOCATION_NAME"], mapset or gisenv["MAPSET"]
+    )
+
+
+def find_map_file(name, element):
+    """Finds file of a map (e.g. element 'cellhd' for raster header)
+    in the current mapset, mapsets in its search path and PERMANENT
+    without running g.findfile.
+
+    @param name map name, optionally with @mapset
+
+    @return path or None if not found
+    """
+    if "@" in name:
+        name, mapset = name.split("@", 1)
+        mapsets = [mapset]
+    else:
+        mapsetPath = get_mapset_path()
+        mapsets = [os.path.basename(mapsetPath)]
+        try:
+            with open(os.path.join(mapsetPath, "SEARCH_PATH"), "r") as f:
+                mapsets.extend(line.strip() for line in f if line.strip())
+        except IOError:
+            pass
+        mapsets.append("PERMANENT")
+    for mapset in mapsets:
+        path = os.path.join(get_mapset_path(mapset), element, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_raster_header(name):
+    """Reads raster header (cellhd file) without running r.info.
+    Coordinates which are not plain numbers (degrees, minutes
+    and seconds in latitude-longitude locations) are read with r.info.
+
+    @param name raster name, optionally with @mapset
+
+    @return dictionary with the region keys as written in cellhd
+    (north, south, east, west, rows, cols, e-w resol, ...)
+    """
+    path = find_map_file(name, "cellhd")
+    if not path:
+        raise IOError("Raster map <{}> not found".format(name))
+    header = {}
+    with open(path, "r") as f:
+        for line in f:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                header[key.strip()] = value.strip()
+    try:
+        for key in ("north", "south", "east", "west", "e-w resol", "n-s resol"):
+            header[key] = float(header[key])
+    except ValueError:
+        info = gscript.raster_info(name)
+        for key, infoKey in (
+            ("north", "north"),
+            ("south", "south"),
+            ("east", "east"),
+            ("west", "west"),
+            ("e-w resol", "ewres"),
+            ("n-s resol", "nsres"),
+        ):
+            header[key] = float(info[infoKey])
+    for key in ("rows", "cols"):
+        header[key] = int(header[key])
+    return header
+
+
+def region_from_header(header):
+    """Creates GRASS_REGION string from raster header,
+    equivalent to gscript.region_env(rast=name)"""
+    keys = (
+        "proj",
+        "zone",
+        "north",
+        "south",
+        "east",
+        "west",
+        "cols",
+        "rows",
+        "e-w resol",
+        "n-s resol",
+    )
+    return "".join("{}: {};".format(key, header[key]) for key in keys if key in header)
+
+
+def parse_region(region):
+    """Parses GRASS_REGION string into a dictionary"""
+    parsed = {}
+    for item in region.split(";"):
+        if ":" in item:
+            key, value = item.split(":", 1)
+            parsed[key.strip()] = value.strip()
+    for key in ("north", "south", "east", "west", "e-w resol", "n-s resol"):
+        parsed[key] = float(parsed[key])
+    for key in ("rows", "cols"):
+        parsed[key] = int(parsed[key])
+    return parsed
+
+
+def _region_of_env(env):
+    if env and "GRASS_REGION" in env:
+        return env["GRASS_REGION"]
+    return gscript.region_env(env=env)
+
+
+_array_cache = OrderedDict()
+_array_cache_lock = threading.Lock()
+_ARRAY_CACHE_SIZE = 8
+
+
+def _raster_stamp(name):
+    """Returns path of the raster header and identification
+    of the current version of the raster files or None if not found"""
+    header = find_map_file(name, "cellhd")
+    if not header:
+        return None, None
+    mapsetPath = os.path.dirname(os.path.dirname(header))
+    return header, _stamp(mapsetPath, os.path.basename(header))
+
+
+def _stamp(mapsetPath, name):
+    stamp = []
+    for element in ("cellhd", "fcell", "cell"):
+        try:
+            st = os.stat(os.path.join(mapsetPath, element, name))
+        except OSError:
+            continue
+        stamp.append((element, st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+def mask_stamp(env=None):
+    """Returns identification of the current version of raster mask
+    active in the current mapset of env or None if there is no mask"""
+    name = (env or os.environ).get("GRASS_MASK", "MASK")
+    stamp = _stamp(get_mapset_path(env=env), name)
+    return (name,) + stamp if stamp else None
+
+
+def _window(cached, region):
+    """Returns (rows, cols) slices selecting region from array
+    with cached region or None if the region is not an aligned subregion"""
+    ewres = cached["e-w resol"]
+    nsres = cached["n-s resol"]
+    if not (
+        np.isclose(ewres, region["e-w resol"])
+        and np.isclose(nsres, region["n-s resol"])
+    ):
+        return None
+    col = (region["west"] - cached["west"]) / ewres
+    row = (cached["north"] - region["north"]) / nsres
+    if not (np.isclose(col, round(col)) and np.isclose(row, round(row))):
+        return None
+    col = int(round(col))
+    row = int(round(row))
+    if (
+        col < 0
+        or row < 0
+        or col + region["cols"] > cached["cols"]
+        or row + region["rows"] > cached["rows"]
+    ):
+        return None
+    return (slice(row, row + region["rows"]), slice(col, col + region["cols"]))
+
+
+def cache_raster_array(name, array, region):
+    """Remembers array with data of raster in the given region
+    (GRASS_REGION string), so that read_raster_array doesn't need
+    to read it again until the raster changes"""
+    header, stamp = _raster_stamp(name)
+    if not header:
+        return
+    array.flags.writeable = False
+    with _array_cache_lock:
+        _array_cache[header] = (stamp, parse_region(region), array)
+        _array_cache.move_to_end(header)
+        while len(_array_cache) > _ARRAY_CACHE_SIZE:
+            _array_cache.popitem(last=False)
+
+
+def read_raster_array(name, env=None, cache=True):
+    """Reads raster into 2D float32 NumPy array (nulls are NaN)
+    using computational region given by env.
+    Data are transferred through memory-mapped binary file
+    written by r.out.bin. Arrays are cached until the raster
+    changes, array of a subregion is sliced from the cached one.
+    Returned array is read-only when cached."""
+    regionString = _region_of_env(env)
+    region = parse_region(regionString)
+    if cache:
+        header, stamp = _raster_stamp(name)
+        with _array_cache_lock:
+            cached = _array_cache.get(header)
+        if cached and cached[0] == stamp:
+            window = _window(cached[1], region)
+            if window:
+                return cached[2][window]
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        gscript.run_command(
+            "r.out.bin",
+            flags="f",
+            input=name,
+            output=path,
+            bytes=4,
+            null="nan",
+            quiet=True,
+            overwrite=True,
+            env=env,
+        )
+        data = np.memmap(
+            path, dtype=np.float32, mode="r", shape=(region["rows"], region["cols"])
+        )
+        array = np.array(data)
+        del data
+    finally:
+        os.remove(path)
+    if cache:
+        cache_raster_array(name, array, regionString)
+    return array
+
+
+def write_raster_array(array, name, env=None, integer=False):
+    """Writes 2D array as floating point raster (NaN are nulls),
+    or as integer (CELL) raster when integer is True,
+    with extent of the computational region given by env using r.in.bin"""
+    region = parse_region(_region_of_env(env))
+    if array.shape != (region["rows"], region["cols"]):
+        raise ValueError(
+            "Array shape {} doesn't match region {}x{}".format(
+                array.shape, region["rows"], region["cols"]
+            )
+        )
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        np.asarray(array, dtype=np.int32 if integer else np.float32).tofile(path)
+        gscript.run_command(
+            "r.in.bin",
+            flags="s" if integer else "f",
+            input=path,
+            output=name,
+            bytes=4,
+            north=region["north"],
+            south=region["south"],
+            east=region["east"],
+            west=region["west"],
+            rows=region["rows"],
+            cols=region["cols"],
+            quiet=True,
+            overwrite=True,
+            env=env,
+        )
+    finally:
+        os.remove(path)
+
+
 def remove_vector(name, deleteTable=False):
     """Helper function to workaround problem with deleting vectors"""
     gisenv = gscript.gisenv()
@@ -147,141 +593,140 @@ def remove_vector(name, deleteTable=False):
 
 
 def run_analyses(
-    settings, analysesFile, update, giface, eventHandler, scanFilter, **kwargs
+    settings,
+    analysesFile,
+    update,
+    giface,
+    eventHandler,
+    scanFilter,
+    pipeline=None,
+    job=None,
+    **kwargs
 ):
     """Runs all functions in specified Python file which start with 'run_'.
-    The Python file is reloaded every time"""
+    The Python file is reloaded only when it changes.
+    New scan is imported by pipeline (ScanPipeline) and passed
+    to the functions as 'scan_frame', last scans as 'scan_history'
+    and cells changed since the previous scan as 'dirty' (DirtyRegion).
+    When run as scheduler Job, the job can cancel the remaining
+    functions and kill their GRASS modules.
+
+    @return True if new data were processed and map displays
+    should be updated, False if the scan was filtered out or skipped
+    because it didn't change (see 'skip_unchanged' in scanning parameters)
+    """
 
-    scan_params = settings["tangible"]["scan"]  # noqa: F841
+    scan_params = settings["tangible"]["scan"]
     scan_name = settings["tangible"]["output"]["scan"]
     calibration = settings["tangible"]["output"]["calibrate"]
-    calib_scan_name = settings["tangible"]["output"]["calibration_scan"]  # noqa: F841
+    calib_scan_name = settings["tangible"]["output"]["calibration_scan"]
     if calibration:
         scan_name = calib_scan_name
-    if scanFilter["filter"]:
+    loaded = None
+    if analysesFile and os.path.exists(analysesFile):
         try:
-            info = gscript.raster_info(scan_name + "tmp")
-        except CalledModuleError:
-            print("error in r.info")
-            return
-        if scanFilter["debug"]:
-            try:
-                print(info["max"] - info["min"])
-            except (
-                TypeError
-            ):  # unsupported operand type(s) for -: 'NoneType' and 'NoneType'
-                return
-        threshold = scanFilter["threshold"]
-        if info["max"] - info["min"] > threshold:
-            scanFilter["counter"] += 1
-            return
-    try:
-        gscript.run_command(
-            "g.copy", raster=[scan_name + "tmp", scan_name], overwrite=True, quiet=True
+            with profiler.span("load"):
+                loaded = load_analyses(analysesFile)
+        except Exception as e:
+            print(e)
+    scan_frame = None
+    # no new scan is written when drawing
+    if not settings["tangible"]["drawing"]["active"]:
+        if pipeline is None:
+            from scan_pipeline import ScanPipeline
+
+            pipeline = ScanPipeline()
+        # unchanged scan is processed again when analyses, settings
+        # or additional parameters (e.g. subtask of activity) change
+        key = (
+            loaded.digest if loaded else None,
+            json.dumps(settings["tangible"], sort_keys=True, default=str),
+            json.dumps(kwargs, sort_keys=True, default=str),
         )
-    except CalledModuleError:
-        print("error copying scanned data from temporary name")
-        return
-    # workaround weird georeferencing
-    # filters cases when extent and elev values are in inconsistent state
-    # probably it reads it before the header is written
-    try:
-        info = gscript.raster_info(scan_name)
-    except CalledModuleError:
-        print("error in r.info")
-        return
-    try:
-        if (abs(info["north"] - info["south"]) / (info["max"] - info["min"])) < 1:
-            return
-    except ZeroDivisionError:
-        return
-    env = get_environment(rast=scan_name)  # noqa: F841
-    if not analysesFile or not os.path.exists(analysesFile):
-        return
+        with profiler.span("import"):
+            scan_frame = pipeline.import_scan(
+                scan_name,
+                scanFilter,
+                scan_params.get("temporal_filter"),
+                scan_params.get("occlusion"),
+                scan_params.get("dirty_tolerance", 0),
+                scan_params.get("skip_unchanged"),
+                key,
+            )
+        if scan_frame is None:
+            return False
+        if scan_frame.unchanged:
+            profiler.skip()
+            return False
+    if loaded is None:
+        return True
+    env = scratchEnv = get_environment(rast=scan_name)
+    cancel = None
+    if job:
+        env = job.environ(env)
+        cancel = job.cancelled
     # run analyses
-    try:
-        myanalyses = load_source("myanalyses", analysesFile)
-    except Exception as e:
-        print(e)
-        return
-
-    functions = [
-        func
-        for func in dir(myanalyses)
-        if (func.startswith("run_") and func != "run_command")
-        or func.startswith("drawing_")
-        or func.startswith("calib_")
-    ]
-    for func in functions:
-        exec("del myanalyses." + func)
-    try:
-        myanalyses = load_source("myanalyses", analysesFile)
-    except Exception as e:
-        print(e)
-        return
     # color output
     color = None
     if settings["tangible"]["output"]["color"]:
-        color = settings["tangible"]["output"]["color_name"]  # noqa: F841
+        color = settings["tangible"]["output"]["color_name"]
     # blender path
     blender_path = None
     if settings["tangible"]["output"]["blender"]:
-        blender_path = settings["tangible"]["output"]["blender_path"]  # noqa: F841
+        blender_path = settings["tangible"]["output"]["blender_path"]
+    params = dict(
+        real_elev=scan_params["elevation"],
+        scanned_elev=scan_name,
+        scanned_calib_elev=calib_scan_name,
+        blender_path=blender_path,
+        zexag=scan_params["zexag"],
+        giface=giface,
+        update=update,
+        scan_frame=scan_frame,
+        scan_history=pipeline.history if pipeline else None,
+        dirty=scan_frame.dirty if scan_frame else None,
+        eventHandler=eventHandler,
+        env=env,
+    )
+    params.update(kwargs)
+    parallel = settings["tangible"]["analyses"].get("parallel", False)
+
+    def dispatch(prefix, **params):
+        start = time.perf_counter()
+        # temporary maps of all analyses are removed together in background
+        with frame_scratch(scratchEnv, background=True):
+            if parallel:
+                loaded.dispatch_graph(prefix, cancel=cancel, **params)
+            else:
+                loaded.dispatch(prefix, cancel=cancel, **params)
+        if scanFilter["debug"]:
+            print(
+                "{}: {:.3f} s ({})".format(
+                    prefix,
+                    time.perf_counter() - start,
+                    ", ".join(
+                        "{} {:.3f} s".format(name, loaded.timings.get(name, 0))
+                        for name in loaded.functions(prefix)
+                    ),
+                )
+            )
+
     # drawing needs different parameters
     # functions postprocessing drawing results start with 'drawing'
     # functions postprocessing scanning results start with 'run'
 
     if settings["tangible"]["drawing"]["active"]:
-        functions = [func for func in dir(myanalyses) if func.startswith("drawing_")]
-        for func in functions:
-            try:
-                exec(
-                    "myanalyses." + func + "(real_elev=scan_params['elevation'],"
-                    " scanned_elev=scan_name,"
-                    " scanned_calib_elev=calib_scan_name,"
-                    " blender_path=blender_path,"
-                    " zexag=scan_params['zexag'],"
-                    " draw_vector=settings['tangible']['drawing']['name'],"
-                    " draw_vector_append=settings['tangible']['drawing']['append'],"
-                    " draw_vector_append_name=settings['tangible']['drawing']['appendName'],"
-                    " giface=giface, update=update,"
-                    " eventHandler=eventHandler, env=env, **kwargs)"
-                )
-            except (CalledModuleError, Exception, ScriptError) as e:
-                print(traceback.print_exc())
+        params["draw_vector"] = settings["tangible"]["drawing"]["name"]
+        params["draw_vector_append"] = settings["tangible"]["drawing"]["append"]
+        params["draw_vector_append_name"] = settings["tangible"]["drawing"][
+            "appendName"
+        ]
+        dispatch("drawing_", **params)
     elif calibration:
-        functions = [func for func in dir(myanalyses) if func.startswith("calib_")]
-        for func in functions:
-            try:
-                exec(
-                    "myanalyses." + func + "(real_elev=scan_params['elevation'],"
-                    " scanned_elev=scan_name,"
-                    " scanned_calib_elev=scan_name,"
-                    " scanned_color=color,"
-                    " blender_path=blender_path,"
-                    " zexag=scan_params['zexag'],"
-                    " giface=giface, update=update,"
-                    " eventHandler=eventHandler, env=env, **kwargs)"
-                )
-            except (CalledModuleError, Exception, ScriptError) as e:
-                print(traceback.print_exc())
+        params["scanned_calib_elev"] = scan_name
+        params["scanned_color"] = color
+        dispatch("calib_", **params)
     else:
-        functions = [
-            func
-            for func in dir(myanalyses)
-            if func.startswith("run_") and func != "run_command"
-        ]
-        for func in functions:
-            try:
-                exec(
-                    "myanalyses." + func + "(real_elev=scan_params['elevation'],"
-                    " scanned_elev=scan_name,"
-                    " scanned_calib_elev=calib_scan_name,"
-                    " scanned_color=color,"
-                    " blender_path=blender_path,"
-                    " zexag=scan_params['zexag'],"
-                    " giface=giface, update=update,"
-                    " eventHandler=eventHandler, env=env, **kwargs)"
-                )
-            except (CalledModuleError, Exception, ScriptError) as e:
-                print(traceback.print_exc())
+        params["scanned_color"] = color
+        dispatch("run_", **params)
+    return True
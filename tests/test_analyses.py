@@ -0,0 +1,887 @@
+import heapq
+import re
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+pytest.importorskip("grass.script")
+analyses = pytest.importorskip("analyses")
+
+
+def priority_flood(dem):
+    """Plain priority-flood from all edge and null cells"""
+    rows, cols = dem.shape
+    filled = dem.copy()
+    done = ~np.isfinite(dem)
+    heap = []
+    for r in range(rows):
+        for c in range(cols):
+            edge = r in (0, rows - 1) or c in (0, cols - 1)
+            near_null = done[max(r - 1, 0) : r + 2, max(c - 1, 0) : c + 2].any()
+            if not done[r, c] and (edge or near_null):
+                heap.append((dem[r, c], r, c))
+    for _, r, c in heap:
+        done[r, c] = True
+    heapq.heapify(heap)
+    while heap:
+        level, r, c = heapq.heappop(heap)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                nr, nc = r + dr, c + dc
+                if 0 <= nr < rows and 0 <= nc < cols and not done[nr, nc]:
+                    done[nr, nc] = True
+                    filled[nr, nc] = max(filled[nr, nc], level)
+                    heapq.heappush(heap, (filled[nr, nc], nr, nc))
+    return filled
+
+
+def terrain(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0 : shape[0], 0 : shape[1]]
+    return 3 * np.sin(x / 5.0) * np.cos(y / 7.0) + 5 * rng.random(shape)
+
+
+def serpentine(size, seed=0):
+    """Walls with a single channel winding through the whole region"""
+    dem = np.full((size, size), 10.0)
+    dem[1 : size - 1 : 2, 1 : size - 1] = 0
+    for row in range(2, size - 1, 2):
+        dem[row, size - 2 if (row // 2) % 2 else 1] = 0
+    dem[1, 0] = 0
+    return dem + 0.001 * np.random.default_rng(seed).random(dem.shape)
+
+
+@pytest.mark.parametrize("shape", [(30, 40), (57, 33)])
+def test_fill_depressions(shape):
+    dem = terrain(shape)
+    assert np.array_equal(analyses._fill_depressions(dem), priority_flood(dem))
+
+
+def test_fill_depressions_drains_to_nulls():
+    dem = terrain((40, 40), seed=1)
+    dem[5:9, 10:12] = np.nan
+    filled = analyses._fill_depressions(dem)
+    assert np.isnan(filled[5:9, 10:12]).all()
+    assert np.array_equal(filled, priority_flood(dem), equal_nan=True)
+
+
+def test_fill_depressions_serpentine():
+    dem = serpentine(81)
+    assert np.array_equal(analyses._fill_depressions(dem), priority_flood(dem))
+    start = time.perf_counter()
+    analyses._fill_depressions(serpentine(400))
+    assert time.perf_counter() - start < 5
+
+
+class FakeScratch:
+    def raster(self, name, current=False):
+        return name
+
+    def vector(self, name):
+        return name
+
+    def qualified(self, name):
+        return name
+
+    def environ(self, env):
+        return env
+
+
+@contextmanager
+def fake_scratch_space(env=None):
+    yield FakeScratch()
+
+
+@pytest.fixture
+def fill_dir(monkeypatch):
+    """Records modules run by depression, arrays written instead of rasters"""
+    commands = []
+    written = {}
+    monkeypatch.setattr(analyses, "scratch_space", fake_scratch_space)
+    monkeypatch.setattr(
+        analyses.gcore, "run_command", lambda *a, **k: commands.append(a[0])
+    )
+    monkeypatch.setattr(analyses.grast, "mapcalc", lambda *a, **k: None)
+    monkeypatch.setattr(analyses.grass_session, "write_command", lambda *a, **k: None)
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda *a, **k: terrain((10, 10))
+    )
+    monkeypatch.setattr(
+        analyses,
+        "write_raster_array",
+        lambda array, name, env=None: written.update({name: array}),
+    )
+    return commands, written
+
+
+@pytest.mark.parametrize("repeat", [1, 2, 3])
+def test_depression_numpy_repeat(fill_dir, repeat):
+    commands, written = fill_dir
+    env = {"GRASS_REGION": "n:10;s:0;e:10;w:0;rows:10;cols:10"}
+    analyses.depression("scan", "ponds", env, repeat=repeat)
+    assert "r.fill.dir" not in commands
+    dem = terrain((10, 10))
+    depth = priority_flood(dem) - dem
+    depth[depth <= 0] = np.nan
+    assert np.allclose(written["ponds"], depth, equal_nan=True)
+
+
+def test_depression_grass_repeat(fill_dir):
+    commands, written = fill_dir
+    env = {"GRASS_REGION": "n:10;s:0;e:10;w:0;rows:10;cols:10"}
+    analyses.depression("scan", "ponds", env, repeat=3, engine="grass")
+    assert commands.count("r.fill.dir") == 3
+
+
+HEADER = {
+    "north": 40.0,
+    "south": 0.0,
+    "east": 40.0,
+    "west": 0.0,
+    "rows": 40,
+    "cols": 40,
+    "e-w resol": 1.0,
+    "n-s resol": 1.0,
+}
+
+
+def local_mean(array, size):
+    """Mean of size x size neighborhood, null where it is not in the array"""
+    radius = size // 2
+    padded = np.pad(array.astype(float), radius, constant_values=np.nan)
+    rows, cols = array.shape
+    total = np.zeros(array.shape)
+    for dr in range(size):
+        for dc in range(size):
+            total += padded[dr : dr + rows, dc : dc + cols]
+    return total / size**2
+
+
+class Rasters:
+    """Rasters in memory in grid of HEADER with r.param.scale computing
+    local mean, r.mapcalc of splicing and g.rename"""
+
+    def __init__(self):
+        self.maps = {}
+        self.regions = []
+        self.modules = []
+
+    def window(self, env):
+        """Returns slices of region of env in HEADER grid"""
+        region = analyses.parse_region(env["GRASS_REGION"])
+        row0 = int(round(HEADER["north"] - region["north"]))
+        col0 = int(round(region["west"] - HEADER["west"]))
+        return (
+            slice(row0, row0 + region["rows"]),
+            slice(col0, col0 + region["cols"]),
+        )
+
+    def run_command(self, module, **kwargs):
+        self.modules.append(module)
+        if module == "r.param.scale":
+            self.regions.append(kwargs["env"]["GRASS_REGION"])
+            window = self.window(kwargs["env"])
+            output = np.full((HEADER["rows"], HEADER["cols"]), np.nan)
+            output[window] = local_mean(
+                self.maps[kwargs["input"]][window], kwargs["size"]
+            )
+            self.maps[kwargs["output"]] = output
+        elif module == "g.rename":
+            old, new = kwargs["raster"]
+            self.maps[new] = self.maps.pop(old)
+
+    def mapcalc(self, expression, env=None):
+        y, x = np.mgrid[0 : HEADER["rows"], 0 : HEADER["cols"]]
+        x = HEADER["west"] + x + 0.5
+        y = HEADER["north"] - y - 0.5
+        for line in expression.splitlines():
+            match = re.match(
+                r"(\S+) = if\(x\(\) > (\S+) && x\(\) < (\S+) && y\(\) > (\S+)"
+                r" && y\(\) < (\S+), (\S+), (\S+)\)",
+                line,
+            )
+            new, w, e, s, n, window, old = match.groups()
+            inside = (x > float(w)) & (x < float(e)) & (y > float(s)) & (y < float(n))
+            self.maps[new] = np.where(inside, self.maps[window], self.maps[old])
+
+
+@pytest.fixture
+def rasters(monkeypatch):
+    rasters = Rasters()
+    monkeypatch.setattr(analyses, "scratch_space", fake_scratch_space)
+    monkeypatch.setattr(analyses.gcore, "run_command", rasters.run_command)
+    monkeypatch.setattr(analyses.grast, "mapcalc", rasters.mapcalc)
+    monkeypatch.setattr(analyses.grass_session, "run_command", rasters.run_command)
+    monkeypatch.setattr(analyses, "read_raster_header", lambda name: HEADER)
+    monkeypatch.setattr(analyses, "_computed", {})
+    rasters.maps["scan"] = terrain((HEADER["rows"], HEADER["cols"]))
+    return rasters
+
+
+@pytest.fixture
+def cancelled(monkeypatch, rasters):
+    """Fails r.param.scale once when set"""
+    cancelled = []
+    run_command = rasters.run_command
+
+    def cancellable(module, **kwargs):
+        if module == "r.param.scale" and cancelled:
+            cancelled.pop()
+            raise analyses.CalledModuleError(module, kwargs, 1)
+        run_command(module, **kwargs)
+
+    monkeypatch.setattr(analyses.gcore, "run_command", cancellable)
+    return cancelled
+
+
+def dirty(index, bbox=(10, 12, 10, 12), since=None, key=None):
+    """DirtyRegion of scan index against the previous scan,
+    the first scan is changed everywhere"""
+    from scan_pipeline import DirtyRegion
+
+    if index == 1:
+        bbox = (0, HEADER["rows"], 0, HEADER["cols"])
+    return DirtyRegion(HEADER, bbox, since=since or index - 1, index=index, key=key)
+
+
+def full_region():
+    from tangible_utils import region_from_header
+
+    return region_from_header(HEADER)
+
+
+def max_curv(index, **kwargs):
+    env = {"GRASS_REGION": full_region()}
+    kwargs.setdefault("dirty", dirty(index))
+    analyses.max_curv("scan", "curv", size=5, env=env, **kwargs)
+
+
+def test_splice_changes_only_dirty_window(rasters):
+    max_curv(1)
+    previous = rasters.maps["curv"].copy()
+    rasters.maps["scan"] = rasters.maps["scan"].copy()
+    rasters.maps["scan"][10:12, 10:12] += 5
+    max_curv(2)
+    assert rasters.regions == [full_region(), dirty(2).region(4)]
+    assert "g.rename" in rasters.modules
+    expected = local_mean(rasters.maps["scan"], 5)
+    assert np.array_equal(rasters.maps["curv"], expected, equal_nan=True)
+    rows, cols = slice(8, 14), slice(8, 14)
+    outside = np.ones(previous.shape, dtype=bool)
+    outside[rows, cols] = False
+    assert np.array_equal(
+        rasters.maps["curv"][outside], previous[outside], equal_nan=True
+    )
+    assert not np.array_equal(rasters.maps["curv"][rows, cols], previous[rows, cols])
+
+
+def test_large_window_is_not_spliced(rasters):
+    max_curv(1)
+    max_curv(2, dirty=dirty(2, bbox=(5, 35, 5, 35)))
+    assert rasters.regions == [full_region()] * 2
+    assert "g.rename" not in rasters.modules
+
+
+def test_cheap_operator_is_not_spliced(rasters, monkeypatch):
+    env = {"GRASS_REGION": full_region()}
+    for index in (1, 2, 3):
+        analyses.shaded_relief(
+            "scan", "relief", env=env, dirty=dirty(index, bbox=(10, 12, 10, 12))
+        )
+    # skipped only without change
+    analyses.shaded_relief("scan", "relief", env=env, dirty=dirty(4, bbox=None))
+    assert rasters.modules == ["r.shaded.relief"] * 3
+
+
+def test_update_dirty_after_cancel(rasters, cancelled):
+    max_curv(1)
+    max_curv(2)
+    assert rasters.regions == [full_region(), dirty(2).region(4)]
+    cancelled.append(True)
+    with pytest.raises(analyses.CalledModuleError):
+        max_curv(3)
+    # output may be partially written, the next scan computes it in full
+    max_curv(4)
+    assert rasters.regions[-1] == full_region()
+    max_curv(5)
+    assert rasters.regions[-1] == dirty(5).region(4)
+
+
+def test_update_dirty_missed_scan(rasters):
+    max_curv(1)
+    # output was not computed for scan 2 (e.g. timeout of the job)
+    max_curv(3)
+    assert rasters.regions == [full_region()] * 2
+
+
+def test_update_dirty_parameters_changed(rasters):
+    env = {"GRASS_REGION": full_region()}
+    max_curv(1)
+    max_curv(2, dirty=dirty(2, bbox=None))
+    assert len(rasters.regions) == 1
+    max_curv(3, dirty=dirty(3, bbox=None), zscale=1)
+    assert rasters.regions == [full_region()] * 2
+    # analyses file or settings changed
+    max_curv(4, dirty=dirty(4, bbox=None, key="new"), zscale=1)
+    assert rasters.regions == [full_region()] * 3
+    # another analysis writes the same output
+    analyses.landform("scan", "curv", size=5, env=env, dirty=dirty(5, bbox=None))
+    assert analyses._computed["curv"][0] == 5
+    max_curv(6, dirty=dirty(6, bbox=None, key="new"), zscale=1)
+    assert rasters.regions == [full_region()] * 5
+
+
+@pytest.fixture
+def walk_env(tmp_path):
+    """Environment with region of HEADER and GISRC of an empty mapset"""
+    (tmp_path / "loc" / "user").mkdir(parents=True)
+    gisrc = tmp_path / "gisrc"
+    gisrc.write_text(
+        "GISDBASE: {}\nLOCATION_NAME: loc\nMAPSET: user\n".format(tmp_path)
+    )
+    return {"GRASS_REGION": full_region(), "GISRC": str(gisrc)}
+
+
+def test_walk_inputs_noise(monkeypatch, walk_env):
+    rng = np.random.default_rng(0)
+    elevation = 100 + terrain((40, 40))
+    scans = [elevation + 0.1 * rng.random(elevation.shape) for i in range(2)]
+    arrays = {"friction": np.zeros(elevation.shape)}
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda name, env=None: arrays[name]
+    )
+    monkeypatch.setattr(analyses.cost_cache, "versions", analyses.cost_cache.Versions())
+    env = walk_env
+    keys = []
+    for array in scans:
+        arrays["scan"] = array
+        keys.append(
+            analyses._walk_inputs("scan", "friction", None, "1", 1, -0.2, 0.5, env)
+        )
+    assert keys[0] == keys[1]
+    arrays["scan"] = scans[1].copy()
+    arrays["scan"][20, 20] += 5
+    assert (
+        analyses._walk_inputs("scan", "friction", None, "1", 1, -0.2, 0.5, env)
+        != keys[0]
+    )
+
+
+def blobs():
+    """Scans before and after adding three blobs"""
+    y, x = np.mgrid[0:40, 0:40]
+    before = (100 + x + 0.5 * y).astype(np.float32)
+    after = before.copy()
+    after[5:10, 5:12] += 5
+    after[20:30, 25:28] += 8
+    after[30:35, 5:10] += 3
+    return before, after
+
+
+def test_change_detection_numpy_outputs(monkeypatch):
+    before, after = blobs()
+    arrays = {"before": before, "after": after}
+    written = {}
+    commands = []
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda name, env=None: arrays[name]
+    )
+    monkeypatch.setattr(
+        analyses,
+        "write_raster_array",
+        lambda array, name, env=None: written.update({name: array}),
+    )
+    monkeypatch.setattr(
+        analyses.gcore, "write_command", lambda *a, **k: commands.append((a, k))
+    )
+    env = {"GRASS_REGION": full_region()}
+    analyses.change_detection(
+        "before", "after", "change", (1, 100), (5, 1000), True, 2, False, env
+    )
+    assert set(written) == {"diff", "change"}
+    # two largest blobs
+    assert np.count_nonzero(written["change"] == 1) == 30 + 35
+    (module,), kwargs = commands[0]
+    assert module == "v.in.ascii"
+    assert "t" not in kwargs.get("flags", "")
+    assert "volume" in kwargs["columns"]
+    points = sorted(line.split("|")[:3] for line in kwargs["stdin"].splitlines())
+    assert points == [["26.5", "15.5", "2"], ["8.5", "32.5", "1"]]
+    # removed blobs use (before - a + b * after) as r.mapcalc expression
+    analyses.change_detection(
+        "before", "after", "change", 1, (5, 2000), False, 2, False, env
+    )
+    assert np.count_nonzero(written["change"] == 1) == before.size
+
+
+@pytest.fixture
+def grass_env():
+    """Environment of a running GRASS session with region of HEADER"""
+    import os
+
+    if "GISRC" not in os.environ:
+        pytest.skip("GRASS session is not running")
+    env = os.environ.copy()
+    env["GRASS_REGION"] = full_region()
+    return env
+
+
+@pytest.mark.parametrize(
+    "add, height_threshold, cells_threshold",
+    [(True, (1, 100), (5, 1000)), (False, 1, (5, 2000))],
+)
+def test_change_detection_engines(grass_env, add, height_threshold, cells_threshold):
+    from tangible_utils import write_raster_array
+
+    gcore = analyses.gcore
+    before, after = blobs()
+    if not add:
+        before, after = after, before
+    write_raster_array(before, "test_before", env=grass_env)
+    write_raster_array(after, "test_after", env=grass_env)
+    outputs = {}
+    for engine in ("numpy", "grass"):
+        change = "test_change_" + engine
+        analyses.change_detection(
+            "test_before",
+            "test_after",
+            change,
+            height_threshold,
+            cells_threshold,
+            add,
+            2,
+            False,
+            grass_env,
+            engine=engine,
+        )
+        assert gcore.find_file("diff", element="raster")["name"]
+        assert gcore.find_file(change, element="raster")["name"]
+        points = gcore.read_command(
+            "v.out.ascii", input=change, format="point", env=grass_env
+        )
+        columns = gcore.read_command("v.info", flags="c", map=change, env=grass_env)
+        outputs[engine] = (
+            sorted(tuple(float(v) for v in p.split("|")[:2]) for p in points.split()),
+            [c.split("|")[1] for c in columns.split()],
+        )
+    assert outputs["numpy"][0] == outputs["grass"][0]
+    assert set(outputs["grass"][1]) <= set(outputs["numpy"][1])
+
+
+def test_walk_inputs_mask(monkeypatch, walk_env, tmp_path):
+    elevation = 100 + terrain((40, 40))
+    arrays = {"scan": elevation, "friction": np.zeros(elevation.shape)}
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda name, env=None: arrays[name]
+    )
+    monkeypatch.setattr(analyses.cost_cache, "versions", analyses.cost_cache.Versions())
+    walk = ("scan", "friction", None, "1", 1, -0.2, 0.5)
+    keys = [analyses._walk_inputs(*walk, env=walk_env)]
+    mapset = tmp_path / "loc" / "user"
+    for element in ("cellhd", "cell"):
+        (mapset / element).mkdir()
+        (mapset / element / "MASK").write_text("1")
+    keys.append(analyses._walk_inputs(*walk, env=walk_env))
+    keys.append(analyses._walk_inputs(*walk, env=walk_env))
+    # mask changed
+    (mapset / "cell" / "MASK").write_text("12")
+    keys.append(analyses._walk_inputs(*walk, env=walk_env))
+    # mask removed
+    (mapset / "cell" / "MASK").unlink()
+    (mapset / "cellhd" / "MASK").unlink()
+    keys.append(analyses._walk_inputs(*walk, env=walk_env))
+    assert keys[0] != keys[1] == keys[2] != keys[3] != keys[0]
+    assert keys[4] == keys[0]
+
+
+def test_trail_salesman_reuses_routes_of_same_inputs(monkeypatch, walk_env):
+    elevation = 100 + terrain((40, 40))
+    arrays = {"scan": elevation, "friction": np.zeros(elevation.shape)}
+    points = ["1,2\n3,4\n5,6"]
+    solved = []
+    commands = []
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda name, env=None: arrays[name]
+    )
+    monkeypatch.setattr(analyses.cost_cache, "versions", analyses.cost_cache.Versions())
+    monkeypatch.setattr(analyses, "scratch_space", fake_scratch_space)
+    monkeypatch.setattr(
+        analyses.gcore,
+        "read_command",
+        lambda module, **k: points[0] if module == "v.out.ascii" else "1",
+    )
+    monkeypatch.setattr(
+        analyses.gcore, "run_command", lambda module, **k: commands.append(module)
+    )
+    monkeypatch.setattr(
+        analyses, "_salesman_numpy", lambda count, routes, output, env: solved.append(1)
+    )
+    monkeypatch.setattr(analyses, "_trail_routes", {})
+    env = walk_env
+    walk = ("scan", "friction", None, "1", 1, -0.2, 0.5)
+    inputs = analyses._walk_inputs(*walk, env=env)
+    coords = analyses._point_coordinates("change", env)
+    analyses._trail_routes["trails"] = (
+        walk,
+        analyses._routes_key(inputs, "change", coords),
+        len(coords),
+        {},
+    )
+    analyses.trail_salesman("trails", "change", "tour", env)
+    assert solved == [1] and not commands
+    # terrain changed since routes were computed
+    arrays["scan"] = elevation + 2
+    analyses.trail_salesman("trails", "change", "tour", env)
+    assert solved == [1] and "v.net.salesman" in commands
+    # points moved
+    arrays["scan"] = elevation
+    points[0] = "1,2\n3,4\n5,7"
+    commands.clear()
+    analyses.trail_salesman("trails", "change", "tour", env)
+    assert solved == [1] and "v.net.salesman" in commands
+
+
+def pits():
+    """Tilted plane with pits of different depth and size"""
+    y, x = np.mgrid[0:40, 0:40]
+    dem = (100 + 0.5 * x + 0.2 * y).astype(np.float32)
+    dem[10:13, 10:13] -= 3
+    dem[25:30, 20:24] -= 5
+    dem[31, 8] -= 1
+    return dem
+
+
+def test_depression_engines(grass_env):
+    from tangible_utils import read_raster_array, write_raster_array
+
+    write_raster_array(pits(), "test_pits", env=grass_env)
+    depths = []
+    for engine in ("numpy", "grass"):
+        analyses.depression(
+            "test_pits", "test_ponds_" + engine, grass_env, repeat=2, engine=engine
+        )
+        depths.append(
+            read_raster_array("test_ponds_" + engine, env=grass_env, cache=False)
+        )
+    assert np.allclose(depths[0], depths[1], atol=1e-4, equal_nan=True)
+
+
+def line_of_sight(dem, observer, obs_elev):
+    """Brute force visibility, cell by cell along its own line of sight"""
+    row0, col0 = observer
+    eye = dem[row0, col0] + obs_elev
+    visible = np.zeros(dem.shape, dtype=bool)
+    for row, col in np.ndindex(dem.shape):
+        steps = max(abs(row - row0), abs(col - col0))
+        if not steps:
+            visible[row, col] = True
+            continue
+        angle = (dem[row, col] - eye) / np.hypot(row - row0, col - col0)
+        visible[row, col] = True
+        for step in range(1, steps):
+            r = int(np.rint(row0 + (row - row0) * step / steps))
+            c = int(np.rint(col0 + (col - col0) * step / steps))
+            if (dem[r, c] - eye) / np.hypot(r - row0, c - col0) > angle:
+                visible[row, col] = False
+                break
+    return visible
+
+
+def test_visibility_flat_and_wall():
+    dem = np.zeros((40, 40))
+    assert analyses._visibility(dem, (20, 20), 1.7, HEADER).all()
+    dem[:, 25] = 10
+    visible = analyses._visibility(dem, (20, 20), 1.7, HEADER)
+    assert visible[:, :25].all() and visible[18:23, 25].all()
+    assert not visible[:, 26:].any()
+
+
+@pytest.mark.parametrize("observer", [(20, 20), (5, 30), (0, 0), (39, 12)])
+def test_visibility_brute_force(observer):
+    dem = terrain((40, 40), seed=1)
+    visible = analyses._visibility(dem, observer, 1.7, HEADER)
+    expected = line_of_sight(dem, observer, 1.7)
+    # rays to the edge pass cells close to the horizon at slightly
+    # different positions than lines of sight to each cell
+    assert (visible == expected).mean() > 0.95
+    assert visible[observer]
+
+
+def test_viewshed_numpy(monkeypatch):
+    dem = np.zeros((40, 40))
+    dem[:, 25] = 10
+    written = {}
+    monkeypatch.setattr(
+        analyses.gcore, "read_command", lambda *a, **k: "20.5,19.5,1\n10.5,5.5,2"
+    )
+    monkeypatch.setattr(analyses, "read_raster_array", lambda name, env=None: dem)
+    monkeypatch.setattr(
+        analyses,
+        "write_raster_array",
+        lambda array, name, env=None, integer=False: written.update(
+            {name: (array, integer)}
+        ),
+    )
+    monkeypatch.setattr(analyses.grass_session, "write_command", lambda *a, **k: None)
+    analyses.viewshed(
+        "scan",
+        "viewshed",
+        "points",
+        "green",
+        "red",
+        env={"GRASS_REGION": full_region()},
+        cumulative="count",
+        engine="numpy",
+    )
+    count, integer = written["count"]
+    assert integer and count.max() == 2
+    assert (count[:, :25] == 2).all() and not count[:, 26:].any()
+    output, integer = written["viewshed"]
+    assert integer
+    assert np.array_equal(np.asarray(output, dtype=int), count > 0)
+
+
+def test_viewshed_engines(grass_env):
+    from tangible_utils import read_raster_array, write_raster_array
+
+    write_raster_array(terrain((40, 40), seed=1), "test_terrain", env=grass_env)
+    analyses.gcore.write_command(
+        "v.in.ascii",
+        input="-",
+        output="test_observers",
+        separator=",",
+        stdin="20.5,19.5\n30.5,5.5",
+        overwrite=True,
+        env=grass_env,
+    )
+    outputs = []
+    for engine in ("numpy", "grass"):
+        analyses.viewshed(
+            "test_terrain",
+            "test_viewshed_" + engine,
+            "test_observers",
+            "green",
+            "red",
+            env=grass_env,
+            engine=engine,
+        )
+        info = analyses.grast.raster_info("test_viewshed_" + engine, env=grass_env)
+        assert info["datatype"] == "CELL"
+        outputs.append(
+            read_raster_array("test_viewshed_" + engine, env=grass_env, cache=False)
+        )
+    assert (outputs[0] == outputs[1]).mean() > 0.95
+
+
+@pytest.fixture
+def arrays(monkeypatch):
+    """Rasters given as arrays in their own regions, read in region of env
+    (same region or the region of HEADER), written arrays are collected"""
+    maps = {}
+    written = {}
+
+    def read(name, env=None):
+        region = analyses.parse_region(env["GRASS_REGION"])
+        array = maps[name][0]
+        assert array.shape == (region["rows"], region["cols"])
+        return array
+
+    monkeypatch.setattr(analyses, "read_raster_array", read)
+    monkeypatch.setattr(analyses, "read_raster_header", lambda name: maps[name][1])
+    monkeypatch.setattr(
+        analyses,
+        "write_raster_array",
+        lambda array, name, env=None: written.update({name: array}),
+    )
+    monkeypatch.setattr(analyses.grass_session, "run_command", lambda *a, **k: None)
+    monkeypatch.setattr(analyses.grass_session, "write_command", lambda *a, **k: None)
+    return maps, written
+
+
+def with_nulls(array):
+    array = array.astype(np.float32)
+    array[:3, :] = np.nan
+    array[20, 5:9] = np.nan
+    return array
+
+
+def test_regression():
+    rng = np.random.default_rng(0)
+    x = with_nulls(terrain((40, 40)))
+    y = 3 + 2 * x + 0.1 * rng.random(x.shape)
+    y[30, :] = np.nan
+    valid = np.isfinite(x) & np.isfinite(y)
+    b, a = np.polyfit(x[valid], y[valid], 1)
+    assert np.allclose(analyses._regression(x, y), (a, b))
+
+
+def test_match_scan_and_difference_scaled_numpy(arrays):
+    maps, written = arrays
+    env = {"GRASS_REGION": full_region()}
+    base = 100 + terrain((40, 40))
+    scan = with_nulls((base - 3) / 2)
+    maps["base"] = (base, HEADER)
+    maps["scan"] = (scan, HEADER)
+    analyses.match_scan("base", "scan", "matched", env)
+    assert np.allclose(
+        written["matched"], np.where(np.isfinite(scan), base, np.nan), equal_nan=True
+    )
+    analyses.difference_scaled("base", "scan", "diff", env)
+    assert np.nanmax(np.abs(written["diff"])) < 1e-3
+    assert np.isnan(written["diff"][:3]).all()
+
+
+def test_resample_bilinear(arrays):
+    maps, written = arrays
+    # plane in 20 x 20 cells of 2 m, bilinear interpolation is exact inside
+    header = dict(HEADER, rows=20, cols=20, **{"e-w resol": 2.0, "n-s resol": 2.0})
+    y, x = np.mgrid[0:20, 0:20]
+    maps["coarse"] = (10 + 2 * x + 3 * y, header)
+    env = {"GRASS_REGION": full_region()}
+    resampled = analyses._resample_bilinear("coarse", env)
+    y, x = np.mgrid[0:40, 0:40]
+    expected = 10 + 2 * (x - 0.5) / 2 + 3 * (y - 0.5) / 2
+    assert np.allclose(resampled[1:-1, 1:-1], expected[1:-1, 1:-1])
+    # same region
+    maps["fine"] = (terrain((40, 40)), HEADER)
+    assert np.allclose(analyses._resample_bilinear("fine", env), maps["fine"][0])
+
+
+def test_difference_numpy(arrays):
+    maps, written = arrays
+    env = {"GRASS_REGION": full_region()}
+    real = 100 + terrain((40, 40))
+    scan = with_nulls(real - 1)
+    maps["real"] = (real, HEADER)
+    maps["scan"] = (scan, HEADER)
+    analyses.difference("real", "scan", "diff", env=env)
+    assert np.allclose(written["diff"], scan * 0 + 1, equal_nan=True)
+
+
+def test_difference_engines(grass_env):
+    from tangible_utils import read_raster_array, write_raster_array
+
+    real = 100 + terrain((40, 40))
+    write_raster_array(real, "test_real", env=grass_env)
+    write_raster_array(with_nulls(0.5 * real - 3), "test_scan", env=grass_env)
+    for function, args in (
+        (analyses.difference, ("test_real", "test_scan")),
+        (analyses.difference_scaled, ("test_real", "test_scan")),
+        (analyses.match_scan, ("test_real", "test_scan")),
+    ):
+        results = []
+        for engine in ("numpy", "grass"):
+            output = "test_{}_{}".format(function.__name__, engine)
+            function(*args, output, env=grass_env, engine=engine)
+            results.append(read_raster_array(output, env=grass_env, cache=False))
+        assert np.allclose(results[0], results[1], atol=1e-3, equal_nan=True)
+
+
+def test_walk_steps_match_directions():
+    """Doubled degrees counterclockwise from east point along the step,
+    knight's moves are coded by the closest multiple of 22.5 degrees"""
+    for code, (row, col) in analyses._WALK_STEPS.items():
+        difference = (np.degrees(np.arctan2(-row, col)) - code / 2.0) % 360
+        assert min(difference, 360 - difference) < 22.5 / 4
+
+
+def walk_reference(elevation, start):
+    """Cost (distance weighted by slope) and directions to start
+    with the moves of r.walk -k (Dijkstra)"""
+    import heapq
+
+    codes = {step: code for code, step in analyses._WALK_STEPS.items()}
+    cost = np.full(elevation.shape, np.inf)
+    directions = np.full(elevation.shape, np.nan)
+    cost[start] = 0
+    queue = [(0.0, start)]
+    while queue:
+        value, (row, col) = heapq.heappop(queue)
+        if value > cost[row, col]:
+            continue
+        for dr, dc in codes:
+            r, c = row - dr, col - dc
+            if not (0 <= r < elevation.shape[0] and 0 <= c < elevation.shape[1]):
+                continue
+            step = np.hypot(dr, dc) * (1 + abs(elevation[r, c] - elevation[row, col]))
+            if value + step < cost[r, c]:
+                cost[r, c] = value + step
+                # direction from the reached cell back towards the start
+                directions[r, c] = codes[(dr, dc)] / 2.0
+                heapq.heappush(queue, (cost[r, c], (r, c)))
+    return cost.astype(np.float32), directions.astype(np.float32)
+
+
+@pytest.fixture
+def walks(monkeypatch):
+    """r.walk computed by walk_reference, returns arrays, r.walk starts
+    and written lines"""
+    arrays = {"scan": 100 + terrain((40, 40)), "friction": np.zeros((40, 40))}
+    starts = []
+    lines = {}
+
+    def run_command(module, **kwargs):
+        if module != "r.walk":
+            return
+        region = analyses.parse_region(kwargs["env"]["GRASS_REGION"])
+        start = analyses._cell(kwargs["start_coordinates"], region)
+        starts.append(kwargs["start_coordinates"])
+        cost, directions = walk_reference(arrays["scan"], start)
+        arrays[kwargs["output"]] = cost
+        arrays[kwargs["outdir"]] = directions
+
+    monkeypatch.setattr(analyses.gcore, "run_command", run_command)
+    monkeypatch.setattr(
+        analyses, "read_raster_array", lambda name, env=None, cache=True: arrays[name]
+    )
+    monkeypatch.setattr(
+        analyses, "_write_lines", lambda l, output, env: lines.update({output: l})
+    )
+    monkeypatch.setattr(analyses, "scratch_space", fake_scratch_space)
+    monkeypatch.setattr(
+        analyses.cost_cache, "surfaces", analyses.cost_cache.CostSurfaces()
+    )
+    monkeypatch.setattr(analyses.cost_cache, "versions", analyses.cost_cache.Versions())
+    return arrays, starts, lines
+
+
+def test_backtrack(walks):
+    arrays, starts, lines = walks
+    cost, directions = walk_reference(arrays["scan"], (30, 5))
+    region = analyses.parse_region(full_region())
+    line = analyses._backtrack(directions, (3, 36), (30, 5), region)
+    assert line[0] == (36.5, 36.5) and line[-1] == (5.5, 9.5)
+    steps = set(analyses._WALK_STEPS.values())
+    for (x0, y0), (x1, y1) in zip(line, line[1:]):
+        assert (int(y0 - y1), int(x1 - x0)) in steps
+    # cost along the line is decreasing towards the start
+    cells = [(int(40 - y), int(x)) for x, y in line]
+    assert all(cost[a] > cost[b] for a, b in zip(cells, cells[1:]))
+    # null direction ends the line
+    directions[10, :] = np.nan
+    line = analyses._backtrack(directions, (3, 36), (30, 5), region)
+    assert line[-1][1] == 29.5
+
+
+def test_trails_numpy(walks, walk_env):
+    arrays, starts, lines = walks
+    coords = [["5.5", "34.5"], ["36.5", "36.5"], ["20.5", "5.5"], ["30.5", "20.5"]]
+    args = ("scan", "friction", "0.72,6,1.9998,-1.9998", 0.5, -0.8125, coords)
+    inputs, routes = analyses._trails_numpy(*args, "routes", None, 0.5, walk_env)
+    # one r.walk for each origin
+    assert starts == ["5.5,34.5", "36.5,36.5", "20.5,5.5"]
+    assert sorted(routes) == [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+    region = analyses.parse_region(full_region())
+    for (i, j), (cost, line) in routes.items():
+        assert line[0] == tuple(float(c) for c in coords[i])
+        assert line[-1] == tuple(float(c) for c in coords[j])
+        reference = walk_reference(
+            arrays["scan"], analyses._cell(",".join(coords[i]), region)
+        )[0]
+        assert np.isclose(cost, reference[analyses._cell(",".join(coords[j]), region)])
+    assert len(lines["routes"]) == 6
+    # the same inputs reuse cost surfaces
+    assert analyses._trails_numpy(*args, "routes", None, 0.5, walk_env)[1] == routes
+    assert len(starts) == 3
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+pytest.importorskip("grass.script")
+analyses_graph = pytest.importorskip("analyses_graph")
+scratch = pytest.importorskip("scratch")
+
+analysis = analyses_graph.analysis
+
+
+def recording(events, name, inputs=None, outputs=None, declared=True, action=None):
+    """Function recording its start and end, declared with inputs and outputs"""
+
+    def run(**kwargs):
+        events.append(("start", name))
+        if action:
+            action()
+        events.append(("end", name))
+
+    if declared:
+        run = analysis(inputs=inputs, outputs=outputs)(run)
+    return (name, run)
+
+
+def test_build_graph():
+    events = []
+    callables = [
+        recording(events, "run_a", ["scanned_elev"], ["slope"]),
+        recording(events, "run_b", ["scan"], ["contours"]),
+        recording(events, "run_c", ["slope"], ["slope_colors"]),
+        recording(events, "run_d", ["dem"], ["scan"]),
+        recording(events, "run_e", declared=False),
+        recording(events, "run_f", ["slope"], ["flow"]),
+    ]
+    graph = analyses_graph.build_graph(callables, {"scanned_elev": "scan@user"})
+    assert graph == {
+        "run_a": set(),
+        "run_b": set(),
+        # reads output of run_a
+        "run_c": {"run_a"},
+        # writes input of run_a and run_b
+        "run_d": {"run_a", "run_b"},
+        # undeclared function is a barrier
+        "run_e": {"run_a", "run_b", "run_c", "run_d"},
+        "run_f": {"run_e"},
+    }
+
+
+def test_run_graph_order():
+    events = []
+    # independent functions have to run at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    callables = [
+        recording(events, "run_a", ["scan"], ["slope"], action=barrier.wait),
+        recording(events, "run_b", ["scan"], ["contours"], action=barrier.wait),
+        recording(events, "run_c", ["slope", "contours"], ["combined"]),
+        recording(events, "run_d", declared=False),
+        recording(events, "run_e", ["scan"], ["flow"]),
+    ]
+    timings = {}
+    analyses_graph.run_graph(callables, {}, timings, max_workers=4)
+    assert not barrier.broken
+    assert sorted(events[:2]) == [("start", "run_a"), ("start", "run_b")]
+    assert events[4:] == [
+        ("start", "run_c"),
+        ("end", "run_c"),
+        ("start", "run_d"),
+        ("end", "run_d"),
+        ("start", "run_e"),
+        ("end", "run_e"),
+    ]
+    assert sorted(timings) == ["run_a", "run_b", "run_c", "run_d", "run_e"]
+
+
+def test_run_graph_errors_and_cancel():
+    events = []
+    cancel = threading.Event()
+
+    def fail():
+        raise RuntimeError("failed")
+
+    callables = [
+        recording(events, "run_a", [], ["a"], action=fail),
+        recording(events, "run_b", ["a"], ["b"], action=cancel.set),
+        recording(events, "run_c", ["b"], ["c"]),
+    ]
+    analyses_graph.run_graph(callables, {}, {}, cancel=cancel)
+    assert events == [("start", "run_a"), ("start", "run_b"), ("end", "run_b")]
+
+
+def test_run_graph_uses_scratch_of_frame():
+    frames = []
+    callables = [
+        ("run_{}".format(i), lambda **kwargs: frames.append(scratch.current_frame()))
+        for i in range(3)
+    ]
+    with scratch.frame_scratch() as frame:
+        analyses_graph.run_graph(callables, {}, {}, max_workers=2)
+    assert frames == [frame] * 3
@@ -0,0 +1,47 @@
+import numpy as np
+
+import cost_cache
+
+
+def scan(seed, noise=0.2):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:50, 0:60]
+    return 100 + 10 * np.sin(x / 7.0) + noise * (rng.random((50, 60)) - 0.5)
+
+
+def test_versions_ignore_noise():
+    versions = cost_cache.Versions()
+    first = versions.digest("scan", scan(0), tolerance=0.5)
+    assert versions.digest("scan", scan(1), tolerance=0.5) == first
+    assert versions.digest("scan", scan(1), tolerance=0) != first
+
+
+def test_versions_change():
+    versions = cost_cache.Versions()
+    first = versions.digest("scan", scan(0), tolerance=0.5)
+    changed = scan(1)
+    changed[20, 30] += 2
+    assert versions.digest("scan", changed, tolerance=0.5) != first
+    missing = scan(2)
+    missing[0, 0] = np.nan
+    assert versions.digest("scan", missing, tolerance=0.5) != first
+
+
+def test_versions_drift():
+    versions = cost_cache.Versions()
+    first = versions.digest("scan", scan(0), tolerance=0.5)
+    digests = [versions.digest("scan", scan(0) + 0.2 * i, 0.5) for i in range(1, 4)]
+    # drift is compared with the first version, not the last scan
+    assert digests[:2] == [first, first]
+    assert digests[2] != first
+
+
+def test_surfaces_hit_for_noisy_scans():
+    surfaces = cost_cache.CostSurfaces()
+    versions = cost_cache.Versions()
+    cost = np.zeros((50, 60))
+    key = ("r.walk", versions.digest("scan", scan(0), 0.5), "1,2")
+    surfaces.put(key, ["3,4"], cost, cost.copy())
+    key = ("r.walk", versions.digest("scan", scan(1), 0.5), "1,2")
+    assert surfaces.get(key, ["3,4"]) is not None
+    assert surfaces.hits == 1
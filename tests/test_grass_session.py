@@ -0,0 +1,176 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("grass.script")
+grass_session = pytest.importorskip("grass_session")
+
+
+class FakeProcess:
+    """Worker process replying with the given statuses"""
+
+    def __init__(self, statuses):
+        self.requests = []
+        self.stdin = self
+        self.stdout = io.StringIO(
+            "".join(json.dumps({"status": s}) + "\n" for s in ["ready"] + statuses)
+        )
+        self.stopped = False
+
+    def write(self, line):
+        self.requests.append(json.loads(line))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.stopped = True
+
+    def poll(self):
+        return 0 if self.stopped else None
+
+    def wait(self, timeout=None):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    """Session with enabled worker, returns session, started processes
+    and modules run as usual"""
+    session = grass_session.GrassSession()
+    session.enabled = True
+    processes = []
+    modules = []
+    statuses = []
+
+    def popen(*args, **kwargs):
+        processes.append(FakeProcess(statuses))
+        return processes[-1]
+
+    monkeypatch.setattr(grass_session, "Popen", popen)
+    monkeypatch.setattr(
+        grass_session.gcore,
+        "run_command",
+        lambda module, **kwargs: modules.append((module, kwargs)),
+    )
+    monkeypatch.setenv("GISRC", "/tmp/gisrc")
+    return session, processes, modules, statuses
+
+
+def test_request(session):
+    session, processes, modules, statuses = session
+    statuses.append("done")
+    env = {"GISRC": "/tmp/gisrc", "GRASS_OVERWRITE": "1"}
+    session.run_command("g.rename", raster=["a", "b"], env=env)
+    assert processes[0].requests == [
+        {
+            "module": "g.rename",
+            "kwargs": {"raster": ["a", "b"]},
+            "stdin": None,
+            "gisrc": "/tmp/gisrc",
+            "overwrite": True,
+        }
+    ]
+    assert not modules
+    assert (session.handled, session.fallbacks) == (1, 0)
+
+
+def test_unsupported_request_runs_module(session):
+    session, processes, modules, statuses = session
+    statuses.append("unsupported")
+    env = {"GISRC": "/tmp/gisrc"}
+    session.run_command("g.remove", type="raster", name="a", env=env)
+    assert len(processes[0].requests) == 1
+    assert modules == [("g.remove", {"type": "raster", "name": "a", "env": env})]
+    assert (session.handled, session.fallbacks) == (0, 1)
+
+
+def test_other_gisrc_runs_module(session):
+    session, processes, modules, statuses = session
+    env = {"GISRC": "/tmp/other"}
+    session.run_command("g.remove", type="raster", name="a", env=env)
+    assert not processes
+    assert modules == [("g.remove", {"type": "raster", "name": "a", "env": env})]
+    assert session.fallbacks == 1
+
+
+def test_other_module_runs_module(session):
+    session, processes, modules, statuses = session
+    session.run_command("r.mapcalc", expression="a = 1")
+    assert not processes
+    assert modules == [("r.mapcalc", {"expression": "a = 1"})]
+    assert session.fallbacks == 0
+
+
+def test_restart(session):
+    session, processes, modules, statuses = session
+    statuses.append("restart")
+    session.run_command("g.remove", type="raster", name="a", flags="f")
+    assert processes[0].stopped
+    assert modules
+    statuses[:] = ["done"]
+    session.run_command("g.remove", type="raster", name="a", flags="f")
+    assert len(processes) == 2
+    assert session.handled == 1
+
+
+class FakeLibgis:
+    def __init__(self, vectors=()):
+        self.calls = []
+        self.vectors = vectors
+
+    def G_remove(self, element, name):
+        self.calls.append(("G_remove", element.decode(), name.decode()))
+        return 1
+
+    def G_rename(self, element, old, new):
+        self.calls.append(("G_rename", element.decode(), old.decode(), new.decode()))
+        return 1
+
+    def G_find_vector2(self, name, mapset):
+        return mapset if name.decode() in self.vectors else None
+
+
+class FakeLibvector:
+    def __init__(self):
+        self.deleted = []
+
+    def Vect_delete(self, name):
+        self.deleted.append(name.decode())
+        return 0
+
+
+@pytest.fixture
+def worker(tmp_path):
+    worker = grass_session.SessionWorker.__new__(grass_session.SessionWorker)
+    worker.libgis = FakeLibgis(vectors=("lines",))
+    worker.libvector = FakeLibvector()
+    worker.encode = str.encode
+    worker.mapset = "user"
+    worker.path = str(tmp_path)
+    (tmp_path / "cellhd").mkdir()
+    for name in ("a", "b"):
+        (tmp_path / "cellhd" / name).write_text("proj: 99\n")
+    return worker
+
+
+def test_worker_removes_with_library(worker):
+    worker.remove({"type": "raster,vector", "name": "a,lines,missing", "flags": "f"})
+    elements = grass_session.RASTER_ELEMENTS + ("colr2/user",)
+    assert worker.libgis.calls == [
+        ("G_remove", element, name)
+        for name in ("a", "lines", "missing")
+        for element in elements
+    ]
+    assert worker.libvector.deleted == ["lines"]
+
+
+def test_worker_renames_with_library(worker):
+    with pytest.raises(grass_session.Unsupported):
+        worker.rename({"raster": "a,b"}, overwrite=False)
+    worker.rename({"raster": "a,b"}, overwrite=True)
+    elements = grass_session.RASTER_ELEMENTS + ("colr2/user",)
+    assert worker.libgis.calls == [("G_remove", e, "b") for e in elements] + [
+        ("G_rename", e, "a", "b") for e in elements
+    ]
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+from profiling import FrameProfiler
+
+
+def process(profiler, signal=None, skip=False, stages=("import", "analysis")):
+    """Processes one frame with the given stages"""
+    frame = profiler.begin_frame(signal)
+    with profiler.frame(frame):
+        for name in stages:
+            with profiler.span(name):
+                time.sleep(0.001)
+        if skip:
+            profiler.skip()
+    return frame
+
+
+def test_disabled_records_nothing():
+    profiler = FrameProfiler()
+    assert process(profiler) is None
+    with profiler.span("import"):
+        pass
+    assert profiler.frames() == []
+    assert profiler.chrome_trace()["traceEvents"] == []
+
+
+def test_spans_of_frames():
+    profiler = FrameProfiler(size=2)
+    profiler.enabled = True
+    signal = time.time() - 0.01
+    first = process(profiler, signal=signal)
+    assert first.start == signal
+    assert [span[0] for span in first.spans] == [
+        "notify",
+        "queue",
+        "import",
+        "analysis",
+    ]
+    for previous, span in zip(first.spans, first.spans[1:]):
+        assert previous[3] <= span[2] <= span[3]
+    assert first.spans[-1][3] <= first.end
+
+    # spans from other threads are added to the current frame
+    def worker():
+        with profiler.span("worker"):
+            pass
+
+    frame = profiler.begin_frame()
+    with profiler.frame(frame):
+        with profiler.span("analyses"):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+    assert [span[0] for span in frame.spans] == ["queue", "worker", "analyses"]
+    assert frame.spans[1][4] == thread.ident != frame.spans[2][4]
+    process(profiler)
+    # ring buffer
+    assert [f.id for f in profiler.frames()] == [2, 3]
+    assert profiler.last.id == 3
+
+
+def test_summary():
+    profiler = FrameProfiler()
+    profiler.enabled = True
+    for i in range(3):
+        process(profiler)
+    process(profiler, skip=True, stages=("import",))
+    fps, stages = profiler.summary()
+    assert fps > 0
+    assert list(stages) == ["queue", "import", "analysis"]
+    assert stages["import"] > 0
+    assert profiler.skipped() == 1
+    assert "(1 skipped)" in profiler.summary_text()
+
+
+def test_chrome_trace(tmp_path):
+    profiler = FrameProfiler()
+    profiler.enabled = True
+    frame = process(profiler)
+    path = tmp_path / "trace.json"
+    profiler.export_chrome_trace(str(path))
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == [
+        "frame 1",
+        "queue",
+        "import",
+        "analysis",
+    ]
+    assert all(event["ph"] == "X" and event["args"]["frame"] == 1 for event in events)
+    assert events[0]["ts"] == frame.start * 1e6
+    assert events[2]["dur"] > 0
+    assert events[2]["tid"] == threading.get_ident()
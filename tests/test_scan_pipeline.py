@@ -0,0 +1,227 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("grass.script")
+scan_pipeline = pytest.importorskip("scan_pipeline")
+
+HEADER = {
+    "north": 40.0,
+    "south": 0.0,
+    "east": 40.0,
+    "west": 0.0,
+    "rows": 40,
+    "cols": 40,
+    "e-w resol": 1.0,
+    "n-s resol": 1.0,
+}
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Feeds arrays appended to the returned list to ScanPipeline.import_scan"""
+    queue = []
+    monkeypatch.setattr(scan_pipeline, "read_raster_header", lambda name: HEADER)
+    monkeypatch.setattr(
+        scan_pipeline,
+        "read_raster_array",
+        lambda name, env=None, cache=True: queue.pop(0),
+    )
+    monkeypatch.setattr(scan_pipeline, "write_raster_array", lambda *a, **k: None)
+    monkeypatch.setattr(scan_pipeline, "cache_raster_array", lambda *a, **k: None)
+    monkeypatch.setattr(
+        scan_pipeline.grass_session, "run_command", lambda *a, **k: None
+    )
+    return queue
+
+
+def model():
+    y, x = np.mgrid[0:40, 0:40]
+    return (100 + 10 * np.sin(x / 7.0) + 5 * np.cos(y / 5.0)).astype(np.float32)
+
+
+def scan_filter():
+    return {"filter": False, "threshold": 0, "debug": False, "counter": 0}
+
+
+GATE = {"tolerance": 0.5}
+OCCLUSION = {"threshold": 20, "action": "patch", "min_cells": 4, "baseline": 3}
+
+
+def test_occluded_hand_does_not_change_scan(scans):
+    pipeline = scan_pipeline.ScanPipeline()
+    for i in range(3):
+        scans.append(model())
+        frame = pipeline.import_scan(
+            "scan", scan_filter(), occlusion=OCCLUSION, changeGate=GATE
+        )
+    assert frame.unchanged
+    assert pipeline.skipped == 2
+    hand = model()
+    hand[10:20, 15:25] += 50
+    scans.append(hand)
+    frame = pipeline.import_scan(
+        "scan", scan_filter(), occlusion=OCCLUSION, changeGate=GATE
+    )
+    assert frame.occlusion[10:20, 15:25].all()
+    assert frame.unchanged
+    assert pipeline.skipped == 3
+
+
+def test_occluded_hand_is_not_dirty(scans):
+    pipeline = scan_pipeline.ScanPipeline()
+    params = dict(occlusion=OCCLUSION, changeGate=GATE, dirtyTolerance=0.1)
+    for i in range(3):
+        scans.append(model())
+        pipeline.import_scan("scan", scan_filter(), **params)
+    # small drift below tolerance of the change gate, scan is skipped
+    drift = model()
+    drift[10:20, 15:25] += 0.3
+    scans.append(drift)
+    assert pipeline.import_scan("scan", scan_filter(), **params).unchanged
+    # hand is patched by the skipped scan, only the real change is dirty
+    hand = drift.copy()
+    hand[10:20, 15:25] += 50
+    hand[32, 32] += 20
+    scans.append(hand)
+    frame = pipeline.import_scan("scan", scan_filter(), **params)
+    assert not frame.unchanged
+    assert frame.dirty.bbox == (32, 33, 32, 33)
+
+
+def test_dirty_region_ignores_cells():
+    previous = model()
+    array = previous.copy()
+    array[5, 6] += 3
+    ignore = np.zeros(array.shape, dtype=bool)
+    dirty = scan_pipeline.DirtyRegion.compare(HEADER, array, previous)
+    assert dirty.bbox == (5, 6, 6, 7)
+    ignore[5, 6] = True
+    dirty = scan_pipeline.DirtyRegion.compare(HEADER, array, previous, ignore=ignore)
+    assert dirty.empty
+
+
+def test_dirty_region_provenance(scans):
+    pipeline = scan_pipeline.ScanPipeline()
+    scans.append(model())
+    first = pipeline.import_scan("scan", scan_filter(), key="analyses")
+    scans.append(model())
+    second = pipeline.import_scan("scan", scan_filter(), key="analyses")
+    assert first.dirty.full and first.dirty.since is None
+    assert second.dirty.empty
+    assert (second.dirty.since, second.dirty.index) == (first.index, second.index)
+    assert second.dirty.key == "analyses"
+
+
+def frame(index, value=0, header=HEADER):
+    array = np.full((header["rows"], header["cols"]), value, dtype=np.float32)
+    return scan_pipeline.ScanFrame("scan", header, array, index=index)
+
+
+def test_scan_history():
+    history = scan_pipeline.ScanHistory(size=3)
+    assert len(history) == 0 and history.stack() is None
+    for index in range(1, 5):
+        history.append(frame(index, value=index))
+    assert history.size == len(history) == 3
+    assert [f.index for f in history.frames()] == [2, 3, 4]
+    assert [f.index for f in history.frames(2)] == [3, 4]
+    assert history[-1].index == 4 and history[0].index == 2
+    assert [f.index for f in history[1:]] == [3, 4]
+    assert history.get(3) is history[1]
+    assert history.get(1) is None
+    assert history.stack(2).shape == (2, 40, 40)
+    assert (history.stack()[:, 0, 0] == [2, 3, 4]).all()
+    # scans of other region are not stacked with the latest one
+    history.append(frame(5, value=5, header=dict(HEADER, rows=20, north=20.0)))
+    assert history.stack().shape == (1, 20, 40)
+    history.clear()
+    assert len(history) == 0
+
+
+def test_scan_history_write(monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        scan_pipeline,
+        "write_raster_array",
+        lambda array, name, env=None: written.append((array, name, env)),
+    )
+    history = scan_pipeline.ScanHistory()
+    history.append(frame(1, value=1, header=dict(HEADER, rows=20, north=20.0)))
+    history.write(history[-1], "past", env={"GRASS_REGION": "other"})
+    array, name, env = written[0]
+    assert array is history[-1].array and name == "past"
+    assert env["GRASS_REGION"] == history[-1].region
+
+
+def test_pipeline_history(scans):
+    pipeline = scan_pipeline.ScanPipeline(historySize=2)
+    arrays = [model() + i for i in range(3)] + [model() + 2]
+    scans.extend(arrays)
+    frames = [
+        pipeline.import_scan("scan", scan_filter(), changeGate=GATE) for each in arrays
+    ]
+    # the last scan didn't change
+    assert frames[-1].unchanged
+    assert [f.index for f in pipeline.history.frames()] == [2, 3]
+    assert pipeline.history[-1] is frames[2]
+    assert pipeline.history[-1].array is arrays[2]
+    assert frames[1].timestamp <= frames[2].timestamp
+
+
+def test_temporal_filter_ema():
+    temporal = scan_pipeline.TemporalFilter("ema", alpha=0.25)
+    first = np.full((4, 4), 8.0)
+    first[0, 0] = np.nan
+    assert np.array_equal(temporal.apply(first), first, equal_nan=True)
+    second = np.full((4, 4), 4.0)
+    second[1, 1] = np.nan
+    filtered = temporal.apply(second)
+    assert filtered.dtype == np.float32
+    # pixel without previous value
+    assert filtered[0, 0] == 4
+    # missing pixel keeps previous value
+    assert filtered[1, 1] == 8
+    assert filtered[2, 2] == 0.25 * 4 + 0.75 * 8
+
+
+def test_temporal_filter_median():
+    temporal = scan_pipeline.TemporalFilter("median", frames=3)
+    for value in (1, 9, 2, 3):
+        filtered = temporal.apply(np.full((4, 4), float(value)))
+    # median of last three scans
+    assert (filtered == 3).all()
+    spike = np.full((4, 4), 3.0)
+    spike[2, 2] = 100
+    assert temporal.apply(spike)[2, 2] == 3
+
+
+def test_temporal_filter_reject_and_reset():
+    temporal = scan_pipeline.TemporalFilter("ema", alpha=0.5, reject=5)
+    temporal.apply(np.full((4, 4), 10.0))
+    hand = np.full((4, 4), 12.0)
+    hand[1:3, 1:3] = 40
+    filtered = temporal.apply(hand)
+    assert (filtered[1:3, 1:3] == 10).all()
+    assert filtered[0, 0] == 11
+    # new shape of scans
+    other = np.full((2, 3), 50.0)
+    assert np.array_equal(temporal.apply(other), other)
+    with pytest.raises(ValueError):
+        scan_pipeline.TemporalFilter("mean")
+
+
+def test_pipeline_temporal_filter(scans, monkeypatch):
+    written = []
+    monkeypatch.setattr(
+        scan_pipeline,
+        "write_raster_array",
+        lambda array, name, env=None: written.append(array),
+    )
+    pipeline = scan_pipeline.ScanPipeline()
+    scans.extend([model(), model() + 2])
+    for each in range(2):
+        frame = pipeline.import_scan(
+            "scan", scan_filter(), temporalFilter={"method": "ema", "alpha": 0.5}
+        )
+    assert np.allclose(frame.array, model() + 1)
+    assert written[-1] is frame.array
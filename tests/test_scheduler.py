@@ -0,0 +1,71 @@
+import threading
+import time
+
+from scheduler import FrameScheduler
+
+
+def test_stop_without_wait_cancels_running_job():
+    stopped = threading.Event()
+    started = threading.Event()
+    scheduler = FrameScheduler(onStopped=stopped.set)
+    scheduler.start()
+
+    def callback(job):
+        started.set()
+        # analysis which checks cancel only after a while
+        job.cancelled.wait(5)
+        time.sleep(0.2)
+
+    job = scheduler.submit("scan", callback)
+    assert started.wait(5)
+    start = time.perf_counter()
+    scheduler.stop(wait=False)
+    assert time.perf_counter() - start < 0.1
+    assert job.is_cancelled()
+    assert not stopped.is_set()
+    assert stopped.wait(5)
+    assert not scheduler.running
+
+
+def test_start_after_stop_without_wait():
+    done = []
+    started = threading.Event()
+    scheduler = FrameScheduler()
+    scheduler.start()
+    scheduler.submit("scan", lambda job: (started.set(), time.sleep(0.2)))
+    assert started.wait(5)
+    scheduler.stop(wait=False)
+    scheduler.start()
+    assert scheduler.running
+    # worker of the stopped scheduler processes new frames
+    scheduler.submit("scan", lambda job: done.append(job))
+    for i in range(50):
+        if done:
+            break
+        time.sleep(0.1)
+    scheduler.stop()
+    assert len(done) == 1
+
+
+def test_timeout_read_for_each_frame():
+    timeouts = [None]
+    scheduler = FrameScheduler(timeout=lambda: timeouts[0])
+    scheduler.start()
+    started = threading.Event()
+    jobs = [
+        scheduler.submit(
+            "scan", lambda job: (started.set(), time.sleep(0.3)), coalesce=False
+        )
+    ]
+    assert started.wait(5)
+    timeouts[0] = 0.05
+    jobs.append(
+        scheduler.submit("scan", lambda job: job.cancelled.wait(5), coalesce=False)
+    )
+    for i in range(50):
+        if scheduler.processed == 2:
+            break
+        time.sleep(0.1)
+    scheduler.stop()
+    assert [job.timedOut for job in jobs] == [False, True]
+    assert scheduler.timedOut == 1
@@ -0,0 +1,145 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("grass.script")
+scratch = pytest.importorskip("scratch")
+
+
+def dead_pid():
+    """Returns ID of process which finished"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def location(tmp_path, monkeypatch):
+    """Location with current mapset and GISRC pointing to it,
+    returns location path and environment"""
+    location = tmp_path / "grassdata" / "loc"
+    (location / "PERMANENT").mkdir(parents=True)
+    (location / "PERMANENT" / "DEFAULT_WIND").write_text("proj: 0\n")
+    (location / "user").mkdir()
+    (location / "user" / "WIND").write_text("proj: 0\n")
+    gisrc = tmp_path / "gisrc"
+    gisrc.write_text(
+        "GISDBASE: {}\nLOCATION_NAME: loc\nMAPSET: user\n".format(
+            tmp_path / "grassdata"
+        )
+    )
+    monkeypatch.setattr(scratch, "_mapset", None)
+    return location, {"GISRC": str(gisrc)}
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    """Collects g.remove calls as (type, names)"""
+    calls = []
+
+    def run_command(module, **kwargs):
+        assert module == "g.remove"
+        calls.append((kwargs["type"], list(kwargs["name"])))
+
+    monkeypatch.setattr(scratch.grass_session, "run_command", run_command)
+    return calls
+
+
+def test_running():
+    assert scratch._running(os.getpid())
+    assert not scratch._running(dead_pid())
+
+
+def test_orphan_pid():
+    dead = dead_pid()
+    assert scratch._orphan_pid("tlscratch_{}_dx_1234abcd".format(dead)) == dead
+    assert scratch._orphan_pid("tlscratch_{}_dx_1234abcd".format(os.getpid())) is None
+    assert scratch._orphan_pid("tlscratch_{}_dx_1234abcd".format(os.getppid())) is None
+    assert scratch._orphan_pid("tlscratch_x") is None
+
+
+def test_remove_orphans(location, removed, tmp_path, monkeypatch):
+    location, env = location
+    dead, live = dead_pid(), os.getppid()
+    shm = tmp_path / "shm"
+    shm.mkdir()
+    for pid in (dead, live):
+        name = "tlscratch_{}".format(pid)
+        (shm / (name + "_x")).mkdir()
+        (shm / (name + "_rc_y")).write_text("")
+        os.symlink(shm / (name + "_x"), location / name)
+    monkeypatch.setattr(
+        scratch.gcore,
+        "read_command",
+        lambda *args, **kwargs: "\n".join(
+            [
+                "raster/tlscratch_{}_dx_1".format(dead),
+                "raster/tlscratch_{}_dy_2".format(dead),
+                "vector/tlscratch_{}_points_3".format(dead),
+                "raster/tlscratch_{}_dx_4".format(live),
+                "raster/tlscratch_{}_dx_5".format(os.getpid()),
+            ]
+        ),
+    )
+
+    scratch.remove_orphans(env)
+
+    assert sorted(os.listdir(location)) == sorted(
+        ["PERMANENT", "user", "tlscratch_{}".format(live)]
+    )
+    assert sorted(os.listdir(shm)) == [
+        "tlscratch_{}_rc_y".format(live),
+        "tlscratch_{}_x".format(live),
+    ]
+    assert sorted(removed) == [
+        (
+            "raster",
+            ["tlscratch_{}_dx_1".format(dead), "tlscratch_{}_dy_2".format(dead)],
+        ),
+        ("vector", ["tlscratch_{}_points_3".format(dead)]),
+    ]
+
+
+def test_cleanup_current_mapset(removed):
+    """Without scratch mapset all maps are removed by one g.remove per type"""
+    space = scratch.Scratch()
+    rasters = [space.raster("a"), space.raster("b"), space.raster("c")]
+    vector = space.vector("v")
+    assert space.environ({"GISRC": "rc"}) == {"GISRC": "rc"}
+    assert space.qualified(rasters[0]) == rasters[0]
+
+    space.cleanup()
+    assert sorted(removed) == [("raster", rasters), ("vector", [vector])]
+    space.cleanup()
+    assert len(removed) == 2
+
+
+def test_cleanup_scratch_mapset(location, removed, tmp_path):
+    location, env = location
+    shm = tmp_path / "shm"
+    shm.mkdir()
+    mapset = scratch.use_mapset(str(shm), env)
+    assert scratch.use_mapset(str(shm), env) is mapset
+    assert os.path.realpath(mapset.link) == mapset.path
+    assert os.path.exists(os.path.join(mapset.path, "WIND"))
+
+    space = scratch.Scratch(env)
+    temporary = space.raster("dx")
+    current = space.raster("dy", current=True)
+    assert space.qualified(temporary) == "{}@{}".format(temporary, mapset.name)
+    assert space.qualified(current) == current
+    assert space.environ(env)["GISRC"] == mapset.gisrc
+    for element in ("cell", "cellhd", "fcell"):
+        os.makedirs(os.path.join(mapset.path, element))
+        open(os.path.join(mapset.path, element, temporary), "w").close()
+
+    space.cleanup()
+    for element in ("cell", "cellhd", "fcell"):
+        assert not os.listdir(os.path.join(mapset.path, element))
+    assert removed == [("raster", [current])]
+
+    assert scratch.use_mapset("", env) is None
+    assert not os.path.lexists(mapset.link)
+    assert not os.listdir(shm)
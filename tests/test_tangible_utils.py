@@ -0,0 +1,343 @@
+import os
+import threading
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip("grass.script")
+tangible_utils = pytest.importorskip("tangible_utils")
+scan_pipeline = pytest.importorskip("scan_pipeline")
+
+HEADER = {
+    "north": 40.0,
+    "south": 0.0,
+    "east": 40.0,
+    "west": 0.0,
+    "rows": 40,
+    "cols": 40,
+    "e-w resol": 1.0,
+    "n-s resol": 1.0,
+}
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Feeds the same model to ScanPipeline.import_scan"""
+    y, x = np.mgrid[0:40, 0:40]
+    model = (100 + 10 * np.sin(x / 7.0)).astype(np.float32)
+    monkeypatch.setattr(scan_pipeline, "read_raster_header", lambda name: HEADER)
+    monkeypatch.setattr(
+        scan_pipeline, "read_raster_array", lambda name, env=None, cache=True: model
+    )
+    monkeypatch.setattr(scan_pipeline, "write_raster_array", lambda *a, **k: None)
+    monkeypatch.setattr(scan_pipeline, "cache_raster_array", lambda *a, **k: None)
+    monkeypatch.setattr(
+        scan_pipeline.grass_session, "run_command", lambda *a, **k: None
+    )
+
+
+def settings():
+    return {
+        "tangible": {
+            "scan": {"skip_unchanged": {"tolerance": 0.5}, "elevation": "dem"},
+            "output": {"scan": "scan", "calibrate": False, "calibration_scan": ""},
+            "drawing": {"active": False},
+            "analyses": {},
+        }
+    }
+
+
+def test_unchanged_scan_runs_analyses_of_new_subtask(scans):
+    pipeline = scan_pipeline.ScanPipeline()
+    scanFilter = {"filter": False, "threshold": 0, "debug": False, "counter": 0}
+
+    def run(**kwargs):
+        return tangible_utils.run_analyses(
+            settings(), None, None, None, None, scanFilter, pipeline=pipeline, **kwargs
+        )
+
+    assert run(subTask=0)
+    assert not run(subTask=0)
+    assert run(subTask=1)
+    assert not run(subTask=1)
+
+
+@pytest.mark.parametrize(
+    "integer, dtype, flags", [(False, "f4", "f"), (True, "i4", "s")]
+)
+def test_write_raster_array_type(monkeypatch, integer, dtype, flags):
+    written = []
+
+    def run_command(module, **kwargs):
+        written.append((kwargs["flags"], np.fromfile(kwargs["input"], dtype=dtype)))
+
+    monkeypatch.setattr(tangible_utils.gscript, "run_command", run_command)
+    env = {"GRASS_REGION": tangible_utils.region_from_header(HEADER)}
+    array = np.arange(1600).reshape(40, 40) % 3
+    tangible_utils.write_raster_array(array, "map", env=env, integer=integer)
+    assert written[0][0] == flags
+    assert np.array_equal(written[0][1], array.ravel())
+
+
+LATLON_CELLHD = """proj:       3
+zone:       0
+north:      35:46:30N
+south:      35:45:50N
+east:       78:39:40W
+west:       78:40:20W
+cols:       40
+rows:       40
+e-w resol:  0:00:01
+n-s resol:  0:00:01
+format:     -1
+compressed: 0
+"""
+
+
+@pytest.fixture
+def latlon(monkeypatch, tmp_path):
+    """Raster header of latitude-longitude location,
+    r.info values in decimal degrees"""
+    path = tmp_path / "cellhd"
+    path.write_text(LATLON_CELLHD)
+    monkeypatch.setattr(
+        tangible_utils, "find_map_file", lambda name, element: str(path)
+    )
+    monkeypatch.setattr(
+        tangible_utils.gscript,
+        "raster_info",
+        lambda name: {
+            "north": 35.775,
+            "south": 35.7638888889,
+            "east": -78.6611111111,
+            "west": -78.6722222222,
+            "ewres": 1 / 3600.0,
+            "nsres": 1 / 3600.0,
+        },
+    )
+
+
+def test_read_raster_header_latlon(latlon):
+    header = tangible_utils.read_raster_header("scantmp")
+    assert header["proj"] == "3"
+    assert header["north"] == 35.775 and header["west"] == -78.6722222222
+    assert header["n-s resol"] == 1 / 3600.0
+    assert header["rows"] == header["cols"] == 40
+    region = tangible_utils.parse_region(tangible_utils.region_from_header(header))
+    assert region["proj"] == "3" and region["east"] == -78.6611111111
+
+
+def test_import_scan_latlon(latlon, monkeypatch):
+    # extent in degrees is larger than range of values (see import_scan)
+    model = 100 + 0.0001 * np.mgrid[0:40, 0:40][1]
+    monkeypatch.setattr(
+        scan_pipeline, "read_raster_array", lambda name, env=None, cache=True: model
+    )
+    monkeypatch.setattr(scan_pipeline, "cache_raster_array", lambda *a, **k: None)
+    monkeypatch.setattr(
+        scan_pipeline.grass_session, "run_command", lambda *a, **k: None
+    )
+    scanFilter = {"filter": False, "threshold": 0, "debug": False, "counter": 0}
+    frame = scan_pipeline.ScanPipeline().import_scan("scan", scanFilter)
+    assert frame is not None
+    assert frame.header["south"] == 35.7638888889
+    assert "proj: 3;" in frame.region
+
+
+ANALYSES = """
+import os
+
+with open(os.path.join(os.path.dirname(__file__), "loads"), "a") as f:
+    f.write("x")
+
+VALUE = {value}
+
+
+def run_b(**kwargs):
+    pass
+
+
+def run_a(**kwargs):
+    pass
+
+
+def other(**kwargs):
+    pass
+"""
+
+
+def test_load_analyses_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(tangible_utils, "_analyses_cache", {})
+    path = tmp_path / "analyses.py"
+    loads = tmp_path / "loads"
+    path.write_text(ANALYSES.format(value=1))
+    first = tangible_utils.load_analyses(str(path))
+    assert first.module.VALUE == 1
+    assert first.functions("run_") == ["run_a", "run_b"]
+    assert tangible_utils.load_analyses(str(path)) is first
+    # saved again without change
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 10**9))
+    assert tangible_utils.load_analyses(str(path)) is first
+    assert first.mtime == os.path.getmtime(path)
+    assert loads.read_text() == "x"
+    # changed
+    path.write_text(ANALYSES.format(value=2))
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 2 * 10**9))
+    second = tangible_utils.load_analyses(str(path))
+    assert second is not first
+    assert second.module.VALUE == 2
+    assert loads.read_text() == "xx"
+
+
+def analyses_module(calls, cancel=None):
+    """AnalysesModule with run_ functions recording their calls,
+    run_b fails and run_c sets cancel"""
+    module = types.ModuleType("analyses")
+
+    def function(name, error=False):
+        def run(**kwargs):
+            calls.append((name, kwargs))
+            if error:
+                raise RuntimeError(name)
+            if cancel and name == "run_c":
+                cancel.set()
+
+        return run
+
+    module.run_d = function("run_d")
+    module.run_c = function("run_c")
+    module.run_b = function("run_b", error=True)
+    module.run_a = function("run_a")
+    module.run_command = function("run_command")
+    module.run_value = 1
+    module.post_a = function("post_a")
+    return tangible_utils.AnalysesModule(module, 0, "")
+
+
+def test_callables():
+    analyses = analyses_module([])
+    assert analyses.functions("run_") == ["run_a", "run_b", "run_c", "run_d"]
+    assert analyses.functions("post_") == ["post_a"]
+    # resolved once per loaded module
+    analyses.module.run_e = analyses.module.run_a
+    assert analyses.functions("run_") == ["run_a", "run_b", "run_c", "run_d"]
+
+
+def test_dispatch(capsys):
+    calls = []
+    analyses = analyses_module(calls)
+    analyses.dispatch("run_", scanned_elev="scan", env={})
+    assert calls == [
+        (name, {"scanned_elev": "scan", "env": {}})
+        for name in ("run_a", "run_b", "run_c", "run_d")
+    ]
+    assert "RuntimeError: run_b" in capsys.readouterr().err
+    assert sorted(analyses.timings) == ["run_a", "run_b", "run_c", "run_d"]
+
+
+def test_dispatch_cancel():
+    calls = []
+    cancel = threading.Event()
+    analyses = analyses_module(calls, cancel)
+    analyses.dispatch("run_", cancel=cancel)
+    assert [name for name, kwargs in calls] == ["run_a", "run_b", "run_c"]
+
+
+CELLHD = """proj:       99
+zone:       0
+north:      {north}
+south:      0
+east:       40
+west:       0
+cols:       40
+rows:       40
+e-w resol:  1
+n-s resol:  1
+"""
+
+
+@pytest.fixture
+def mapset(monkeypatch, tmp_path):
+    """Current mapset with WIND, raster dem and vector roads,
+    returns its path and list of g.region calls"""
+    mapset = tmp_path / "loc" / "user"
+    (mapset / "cellhd").mkdir(parents=True)
+    (mapset / "cellhd" / "dem").write_text(CELLHD.format(north=40))
+    (mapset / "vector" / "roads").mkdir(parents=True)
+    (mapset / "vector" / "roads" / "topo").write_text("topo")
+    (mapset / "WIND").write_text("wind")
+    gisrc = tmp_path / "gisrc"
+    gisrc.write_text(
+        "GISDBASE: {}\nLOCATION_NAME: loc\nMAPSET: user\n".format(tmp_path)
+    )
+    monkeypatch.setenv("GISRC", str(gisrc))
+    monkeypatch.delenv("GRASS_REGION", raising=False)
+    monkeypatch.setattr(tangible_utils, "_region_cache", {})
+    calls = []
+
+    def region_env(region3d=False, **kwargs):
+        calls.append(kwargs)
+        return "region {};".format(len(calls))
+
+    monkeypatch.setattr(tangible_utils.gscript, "region_env", region_env)
+    return mapset, calls
+
+
+def touch(path, content):
+    """Rewrites file, makes sure modification time changes"""
+    mtime = path.stat().st_mtime_ns
+    path.write_text(content)
+    os.utime(path, ns=(0, mtime + 10**9))
+
+
+def test_region_of_raster_header(mapset, monkeypatch):
+    mapset, calls = mapset
+    env = tangible_utils.get_environment(raster="dem")
+    region = tangible_utils.parse_region(env["GRASS_REGION"])
+    assert region["north"] == 40 and region["rows"] == 40
+    assert not calls
+    monkeypatch.setattr(tangible_utils, "read_raster_header", None)
+    other = tangible_utils.get_environment(raster="dem")
+    assert other == env and other is not env
+
+
+def test_region_cache_stamps(mapset, monkeypatch):
+    mapset, calls = mapset
+    headers = []
+    read_raster_header = tangible_utils.read_raster_header
+    monkeypatch.setattr(
+        tangible_utils,
+        "read_raster_header",
+        lambda name: headers.append(name) or read_raster_header(name),
+    )
+    tangible_utils.get_environment(raster="dem")
+    tangible_utils.get_environment(raster="dem")
+    assert headers == ["dem"]
+    # raster changed
+    touch(mapset / "cellhd" / "dem", CELLHD.format(north=30))
+    env = tangible_utils.get_environment(raster="dem")
+    assert tangible_utils.parse_region(env["GRASS_REGION"])["north"] == 30
+    assert headers == ["dem", "dem"]
+    # current region changed
+    touch(mapset / "WIND", "changed")
+    tangible_utils.get_environment(raster="dem")
+    assert headers == ["dem", "dem", "dem"]
+    # vector
+    assert tangible_utils.get_environment(vector="roads")["GRASS_REGION"] == "region 1;"
+    assert tangible_utils.get_environment(vector="roads")["GRASS_REGION"] == "region 1;"
+    touch(mapset / "vector" / "roads" / "topo", "changed")
+    assert tangible_utils.get_environment(vector="roads")["GRASS_REGION"] == "region 2;"
+    assert calls == [{"vector": "roads"}] * 2
+
+
+def test_region_cache_not_found_and_override(mapset, monkeypatch):
+    mapset, calls = mapset
+    tangible_utils.get_environment(raster="missing")
+    tangible_utils.get_environment(raster="missing")
+    assert len(calls) == 2
+    tangible_utils.get_environment(res=2)
+    tangible_utils.get_environment(res=2)
+    monkeypatch.setenv("GRASS_REGION", "other")
+    tangible_utils.get_environment(res=2)
+    assert calls[2:] == [{"res": 2}] * 2
@@ -0,0 +1,50 @@
+import time
+
+import numpy as np
+import pytest
+
+import TSP
+
+
+def distance_matrix(count, seed=0):
+    points = np.random.default_rng(seed).random((count, 2))
+    return np.hypot(*(points[:, np.newaxis] - points[np.newaxis]).T)
+
+
+def length(distances, path, closed=False):
+    total = sum(distances[a, b] for a, b in zip(path[:-1], path[1:]))
+    if closed:
+        total += distances[path[-1], path[0]]
+    return total
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 4, 10, 57])
+@pytest.mark.parametrize("closed", [False, True])
+def test_path_visits_all_vertices(count, closed):
+    path = TSP.solve_tsp_numpy(distance_matrix(count), or_opt=True, closed=closed)
+    assert sorted(path) == list(range(count))
+
+
+def test_optimization_improves_greedy_path():
+    distances = distance_matrix(200)
+    greedy = TSP.greedy_path_np(distances)
+    path = TSP.solve_tsp_numpy(distances, optim_steps=20, or_opt=True)
+    assert (path[0], path[-1]) == (greedy[0], greedy[-1])
+    assert length(distances, path) < length(distances, greedy)
+    assert length(distances, path) <= length(distances, TSP.solve_tsp(distances))
+
+
+def test_time_budget_includes_greedy_solution():
+    distances = distance_matrix(800)
+    start = time.perf_counter()
+    path = TSP.solve_tsp_numpy(distances, optim_steps=100, or_opt=True, time_budget=0.1)
+    assert time.perf_counter() - start < 0.1 + 0.05
+    assert sorted(path) == list(range(800))
+
+
+def test_pairs_sorted_by_distance():
+    distances = distance_matrix(30)
+    pairs = TSP.pairs_by_dist_np(30, distances)
+    assert len(pairs) == 30 * 29 // 2
+    values = [distances[i, j] for i, j in pairs]
+    assert values == sorted(values)